@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""Asyncio transport for the iGEM Wiki manager, using aiohttp
+
+Requires Python 3 and aiohttp (pip install aiohttp).
+
+Copyright under MIT License, see LICENSE.
+"""
+
+from igem_manager import IGemMultipartEncoder, IGemTransport, IGemTransportError, IGemResponse
+from http.cookies import SimpleCookie
+import asyncio
+import threading
+
+try:
+    import aiohttp
+    from yarl import URL
+except ImportError:
+    aiohttp = None
+
+__author__ = "Joeri Jongbloets <joeri@jongbloets.net>"
+
+
+class IGemAsyncioTransport(IGemTransport):
+    """Sends requests with aiohttp on an event loop, so many requests can be in flight at once
+
+    The event loop runs in a background thread, requests can be send from any thread and
+    request_many sends all its requests concurrently without extra worker threads.
+    """
+
+    def __init__(self, pool_size=IGemTransport.POOL_SIZE, keep_alive=True, timeout=None, parent=None):
+        if aiohttp is None:
+            raise ImportError("The asyncio transport requires aiohttp: pip install aiohttp")
+        super(IGemAsyncioTransport, self).__init__(pool_size=pool_size, keep_alive=keep_alive, timeout=timeout)
+        # a forked transport runs on the loop and uses the connections of the transport it was forked from
+        self._parent = parent
+        if parent is None:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="IGemAsyncioTransport")
+            self._thread.daemon = True
+            self._thread.start()
+        else:
+            self._loop = parent._loop
+            self._thread = parent._thread
+        self._session = self._run(self._create_session())
+
+    @property
+    def session(self):
+        return self._session
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _create_session(self):
+        if self._parent is not None:
+            connector = self._parent.session.connector
+        else:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size, limit_per_host=self.pool_size, force_close=not self.keep_alive
+            )
+        return aiohttp.ClientSession(
+            connector=connector,
+            connector_owner=self._parent is None,
+            # also keep the cookies of hosts given by IP (e.g. a local test server)
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    @staticmethod
+    def _to_text(values):
+        if values is None:
+            return None
+        return dict((k, str(v)) for k, v in values.items() if v is not None)
+
+    @staticmethod
+    async def _stream(encoder):
+        # files are read in the executor, so reading them does not block the other requests
+        loop = asyncio.get_event_loop()
+        blocks = iter(encoder)
+        try:
+            while True:
+                block = await loop.run_in_executor(None, next, blocks, None)
+                if block is None:
+                    break
+                yield block
+        finally:
+            blocks.close()
+
+    async def _request(self, method, url, params=None, data=None, files=None, headers=None):
+        if files:
+            # stream the multipart body, files are read while they are send
+            encoder = IGemMultipartEncoder(data, files)
+            headers = dict(headers or {}, **{"Content-Type": encoder.content_type, "Content-Length": str(len(encoder))})
+            data = self._stream(encoder)
+        elif isinstance(data, dict):
+            data = self._to_text(data)
+        try:
+            async with self._session.request(
+                    method, url, params=self._to_text(params), data=data, headers=headers
+            ) as response:
+                content = await response.read()
+                return IGemResponse(response.status, str(response.url), dict(response.headers), content)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise IGemTransportError(str(e) or e.__class__.__name__)
+
+    async def _request_many(self, calls):
+        results = await asyncio.gather(
+            *[self._request(method, url, **kwargs) for method, url, kwargs in calls], return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, IGemTransportError):
+                raise result
+        return results
+
+    async def _download(self, url, location, block_size):
+        try:
+            async with self._session.get(url) as response:
+                if response.status == 200:
+                    with open(location, "wb") as dst:
+                        async for block in response.content.iter_chunked(block_size):
+                            dst.write(block)
+                return IGemResponse(response.status, str(response.url), dict(response.headers), b"")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise IGemTransportError(str(e) or e.__class__.__name__)
+
+    def download(self, url, location, block_size=64 * 1024):
+        return self._run(self._download(url, location, block_size))
+
+    def request(self, method, url, params=None, data=None, files=None, headers=None):
+        return self._run(self._request(method, url, params=params, data=data, files=files, headers=headers))
+
+    def request_many(self, calls):
+        return self._run(self._request_many(list(calls)))
+
+    async def _get_cookies(self):
+        return [
+            {"name": morsel.key, "value": morsel.value, "domain": morsel["domain"], "path": morsel["path"] or "/",
+             "secure": bool(morsel["secure"])}
+            for morsel in self._session.cookie_jar
+        ]
+
+    async def _set_cookies(self, cookies):
+        for c in cookies:
+            cookie = SimpleCookie()
+            cookie[c.get("name")] = c.get("value")
+            morsel = cookie[c.get("name")]
+            morsel["domain"] = c.get("domain", "")
+            morsel["path"] = c.get("path", "/")
+            if c.get("secure"):
+                morsel["secure"] = True
+            self._session.cookie_jar.update_cookies(cookie, response_url=URL("http://{}/".format(
+                c.get("domain", "").lstrip(".") or "localhost"
+            )))
+
+    def get_cookies(self):
+        # the cookie jar is not thread safe, only touch it from the loop
+        return self._run(self._get_cookies())
+
+    def set_cookies(self, cookies):
+        self._run(self._set_cookies(cookies))
+
+    def fork(self):
+        return IGemAsyncioTransport(
+            pool_size=self.pool_size, keep_alive=self.keep_alive, timeout=self.timeout, parent=self
+        )
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        self._run(self._session.close())
+        if self._parent is not None:
+            # the loop and connections belong to the parent
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+"""Uploads the wikis of several teams and editions at once, in one process
+
+Every ini file given is one job, or when it has sections named `igem:<name>`, every such section is a
+job (with the settings of its `[igem]` section as defaults):
+
+    [igem]
+    username: <igem username>
+    password: <igem password>
+    strip: 1
+
+    [igem:team-a]
+    team: TeamA
+    year: 2017
+    files: ./team-a/build/*
+
+    [igem:team-b-2018]
+    team: TeamB
+    year: 2018
+    files: ./team-b/build/*, ./shared/*
+
+Run it with:
+
+    igem_batch.py --parallel 4 -j 4 upload teams.ini other-team.ini
+
+All jobs share one connection pool, jobs with the same username on the same wiki (the wiki of their
+year, unless `api_url` is set) share one login and the content hashes of files used by more than one job are only
+calculated once. A summary of all jobs is printed at the end.
+
+Copyright under MIT License, see LICENSE.
+"""
+
+from __future__ import print_function
+from igem_manager import BaseIGemWikiManager, IGemDigestCache, IGemStreamHandler
+from igem_upload import IGemUploader
+import logging
+import os
+import sys
+import threading
+import time
+
+__author__ = "Joeri Jongbloets <joeri@jongbloets.net>"
+
+
+class IGemBatchStream(object):
+    """Prefixes every line printed by a job with the name of the job"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def prefix(self):
+        """Name of the job running in this thread, None if none"""
+        return getattr(self._local, "prefix", None)
+
+    def set_prefix(self, prefix):
+        self.finish()
+        self._local.prefix = prefix
+        self._local.line = ""
+
+    def finish(self):
+        """Writes what is left of the last line of the job running in this thread"""
+        line = getattr(self._local, "line", "")
+        if line != "":
+            self._local.line = ""
+            with self._lock:
+                self._stream.write("[{}] {}\n".format(self.prefix, line))
+
+    def write(self, text):
+        prefix = getattr(self._local, "prefix", None)
+        if prefix is None:
+            with self._lock:
+                self._stream.write(text)
+            return
+        # only write complete lines, so lines of jobs are not mixed
+        lines = (self._local.line + text).split("\n")
+        self._local.line = lines.pop()
+        if len(lines) > 0:
+            with self._lock:
+                self._stream.write("".join("[{}] {}\n".format(prefix, line) for line in lines))
+
+    def flush(self):
+        self._stream.flush()
+
+
+class IGemBatchLogFilter(logging.Filter):
+    """Prefixes the log messages of a job with the name of the job"""
+
+    def __init__(self, stream):
+        super(IGemBatchLogFilter, self).__init__()
+        self._stream = stream
+
+    def filter(self, record):
+        prefix = self._stream.prefix
+        if prefix is not None:
+            record.msg = "[{}] {}".format(prefix, record.getMessage())
+            record.args = None
+        return True
+
+
+class IGemBatchUploader(IGemUploader):
+    """Uploader of a batch job, its worker threads print and log with the name of the job"""
+
+    name = None
+    stream = None
+
+    def map_jobs(self, func, items):
+        def run(item):
+            if self.stream is None or self.stream.prefix == self.name:
+                return func(item)
+            self.stream.set_prefix(self.name)
+            try:
+                return func(item)
+            finally:
+                self.stream.set_prefix(None)
+        return super(IGemBatchUploader, self).map_jobs(run, items)
+
+
+class IGemBatchJob(object):
+    """One run of the uploader for a team and year"""
+
+    def __init__(self, name, settings):
+        self._name = name
+        self._settings = settings
+        self._manager = None
+        self._seconds = 0.0
+        self._error = None
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def settings(self):
+        return self._settings
+
+    @property
+    def manager(self):
+        """The uploader of the job, created by setup
+
+        :rtype: IGemUploader
+        """
+        return self._manager
+
+    @property
+    def seconds(self):
+        return self._seconds
+
+    @property
+    def error(self):
+        """Why the job failed, None when it did not"""
+        return self._error
+
+    @error.setter
+    def error(self, error):
+        self._error = error
+
+    def setup(self, digest_cache, stream=None):
+        settings = dict(self.settings)
+        files = settings.get("files") or ""
+        if not isinstance(files, (tuple, list)):
+            files = [f.strip() for f in files.split(",") if f.strip() != ""]
+        settings["files"] = files
+        # all jobs use the transport of the batch
+        settings["transport"] = None
+        self._manager = IGemBatchUploader(team=settings.get("team"), year=settings.get("year"))
+        self._manager.name = self.name
+        self._manager.stream = stream
+        self._manager.parse_arguments(settings)
+        self._manager.digest_cache = digest_cache
+        return self._manager
+
+    def run(self, action):
+        start = time.time()
+        try:
+            self.manager.execute(action)
+        except Exception as e:
+            self.manager.get_logger().exception("Job {} failed".format(self.name))
+            self.error = str(e) or e.__class__.__name__
+        finally:
+            self._seconds = time.time() - start
+            self.manager.save_report()
+            if self.manager.title_index is not None and not self.manager.runs_dry():
+                self.manager.title_index.save()
+        return self
+
+    def summary(self):
+        manager = self.manager
+        # files that are still collected were not uploaded (or skipped)
+        failed = len(manager.collected_files)
+        return {
+            "job": self.name, "team": str(manager.team).replace("Team:", ""), "year": manager.year,
+            "files": len(manager.uploaded_files) + failed, "uploaded": len(manager.uploaded_files) -
+            len(manager.skipped_files), "skipped": len(manager.skipped_files), "failed": failed,
+            "seconds": self.seconds, "requests": manager.metrics.requests, "sent": manager.metrics.bytes_sent,
+            "received": manager.metrics.bytes_received, "waited": manager.throttle.waited,
+            "error": self.error or "",
+        }
+
+
+def load_jobs(locations, arguments=None):
+    """Creates a job for every ini file, or for every `igem:<name>` section in it
+
+    :param arguments: Settings that override those of the ini files
+    :rtype: list[IGemBatchJob]
+    """
+    results = []
+    for location in locations:
+        sections = BaseIGemWikiManager.load_ini_sections(location)
+        if len(sections) == 0:
+            print("Cannot find any settings in {}".format(location))
+        defaults = dict(dict(sections).get("igem", []))
+        named = [(section, items) for section, items in sections if section.startswith("igem:")]
+        if len(named) == 0:
+            named = [(os.path.splitext(os.path.basename(location))[0], [])]
+        for section, items in named:
+            settings = dict(defaults)
+            settings.update(dict(items))
+            settings.update(dict((k, v) for k, v in (arguments or {}).items() if v is not None))
+            results.append(IGemBatchJob(section.replace("igem:", "", 1), settings))
+    return results
+
+
+def login_jobs(jobs, session):
+    """Logs in once per username and wiki, the other jobs of that user on that wiki continue its login
+
+    All transports share the connections of the session.
+
+    :type session: BaseIGemWikiManager
+    """
+    logins = {}
+    for job in jobs:
+        manager = job.manager
+        key = (manager.username, manager.login_url, manager.api_url)
+        other = logins.get(key)
+        if other is not None and manager.adopt_login(other):
+            continue
+        manager.share_connections(session)
+        if manager.login():
+            logins.setdefault(key, manager)
+        else:
+            job.error = "Cannot login as {}".format(manager.username)
+
+
+def run_batch(jobs, action="upload", parallel=4, transport=None):
+    """Runs the jobs, up to parallel at a time, over one connection pool
+
+    :type jobs: list[IGemBatchJob]
+    """
+    from multiprocessing.pool import ThreadPool
+    digest_cache = IGemDigestCache()
+    stream = IGemBatchStream(sys.stdout)
+    for job in jobs:
+        job.setup(digest_cache, stream=stream)
+    # holds the connection pool shared by all jobs
+    session = BaseIGemWikiManager()
+    session.use_transport(transport, pool_size=max(sum(job.manager.jobs for job in jobs), 10))
+    stdout, sys.stdout = sys.stdout, stream
+    log_filter = IGemBatchLogFilter(stream)
+    handlers = list(logging.getLogger().handlers)
+    for handler in handlers:
+        handler.addFilter(log_filter)
+    pool = ThreadPool(max(1, min(parallel, len(jobs))))
+
+    def run(job):
+        stream.set_prefix(job.name)
+        try:
+            if job.error is not None:
+                return job
+            return job.run(action)
+        finally:
+            stream.set_prefix(None)
+
+    try:
+        login_jobs(jobs, session)
+        pool.map(run, jobs)
+    finally:
+        pool.close()
+        pool.join()
+        sys.stdout = stdout
+        for handler in handlers:
+            handler.removeFilter(log_filter)
+        # jobs of the same user share a transport, so only close them when all jobs are done
+        for job in jobs:
+            job.manager.close()
+        session.close()
+    return jobs
+
+
+def print_summary(jobs):
+    results = [job.summary() for job in jobs]
+    line = "{job:<20} {team:<16} {year:>5} {files:>6} {uploaded:>8} {skipped:>8} {failed:>6} {seconds:>8} " \
+           "{requests:>8} {sent:>12} {received:>12} {waited:>7}  {error}"
+    print(line.format(
+        job="job", team="team", year="year", files="files", uploaded="uploaded", skipped="skipped",
+        failed="failed", seconds="seconds", requests="requests", sent="bytes sent", received="received",
+        waited="waited", error=""
+    ))
+    for result in results:
+        print(line.format(**dict(result, seconds="{:.1f}".format(result["seconds"]),
+                                 waited="{:.1f}".format(result["waited"]))))
+    totals = dict(job="total", team="", year="", error="")
+    for key in ("files", "uploaded", "skipped", "failed", "requests", "sent", "received"):
+        totals[key] = sum(result[key] for result in results)
+    # the jobs ran at the same time, so the total time is that of the longest
+    totals["seconds"] = "{:.1f}".format(max([result["seconds"] for result in results] or [0]))
+    totals["waited"] = "{:.1f}".format(sum(result["waited"] for result in results))
+    print(line.format(**totals))
+
+
+def create_parser():
+    import argparse
+    parser = argparse.ArgumentParser(description="Upload the wikis of several teams and editions at once")
+    parser.add_argument('action', choices=("upload",), help="What should be done for every job?")
+    parser.add_argument('ini', nargs="+", help="Ini files with the settings (and files) of the jobs")
+    parser.add_argument('--parallel', type=int, default=4, help="Number of jobs to run at the same time")
+    parser.add_argument(
+        '-j', '--jobs', dest="jobs", type=int, help="Number of requests each job sends in parallel"
+    )
+    parser.add_argument('--transport', choices=("requests", "asyncio"), help="Transport shared by all jobs")
+    parser.add_argument('--force', action="store_true", default=None, help="Upload all files of all jobs")
+    parser.add_argument('--dry', action="store_true", default=None, help="Only show what would be done")
+    parser.add_argument('-v', dest="verbose", action="count", help="Print log messages to the console")
+    return parser
+
+
+def main(argv):
+    arguments = vars(create_parser().parse_args(argv))
+    verbosity = arguments.pop("verbose")
+    if verbosity is not None and verbosity > 0:
+        level = max(0, 60 - (verbosity * 10))
+        logging.getLogger().setLevel(level)
+        logging.getLogger().addHandler(IGemStreamHandler(level=level))
+    action = arguments.pop("action")
+    locations = arguments.pop("ini")
+    parallel = arguments.pop("parallel")
+    jobs = load_jobs(locations, arguments)
+    if len(jobs) == 0:
+        return 1
+    run_batch(jobs, action=action, parallel=parallel, transport=arguments.get("transport"))
+    print_summary(jobs)
+    return 1 if any(job.error is not None for job in jobs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+"""Measures the upload throughput of igem_upload.py against the local mock wiki
+
+Generates synthetic sites (10, 1000 and 10000 files by default), uploads each of them with
+IGemUploader to an in-process IGemMockServer, then searches and deletes the pages again with
+IGemWikiManager. For every step it reports files/s, bytes/s and the p50/p99 request latency.
+
+Requires Python 3. Example:
+
+    python igem_benchmark.py --sizes 10,1000 --latency 0.05 --error-rate 0.01 -j 8
+
+Copyright under MIT License, see LICENSE.
+"""
+
+from igem_manager import IGemTransport, IGemWikiManager
+from igem_mock_server import IGemMockServer
+from igem_upload import IGemUploader
+import contextlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+__author__ = "Joeri Jongbloets <joeri@jongbloets.net>"
+
+
+class IGemTimings(object):
+    """Collects the latency of every request send through an IGemTimedTransport"""
+
+    def __init__(self):
+        self._latencies = []
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency, size):
+        with self._lock:
+            self._latencies.append(latency)
+            self._bytes += size
+
+    def reset(self):
+        with self._lock:
+            self._latencies = []
+            self._bytes = 0
+
+    @property
+    def requests(self):
+        return len(self._latencies)
+
+    @property
+    def bytes_received(self):
+        return self._bytes
+
+    def percentile(self, p):
+        """Latency (in seconds) below which p percent of the requests completed"""
+        with self._lock:
+            values = sorted(self._latencies)
+        if len(values) == 0:
+            return 0.0
+        index = int(round((len(values) - 1) * p / 100.0))
+        return values[index]
+
+
+class IGemTimedTransport(IGemTransport):
+    """Wraps another transport and records how long each request took"""
+
+    def __init__(self, transport, timings):
+        super(IGemTimedTransport, self).__init__(
+            pool_size=transport.pool_size, keep_alive=transport.keep_alive, timeout=transport.timeout
+        )
+        self._transport = transport
+        self._timings = timings
+
+    def request(self, method, url, params=None, data=None, files=None, headers=None):
+        start = time.time()
+        result = self._transport.request(method, url, params=params, data=data, files=files, headers=headers)
+        self._timings.record(time.time() - start, len(result.content or b""))
+        return result
+
+    def request_many(self, calls):
+        # the calls are in flight together, each of them waited for the whole batch
+        calls = list(calls)
+        start = time.time()
+        results = self._transport.request_many(calls)
+        elapsed = time.time() - start
+        for result in results:
+            size = 0 if isinstance(result, Exception) else len(result.content or b"")
+            self._timings.record(elapsed, size)
+        return results
+
+    def download(self, url, location, block_size=64 * 1024):
+        start = time.time()
+        result = self._transport.download(url, location, block_size=block_size)
+        self._timings.record(time.time() - start, os.path.getsize(location) if os.path.exists(location) else 0)
+        return result
+
+    def fork(self):
+        return IGemTimedTransport(self._transport.fork(), self._timings)
+
+    def get_cookies(self):
+        return self._transport.get_cookies()
+
+    def set_cookies(self, cookies):
+        self._transport.set_cookies(cookies)
+
+    def close(self):
+        self._transport.close()
+
+
+class IGemTimedMixin(object):
+    """Sends all requests of a manager through an IGemTimedTransport"""
+
+    timings = None
+
+    def create_transport(self):
+        transport = super(IGemTimedMixin, self).create_transport()
+        return IGemTimedTransport(transport, self.timings)
+
+
+class IGemTimedUploader(IGemTimedMixin, IGemUploader):
+    pass
+
+
+class IGemTimedWikiManager(IGemTimedMixin, IGemWikiManager):
+    pass
+
+
+def generate_site(location, size, large=0):
+    """Writes a synthetic site of size files: half html pages, the rest stylesheets, scripts and images
+
+    :param large: Size in bytes of one extra file, to exercise chunked uploads (0 for none)
+    """
+    rng = random.Random(size)
+    counts = {
+        "css": max(1, size // 10), "js": max(1, size // 10),
+    }
+    counts["png"] = max(1, (size * 3) // 10)
+    counts["html"] = max(1, size - sum(counts.values()))
+    for folder in ("css", "js", "img"):
+        os.makedirs(os.path.join(location, "assets", folder))
+    for idx in range(counts["css"]):
+        with open(os.path.join(location, "assets", "css", "style{}.css".format(idx)), "w") as dest:
+            dest.write("body {{ margin: {}px; }}\n".format(idx))
+            dest.write(".logo {{ background: url('../img/image{}.png'); }}\n".format(idx % counts["png"]))
+    for idx in range(counts["js"]):
+        with open(os.path.join(location, "assets", "js", "script{}.js".format(idx)), "w") as dest:
+            dest.write("var counter{0} = {0};\nfunction f{0}() {{ return counter{0} + 1; }}\n".format(idx))
+    for idx in range(counts["png"]):
+        with open(os.path.join(location, "assets", "img", "image{}.png".format(idx)), "wb") as dest:
+            dest.write(bytearray(rng.getrandbits(8) for _ in range(rng.randint(2048, 20480))))
+    if large > 0:
+        with open(os.path.join(location, "assets", "img", "large.bin"), "wb") as dest:
+            dest.write(os.urandom(large))
+    for idx in range(counts["html"]):
+        with open(os.path.join(location, "page{}.html".format(idx)), "w") as dest:
+            dest.write(
+                "<html><head>"
+                "<link rel=\"stylesheet\" href=\"assets/css/style{css}.css\">"
+                "<script src=\"assets/js/script{js}.js\"></script>"
+                "</head><body><h1>Page {idx}</h1>"
+                "<img src=\"assets/img/image{png}.png\">"
+                "<a href=\"page{next}.html\">next</a>"
+                "<p>{text}</p></body></html>\n".format(
+                    idx=idx, css=idx % counts["css"], js=idx % counts["js"], png=idx % counts["png"],
+                    next=(idx + 1) % counts["html"], text="Lorem ipsum dolor sit amet. " * rng.randint(5, 50)
+                )
+            )
+    return sum(counts.values()) + (1 if large > 0 else 0)
+
+
+def site_bytes(location):
+    result = 0
+    for root, folders, files in os.walk(location):
+        result += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return result
+
+
+def run_step(name, cls, server, arguments, timings, files, size):
+    """Runs one action of cls against the server and returns its statistics
+
+    :param size: Number of bytes the action transfers, None to count the bytes of the responses
+    """
+    timings.reset()
+    settings = {
+        "team": "Benchmark", "year": "2017", "username": "test", "password": "test", "quiet": True,
+        "api_url": server.api_url, "login_url": server.login_url,
+    }
+    settings.update(arguments)
+    manager = cls(team=settings["team"], year=settings["year"])
+    manager.timings = timings
+    manager.parse_arguments(settings)
+    start = time.time()
+    try:
+        # the scripts print their progress, we only want the numbers
+        with contextlib.redirect_stdout(io.StringIO()):
+            manager.execute(settings["action"])
+    finally:
+        manager.close()
+    elapsed = max(time.time() - start, 1e-9)
+    if size is None:
+        # nothing was uploaded, so count what we downloaded
+        size = timings.bytes_received
+    return {
+        "step": name, "files": files, "seconds": elapsed, "files/s": files / elapsed, "bytes/s": size / elapsed,
+        "requests": timings.requests, "p50": timings.percentile(50), "p99": timings.percentile(99),
+        "retries": manager.throttle.retries,
+    }
+
+
+def run_benchmark(sizes, jobs=1, transport="requests", latency=0.0, error_rate=0.0, large=0):
+    server = IGemMockServer(("127.0.0.1", 0), users={"test": "test"}, latency=latency, error_rate=error_rate)
+    server.start()
+    timings = IGemTimings()
+    results = []
+    try:
+        for size in sizes:
+            location = tempfile.mkdtemp(prefix="igem_benchmark_")
+            try:
+                files = generate_site(location, size, large=large)
+                arguments = {"jobs": jobs, "transport": transport, "strip": True}
+                pattern = os.path.join(location, "*")
+                results.append(run_step(
+                    "upload", IGemTimedUploader, server, dict(arguments, action="upload", files=[pattern]),
+                    timings, files, site_bytes(location)
+                ))
+                results.append(run_step(
+                    "search", IGemTimedWikiManager, server, dict(arguments, action="search", files=[""]),
+                    timings, files, None
+                ))
+                results.append(run_step(
+                    "delete", IGemTimedWikiManager, server, dict(arguments, action="delete", files=[""]),
+                    timings, files, None
+                ))
+            finally:
+                shutil.rmtree(location)
+    finally:
+        server.stop()
+    return results
+
+
+def print_results(results):
+    print("{:>7} {:>7} {:>9} {:>10} {:>12} {:>9} {:>9} {:>9} {:>8}".format(
+        "step", "files", "seconds", "files/s", "bytes/s", "requests", "p50 ms", "p99 ms", "retries"
+    ))
+    for result in results:
+        print("{step:>7} {files:7d} {seconds:9.2f} {files/s:10.1f} {bytes/s:12.0f} {requests:9d} "
+              "{p50_ms:9.1f} {p99_ms:9.1f} {retries:8d}".format(
+                  p50_ms=result["p50"] * 1000, p99_ms=result["p99"] * 1000, **result
+              ))
+
+
+def create_parser():
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the iGEM Wiki scripts against a local mock wiki")
+    parser.add_argument('--sizes', default="10,1000,10000", help="Comma separated number of files per site")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="Number of requests to send in parallel")
+    parser.add_argument('--transport', choices=["requests", "asyncio"], default="requests",
+                        help="Transport used to send the requests")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds the server delays every request")
+    parser.add_argument('--error-rate', dest="error_rate", type=float, default=0.0,
+                        help="Fraction of API requests the server refuses with 503")
+    parser.add_argument('--large', type=int, default=0,
+                        help="Add one file of this many MB to each site, to exercise chunked uploads")
+    return parser
+
+
+if __name__ == "__main__":
+    arguments = create_parser().parse_args()
+    print_results(run_benchmark(
+        [int(size) for size in arguments.sizes.split(",")], jobs=arguments.jobs, transport=arguments.transport,
+        latency=arguments.latency, error_rate=arguments.error_rate, large=arguments.large * 1024 * 1024
+    ))
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+"""Keeps a logged in session to the iGEM Wiki open, to run many small commands without starting over
+
+Start the daemon once (it keeps running in the foreground):
+
+    igem_daemon.py serve --ini igem.ini
+
+and send it the commands of igem_upload.py and igem_manager.py:
+
+    igem_daemon.py upload "./build/*"
+    igem_daemon.py -j 8 delete "old/"
+    igem_daemon.py stop
+
+The client only forwards its arguments and working directory over a local socket and prints what the
+command prints, so it starts without loading the scripts. The daemon loads the ini file and logs in
+once and keeps its connections to the wiki open between commands. The manager of a command is kept
+(with its manifest, title index and caches) for the next command with the same options. Commands are
+run one at a time.
+
+Copyright under MIT License, see LICENSE.
+"""
+
+from __future__ import print_function
+import json
+import os
+import socket
+import sys
+
+__author__ = "Joeri Jongbloets <joeri@jongbloets.net>"
+
+# actions handled by igem_upload.py, other actions are handled by igem_manager.py
+UPLOAD_ACTIONS = ("upload", "plan")
+MANAGER_ACTIONS = ("search", "delete", "pull")
+# watch keeps running until it is interrupted, so it would block all other commands of the daemon
+BLOCKING_ACTIONS = ("watch",)
+DEFAULT_SOCKET = os.environ.get("IGEM_DAEMON_SOCKET", os.path.join(os.path.expanduser("~"), ".igem_daemon.sock"))
+# used when the system has no unix sockets (Windows)
+DEFAULT_PORT = 8765
+
+
+def get_address(location):
+    if hasattr(socket, "AF_UNIX"):
+        return socket.AF_UNIX, location
+    return socket.AF_INET, ("127.0.0.1", DEFAULT_PORT)
+
+
+class IGemDaemonStream(object):
+    """File-like object that forwards what a command prints (and reads) to the client"""
+
+    def __init__(self, connection, reader):
+        self._connection = connection
+        self._reader = reader
+
+    def send(self, message):
+        self._connection.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+    def write(self, text):
+        if len(text) > 0:
+            self.send({"output": text})
+
+    def flush(self):
+        pass
+
+    def readline(self):
+        # ask the client for a line of its input, e.g. to confirm a delete
+        self.send({"input": True})
+        return self._reader.readline().decode("utf-8")
+
+    def isatty(self):
+        return False
+
+
+class IGemDaemon(object):
+    """Runs the commands received over a local socket with a shared login session"""
+
+    def __init__(self, location=DEFAULT_SOCKET, arguments=None):
+        from igem_manager import BaseIGemWikiManager
+        if arguments is None:
+            arguments = {}
+        self._location = location
+        self._arguments = arguments
+        self._settings = {}
+        if arguments.get("ini") is not None:
+            self._settings = dict(BaseIGemWikiManager.load_ini(arguments["ini"]))
+        settings = dict(self._settings)
+        settings.update(dict((k, v) for k, v in arguments.items() if v is not None))
+        # the manager that holds the session shared by all commands
+        self._session = BaseIGemWikiManager(team=settings.get("team"), year=settings.get("year"))
+        self._session.parse_arguments(settings)
+        # managers of earlier commands, by class, ini file, working directory and options
+        self._managers = {}
+        self._server = None
+        self._running = False
+
+    @classmethod
+    def get_logger(cls):
+        import logging
+        return logging.getLogger(cls.__name__)
+
+    @property
+    def session(self):
+        return self._session
+
+    def start(self):
+        """Logs in and listens for commands until stopped"""
+        if not self.session.login():
+            self.get_logger().warning("Could not login, commands will login themselves")
+        family, address = get_address(self._location)
+        if family == getattr(socket, "AF_UNIX", None) and os.path.exists(address):
+            os.remove(address)
+        self._server = socket.socket(family, socket.SOCK_STREAM)
+        # only we may send commands, also before the permissions of the socket are set
+        umask = os.umask(0o077)
+        try:
+            self._server.bind(address)
+        finally:
+            os.umask(umask)
+        if family == getattr(socket, "AF_UNIX", None):
+            os.chmod(address, 0o600)
+        self._server.listen(5)
+        self._running = True
+        print("## Waiting for commands at {}".format(address))
+        try:
+            while self._running:
+                connection, _ = self._server.accept()
+                try:
+                    self.handle(connection)
+                except (socket.error, ValueError) as e:
+                    # the client went away or did not send a valid request
+                    self.get_logger().warning("Failed to handle a command: {}".format(e))
+                finally:
+                    connection.close()
+        finally:
+            self._server.close()
+            self.session.close()
+            if family == getattr(socket, "AF_UNIX", None) and os.path.exists(address):
+                os.remove(address)
+
+    def handle(self, connection):
+        reader = connection.makefile("rb")
+        stream = IGemDaemonStream(connection, reader)
+        request = json.loads(reader.readline().decode("utf-8"))
+        if request.get("stop"):
+            self._running = False
+            stream.send({"output": "## Daemon stopped\n"})
+            stream.send({"exit": 0})
+            return
+        code = self.execute(request.get("arguments", []), request.get("cwd"), stream)
+        stream.send({"exit": code})
+
+    def execute(self, argv, cwd, stream):
+        """Runs a command as igem_upload.py or igem_manager.py would, with the output send to the client"""
+        cwd_before = os.getcwd()
+        streams = sys.stdin, sys.stdout, sys.stderr
+        sys.stdin = sys.stdout = sys.stderr = stream
+        code = 0
+        try:
+            if cwd is not None:
+                os.chdir(cwd)
+            error = self.check_action(argv)
+            if error is not None:
+                print(error)
+                return 2
+            cls = self.get_manager_class(argv)
+            arguments = vars(cls.create_parser().parse_args(argv))
+            key = self.get_manager_key(cls, arguments)
+            self._managers[key] = cls.run_arguments(
+                arguments, settings=self.get_settings(arguments), session=self.session,
+                manager=self._managers.get(key)
+            )
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            self.get_logger().exception("Command {} failed".format(argv))
+            print("Command failed: {}".format(e))
+            code = 1
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = streams
+            os.chdir(cwd_before)
+        return code
+
+    @staticmethod
+    def get_manager_key(cls, arguments):
+        """Commands with the same key can reuse the same manager: only their action and files differ"""
+        options = tuple(sorted(
+            (k, str(v)) for k, v in arguments.items() if v is not None and k not in ("action", "files")
+        ))
+        return cls, os.getcwd(), options
+
+    def get_settings(self, arguments):
+        """Settings of the ini file of the daemon, or of the ini file given with the command"""
+        if arguments.get("ini") is None:
+            return self._settings
+        from igem_manager import BaseIGemWikiManager
+        return dict(BaseIGemWikiManager.load_ini(arguments["ini"]))
+
+    @staticmethod
+    def check_action(argv):
+        """Returns why the daemon cannot run the action of the command, None if it can"""
+        from igem_manager import IGemWikiManager
+        arguments, _ = IGemWikiManager.create_parser().parse_known_args(argv)
+        if arguments.action in BLOCKING_ACTIONS:
+            return "The daemon cannot {0}, it runs one command at a time: run igem_upload.py {0} instead".format(
+                arguments.action
+            )
+        if arguments.action not in UPLOAD_ACTIONS + MANAGER_ACTIONS:
+            return "Unknown action {}, the daemon runs: {}".format(
+                arguments.action, ", ".join(UPLOAD_ACTIONS + MANAGER_ACTIONS)
+            )
+        return None
+
+    @staticmethod
+    def get_manager_class(argv):
+        from igem_manager import IGemWikiManager
+        from igem_upload import IGemUploader
+        # both scripts take the action as first positional argument
+        arguments, _ = IGemWikiManager.create_parser().parse_known_args(argv)
+        if arguments.action in UPLOAD_ACTIONS:
+            return IGemUploader
+        return IGemWikiManager
+
+
+def send_command(request, location=DEFAULT_SOCKET):
+    """Sends a command to the daemon and prints its output, returns the exit code of the command"""
+    family, address = get_address(location)
+    connection = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        connection.connect(address)
+    except socket.error as e:
+        print("Cannot reach the daemon at {} ({}), start it with: igem_daemon.py serve".format(address, e))
+        return 1
+    code = 1
+    try:
+        reader = connection.makefile("rb")
+        connection.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        for line in reader:
+            message = json.loads(line.decode("utf-8"))
+            if "output" in message:
+                sys.stdout.write(message["output"])
+                sys.stdout.flush()
+            if message.get("input"):
+                connection.sendall(sys.stdin.readline().encode("utf-8"))
+            if "exit" in message:
+                code = message["exit"]
+                break
+    finally:
+        connection.close()
+    return code
+
+
+def serve(argv):
+    import argparse
+    from igem_manager import IGemStreamHandler
+    import logging
+    parser = argparse.ArgumentParser(description="Keeps a logged in session to the iGEM Wiki open")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help="Location of the socket to listen on")
+    parser.add_argument('--ini', help="Location of the ini file with the settings for all commands")
+    parser.add_argument('--team', help="The name of your iGEM Team")
+    parser.add_argument('--year', help="Wiki Edition you want to edit")
+    parser.add_argument('--username', '-U', dest="username", help="Username to login with on the iGEM wiki")
+    parser.add_argument('--password', '-p', dest="password", help="Password to login with on the iGEM wiki")
+    parser.add_argument('-v', dest="verbose", action="count", help="Print log messages to the console")
+    arguments = vars(parser.parse_args(argv))
+    verbosity = arguments.pop("verbose")
+    if verbosity is not None and verbosity > 0:
+        level = max(0, 60 - (verbosity * 10))
+        logging.getLogger().setLevel(level)
+        logging.getLogger().addHandler(IGemStreamHandler(level=level))
+    location = arguments.pop("socket")
+    IGemDaemon(location, arguments).start()
+
+
+def main(argv):
+    if len(argv) > 0 and argv[0] == "serve":
+        return serve(argv[1:])
+    if len(argv) > 0 and argv[0] == "stop":
+        return send_command({"stop": True})
+    return send_command({"arguments": argv, "cwd": os.getcwd()})
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
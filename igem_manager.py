@@ -9,16 +9,27 @@ Copyright under MIT License, see LICENSE.
 
 from __future__ import print_function
 from datetime import datetime as dt
-import requests
+import binascii
+import bisect
+import hashlib
+import heapq
+import io
+import json
 import logging
 import os
+import random
+import re
 import sys
+import threading
+import time
 
 if sys.version_info[0] < 3:
     input = raw_input
     import ConfigParser as configparser
+    string_types = (unicode, str)
 else:
     import configparser
+    string_types = (str,)
 
 __author__ = "Joeri Jongbloets <joeri@jongbloets.net>"
 
@@ -41,6 +52,905 @@ def ask_confirm(question, max_attempts=1):
     return result
 
 
+def sha1_digest(content):
+    """Returns the hexadecimal SHA1 digest of a (unicode) string"""
+    if not isinstance(content, bytes):
+        content = content.encode("utf-8")
+    return hashlib.sha1(content).hexdigest()
+
+
+def sha1_file(path, block_size=1024*1024):
+    """Returns the hexadecimal SHA1 digest of a file, without loading it in memory at once"""
+    result = hashlib.sha1()
+    with open(path, "rb") as src:
+        while True:
+            block = src.read(block_size)
+            if not block:
+                break
+            result.update(block)
+    return result.hexdigest()
+
+
+class IGemDigestCache(object):
+    """Remembers the SHA1 of files by their real path, size and modification time
+
+    Can be shared by managers that upload the same files, so every file is only read once.
+    """
+
+    def __init__(self):
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._digests)
+
+    def digest(self, path):
+        stat = os.stat(path)
+        key = (os.path.realpath(path), stat.st_size, stat.st_mtime)
+        with self._lock:
+            result = self._digests.get(key)
+        if result is None:
+            result = sha1_file(path)
+            with self._lock:
+                self._digests[key] = result
+        return result
+
+
+def batched(items, size):
+    """Splits items into lists of at most size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+class IGemStore(object):
+    """Simple key-value store that is kept on disk as a JSON file
+
+    Safe to use from multiple threads; changes are only written when save is called.
+    """
+
+    # permissions of the file (e.g. 0o600), None to use the defaults of the system
+    FILE_MODE = None
+
+    def __init__(self, location=None):
+        self._location = location
+        self._data = {}
+        self._changed = False
+        self._lock = threading.RLock()
+
+    @classmethod
+    def get_logger(cls):
+        return logging.getLogger(cls.__name__)
+
+    @property
+    def location(self):
+        return self._location
+
+    def load(self):
+        data = {}
+        if self.location is not None and os.path.exists(self.location):
+            try:
+                with open(self.location, "r") as src:
+                    data = json.load(src)
+            except (IOError, ValueError) as e:
+                self.get_logger().warning("Cannot load {}: {}".format(self.location, e))
+        if not isinstance(data, dict):
+            data = {}
+        with self._lock:
+            self._data = data
+            self._changed = False
+        return self
+
+    def save(self):
+        with self._lock:
+            if self.location is None or not self._changed:
+                return False
+            # write to a temporary file first, so we never leave a half written store behind
+            tmp = "{}.tmp".format(self.location)
+            if self.FILE_MODE is None:
+                dst = open(tmp, "w")
+            else:
+                dst = os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, self.FILE_MODE), "w")
+                os.chmod(tmp, self.FILE_MODE)
+            with dst:
+                json.dump(self._data, dst, indent=1, sort_keys=True)
+            getattr(os, "replace", os.rename)(tmp, self.location)
+            self._changed = False
+        return True
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._changed = True
+
+    def remove(self, key):
+        with self._lock:
+            if key in self._data:
+                del self._data[key]
+                self._changed = True
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class IGemUploadJournal(IGemStore):
+    """Keeps track of chunked uploads in progress, so an interrupted upload can be resumed
+
+    Entries are keyed by the title of the upload and only valid for the same (unchanged) source file.
+    """
+
+    # the wiki removes stashed chunks after some time, older entries are useless
+    MAX_AGE = 6 * 3600
+
+    def resume(self, page, source):
+        """Returns the filekey and confirmed offset of an earlier attempt to upload source to page
+
+        :rtype: dict[str, str | int]
+        """
+        result = {}
+        entry = self.get(page)
+        if isinstance(entry, dict) and entry.get("source") == os.path.abspath(source):
+            stat = os.stat(source)
+            is_same = entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime
+            if is_same and time.time() - entry.get("time", 0) < self.MAX_AGE:
+                result = {"filekey": entry.get("filekey"), "offset": entry.get("offset", 0)}
+        return result
+
+    def record(self, page, source, filekey, offset):
+        """Stores the filekey and offset confirmed by the server"""
+        stat = os.stat(source)
+        self.set(page, {
+            "source": os.path.abspath(source), "size": stat.st_size, "mtime": stat.st_mtime,
+            "filekey": filekey, "offset": offset, "time": time.time()
+        })
+        self.save()
+
+    def forget(self, page):
+        self.remove(page)
+        self.save()
+
+
+class IGemSessionCache(IGemStore):
+    """Keeps the cookies and edit token of a login, so the next run can continue the session
+
+    Only readable by the owner of the file, as the cookies give access to the account.
+    """
+
+    FILE_MODE = 0o600
+
+    @staticmethod
+    def key(username, api_url):
+        return "{}@{}".format(username, api_url)
+
+    def find(self, username, api_url):
+        """Returns the cookies and token saved for the user on the wiki, None if there are none
+
+        :rtype: dict | None
+        """
+        entry = self.get(self.key(username, api_url))
+        if not isinstance(entry, dict):
+            entry = None
+        return entry
+
+    def record(self, username, api_url, cookies, token):
+        self.set(self.key(username, api_url), {"cookies": cookies, "token": token, "time": time.time()})
+        self.save()
+
+    def forget(self, username, api_url):
+        self.remove(self.key(username, api_url))
+        self.save()
+
+
+class IGemTitleIndex(IGemStore):
+    """Local copy of the titles starting with a scope (e.g. Team:Name), with their page id and last change
+
+    The titles are also kept sorted in memory, so prefix queries are answered without asking the wiki.
+    The index remembers the time of the last change it has seen, so it can be brought up to date with
+    the recent changes of the wiki.
+    """
+
+    def __init__(self, location=None):
+        super(IGemTitleIndex, self).__init__(location)
+        self._titles = []
+
+    def load(self):
+        super(IGemTitleIndex, self).load()
+        with self._lock:
+            if not isinstance(self._data.get("pages"), dict):
+                self._data["pages"] = {}
+            self._titles = sorted(self._data["pages"].keys())
+        return self
+
+    @property
+    def scope(self):
+        return self.get("scope")
+
+    @property
+    def synced(self):
+        """Timestamp (as given by the wiki) of the last change included in the index, None if never synced"""
+        return self.get("synced")
+
+    def reset(self, scope):
+        """Removes all titles, to start over with a new scope"""
+        with self._lock:
+            self._data = {"scope": scope, "synced": None, "pages": {}}
+            self._titles = []
+            self._changed = True
+
+    def mark_synced(self, timestamp):
+        self.set("synced", timestamp)
+
+    def in_scope(self, title):
+        return self.scope is not None and title.startswith(self.scope)
+
+    def find(self, prefix):
+        """Returns the titles starting with prefix, sorted, together with their page id and last change
+
+        :rtype: list[(str, dict)]
+        """
+        results = []
+        with self._lock:
+            idx = bisect.bisect_left(self._titles, prefix)
+            while idx < len(self._titles) and self._titles[idx].startswith(prefix):
+                title = self._titles[idx]
+                results.append((title, dict(self._data["pages"][title])))
+                idx += 1
+        return results
+
+    def add(self, title, pageid=None, touched=None):
+        """Adds or updates a title, titles outside the scope are ignored"""
+        if not self.in_scope(title):
+            return
+        with self._lock:
+            pages = self._data.setdefault("pages", {})
+            if title not in pages:
+                bisect.insort(self._titles, title)
+            page = pages.setdefault(title, {})
+            if pageid is not None:
+                page["pageid"] = pageid
+            if touched is not None:
+                page["touched"] = touched
+            self._changed = True
+
+    def discard(self, title):
+        with self._lock:
+            pages = self._data.setdefault("pages", {})
+            if title in pages:
+                del pages[title]
+                self._titles.remove(title)
+                self._changed = True
+
+
+class IGemTransportError(IOError):
+    """Raised by transports when a request could not be send or no response was received"""
+    pass
+
+
+class IGemResponse(object):
+    """Response of a transport that does not use requests, with the parts of requests' response we use"""
+
+    def __init__(self, status_code, url, headers, content):
+        self.status_code = status_code
+        self.url = url
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", "replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def __repr__(self):
+        return "<IGemResponse [{}]>".format(self.status_code)
+
+
+class IGemFilePart(object):
+    """A range of bytes of a file, read only when it is send
+
+    :param length: Number of bytes from offset, None for the rest of the file
+    """
+
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, path, offset=0, length=None):
+        self._path = path
+        self._offset = offset
+        if length is None:
+            length = os.path.getsize(path) - offset
+        self._length = length
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def offset(self):
+        return self._offset
+
+    def __len__(self):
+        return self._length
+
+    def iter_blocks(self, block_size=BLOCK_SIZE):
+        """Yields the content in blocks of at most block_size bytes, the file is closed afterwards"""
+        remaining = self._length
+        with open(self._path, "rb") as src:
+            src.seek(self._offset)
+            while remaining > 0:
+                block = src.read(min(block_size, remaining))
+                if len(block) == 0:
+                    raise IOError("{} is shorter than expected".format(self._path))
+                remaining -= len(block)
+                yield block
+
+
+class IGemMultipartEncoder(object):
+    """Multipart form body that is generated while it is send
+
+    Files are read in blocks, so the memory used does not depend on their size. The body has a known
+    length (for the Content-Length header) and can be iterated again when a request is retried.
+
+    :param data: Dictionary of field name to value, None values are left out (like requests does)
+    :param files: Dictionary of field name to IGemFilePart, bytes, an open file or a tuple
+        (filename, content, mime type)
+    """
+
+    def __init__(self, data=None, files=None, boundary=None):
+        if boundary is None:
+            boundary = binascii.hexlify(os.urandom(16)).decode("ascii")
+        self._boundary = boundary
+        self._parts = []
+        for name, value in (data or {}).items():
+            if value is not None:
+                self._parts.append((self.format_header(name), self.to_bytes(value)))
+        for name, value in (files or {}).items():
+            filename, content_type = name, "application/octet-stream"
+            if isinstance(value, (tuple, list)):
+                filename = value[0]
+                if len(value) > 2:
+                    content_type = value[2]
+                value = value[1]
+            elif hasattr(value, "name"):
+                filename = os.path.basename(value.name)
+            if hasattr(value, "read"):
+                # an open file, send what is left of it
+                value = IGemFilePart(value.name, offset=value.tell())
+            elif not isinstance(value, IGemFilePart):
+                value = self.to_bytes(value)
+            self._parts.append((self.format_header(name, filename, content_type), value))
+        self._end = "--{}--\r\n".format(self._boundary).encode("ascii")
+
+    @property
+    def content_type(self):
+        return "multipart/form-data; boundary={}".format(self._boundary)
+
+    @staticmethod
+    def to_bytes(value):
+        if isinstance(value, bytes):
+            return value
+        return ("%s" % value).encode("utf-8")
+
+    def format_header(self, name, filename=None, content_type=None):
+        header = '--{}\r\nContent-Disposition: form-data; name="{}"'.format(self._boundary, name.replace('"', "%22"))
+        if filename is not None:
+            header += '; filename="{}"'.format(filename.replace('"', "%22"))
+        if content_type is not None:
+            header += "\r\nContent-Type: {}".format(content_type)
+        return self.to_bytes(header + "\r\n\r\n")
+
+    def __len__(self):
+        # every part is followed by a line break
+        return sum(len(header) + len(content) + 2 for header, content in self._parts) + len(self._end)
+
+    def __iter__(self):
+        for header, content in self._parts:
+            if isinstance(content, IGemFilePart):
+                yield header
+                for block in content.iter_blocks():
+                    yield block
+                yield b"\r\n"
+            else:
+                # small fields are send as one block
+                yield header + content + b"\r\n"
+        yield self._end
+
+
+class IGemTransport(object):
+    """Sends the HTTP requests of a wiki manager
+
+    Responses provide status_code, url, headers, content, text and json() like the responses of requests.
+    """
+
+    POOL_SIZE = 10
+
+    def __init__(self, pool_size=POOL_SIZE, keep_alive=True, timeout=None):
+        self._pool_size = pool_size
+        self._keep_alive = keep_alive is True
+        self._timeout = timeout
+
+    @property
+    def pool_size(self):
+        """Maximum number of connections (and requests in flight) per host"""
+        return self._pool_size
+
+    @property
+    def keep_alive(self):
+        return self._keep_alive
+
+    @property
+    def timeout(self):
+        """Seconds to wait for a response, None to wait forever"""
+        return self._timeout
+
+    def request(self, method, url, params=None, data=None, files=None, headers=None):
+        """Sends a request and returns its response
+
+        :param files: Dictionary of field name to an open file or a tuple (filename, content, mime type), the
+            content can be an IGemFilePart to read it from disk while it is send (see IGemMultipartEncoder)
+        :raises IGemTransportError: When no response was received
+        """
+        raise NotImplementedError
+
+    def request_many(self, calls):
+        """Sends many requests at once
+
+        :param calls: List of (method, url, keyword arguments of request)
+        :return: The responses (or IGemTransportError when failed), in the same order as the calls
+        """
+        results = []
+        for method, url, kwargs in calls:
+            try:
+                results.append(self.request(method, url, **kwargs))
+            except IGemTransportError as e:
+                results.append(e)
+        return results
+
+    def download(self, url, location, block_size=64 * 1024):
+        """Saves the body of the response to a GET of url in a file, if the response is OK (200)
+
+        :return: The response, without content
+        :raises IGemTransportError: When no response was received
+        """
+        response = self.request("GET", url)
+        if response.status_code == 200:
+            with open(location, "wb") as dst:
+                dst.write(response.content)
+        return IGemResponse(response.status_code, response.url, response.headers, b"")
+
+    def fork(self):
+        """Returns a transport with its own cookies that shares the connections of this transport
+
+        Closing the returned transport leaves the shared connections open. By default the returned
+        transport is a new one with the same settings, which has its own connections.
+        """
+        return self.__class__(pool_size=self.pool_size, keep_alive=self.keep_alive, timeout=self.timeout)
+
+    def get_cookies(self):
+        """Returns the cookies of the session, as list of dictionaries with name, value, domain and path"""
+        return []
+
+    def set_cookies(self, cookies):
+        """Adds cookies (as returned by get_cookies) to the session"""
+        pass
+
+    def close(self):
+        pass
+
+
+class IGemRequestsTransport(IGemTransport):
+    """Default transport: a requests session, with a thread pool for many requests at once
+
+    requests is only imported when the transport is created, as it takes most of the start up time.
+    """
+
+    def __init__(self, pool_size=IGemTransport.POOL_SIZE, keep_alive=True, timeout=None, adapter=None):
+        super(IGemRequestsTransport, self).__init__(pool_size=pool_size, keep_alive=keep_alive, timeout=timeout)
+        import requests
+        self._session = requests.Session()
+        # a forked transport uses the connection pool of the transport it was forked from
+        self._is_fork = adapter is not None
+        if adapter is None:
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._adapter = adapter
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        if not self.keep_alive:
+            self._session.headers["Connection"] = "close"
+
+    @property
+    def session(self):
+        return self._session
+
+    def request(self, method, url, params=None, data=None, files=None, headers=None):
+        import requests
+        if files:
+            # requests would build the whole body in memory
+            data = IGemMultipartEncoder(data, files)
+            headers = dict(headers or {}, **{"Content-Type": data.content_type})
+            files = None
+        try:
+            return self._session.request(
+                method, url, params=params, data=data, files=files, headers=headers, timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            raise IGemTransportError(str(e))
+
+    def download(self, url, location, block_size=64 * 1024):
+        import requests
+        # stream the body to disk, so large files are never kept in memory
+        try:
+            response = self._session.get(url, stream=True, timeout=self.timeout)
+            try:
+                if response.status_code == 200:
+                    with open(location, "wb") as dst:
+                        for block in response.iter_content(block_size):
+                            dst.write(block)
+                return IGemResponse(response.status_code, response.url, dict(response.headers), b"")
+            finally:
+                response.close()
+        except requests.RequestException as e:
+            raise IGemTransportError(str(e))
+
+    def request_many(self, calls):
+        calls = list(calls)
+        if len(calls) <= 1:
+            return super(IGemRequestsTransport, self).request_many(calls)
+        from multiprocessing.pool import ThreadPool
+        send = super(IGemRequestsTransport, self).request_many
+        pool = ThreadPool(min(self.pool_size, len(calls)))
+        try:
+            results = pool.map(lambda call: send([call])[0], calls)
+        finally:
+            pool.close()
+            pool.join()
+        return results
+
+    def get_cookies(self):
+        return [
+            {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path, "secure": c.secure,
+             "expires": c.expires}
+            for c in self._session.cookies
+        ]
+
+    def set_cookies(self, cookies):
+        for c in cookies:
+            self._session.cookies.set(
+                c.get("name"), c.get("value"), domain=c.get("domain", ""), path=c.get("path", "/"),
+                secure=c.get("secure", False), expires=c.get("expires")
+            )
+
+    def fork(self):
+        return IGemRequestsTransport(
+            pool_size=self.pool_size, keep_alive=self.keep_alive, timeout=self.timeout, adapter=self._adapter
+        )
+
+    def close(self):
+        if self._is_fork:
+            # closing the session would close the shared connections
+            self._session.cookies.clear()
+        else:
+            self._session.close()
+
+
+class IGemThrottle(object):
+    """Limits the number of requests in flight and adapts the limit to what the server can take
+
+    Whenever the server asks us to slow down the limit is halved, after every `increase_after`
+    requests accepted in a row it grows by one again, up to the maximum.
+    Also keeps track of the time spent waiting for the server.
+    """
+
+    def __init__(self, maximum=1, increase_after=10):
+        self._maximum = maximum
+        self._limit = maximum
+        self._increase_after = increase_after
+        self._active = 0
+        self._accepted = 0
+        self._waited = 0.0
+        self._retries = 0
+        self._condition = threading.Condition()
+
+    @property
+    def maximum(self):
+        return self._maximum
+
+    @maximum.setter
+    def maximum(self, value):
+        with self._condition:
+            self._maximum = max(1, int(value))
+            self._limit = self._maximum
+            self._condition.notify_all()
+
+    @property
+    def limit(self):
+        """Current number of requests allowed in flight"""
+        return self._limit
+
+    @property
+    def waited(self):
+        """Seconds spent waiting because the server asked us to slow down (or failed)"""
+        return self._waited
+
+    @property
+    def retries(self):
+        return self._retries
+
+    def acquire(self):
+        with self._condition:
+            while self._active >= self._limit:
+                self._condition.wait()
+            self._active += 1
+
+    def acquire_many(self, count):
+        """Waits until a request is allowed, then takes up to count requests
+
+        :return: Number of requests taken, to release afterwards
+        """
+        with self._condition:
+            while self._active >= self._limit:
+                self._condition.wait()
+            result = max(1, min(count, self._limit - self._active))
+            self._active += result
+            return result
+
+    def release(self, count=1):
+        with self._condition:
+            self._active -= count
+            self._condition.notify(count)
+
+    def accepted(self):
+        """Registers a request accepted by the server"""
+        with self._condition:
+            self._accepted += 1
+            if self._accepted >= self._increase_after and self._limit < self._maximum:
+                self._accepted = 0
+                self._limit += 1
+                self._condition.notify()
+
+    def backoff(self, delay):
+        """Registers a request rejected by the server and waits before it is retried"""
+        with self._condition:
+            self._accepted = 0
+            self._limit = max(1, self._limit // 2)
+            self._retries += 1
+            self._waited += delay
+        time.sleep(delay)
+
+
+class IGemChunkSizer(object):
+    """Chooses the size of the chunks of uploads from the throughput of the chunks send before
+
+    Chunks are made to take about `target` seconds to send: large enough that the round trip per chunk
+    does not matter, small enough that resending a failed chunk does not cost much. The size at most
+    doubles per chunk, every failed chunk halves it. When not adaptive the size stays the same.
+    """
+
+    # sizes are multiples of this many bytes
+    STEP = 64 * 1024
+
+    def __init__(self, size, minimum=None, maximum=None, target=2.0, adaptive=True):
+        self._minimum = minimum if minimum is not None else size
+        self._maximum = maximum if maximum is not None else size
+        self._target = target
+        self._adaptive = adaptive is True
+        self._size = self.limit(size)
+        self._rate = None
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        """Size in bytes of the next chunk"""
+        return self._size
+
+    @property
+    def rate(self):
+        """Average throughput of the recent chunks in bytes per second, None when nothing was send yet"""
+        return self._rate
+
+    @property
+    def is_adaptive(self):
+        return self._adaptive
+
+    def limit(self, size):
+        size = max(self.STEP, int(size) - int(size) % self.STEP)
+        return int(min(self._maximum, max(self._minimum, size)))
+
+    def sent(self, length, seconds):
+        """Registers a chunk accepted by the server"""
+        with self._lock:
+            if length < self._size // 2:
+                # the last (small) chunk of a file is mostly round trip
+                return
+            rate = length / max(seconds, 1e-3)
+            self._rate = rate if self._rate is None else (self._rate + rate) / 2
+            if self._adaptive:
+                size = min(self._rate * self._target, self._size * 2)
+                self._size = self.limit(max(size, self._size // 2))
+
+    def failed(self):
+        """Registers a chunk that was not accepted"""
+        with self._lock:
+            if self._adaptive:
+                self._size = self.limit(self._size // 2)
+
+
+class IGemMetrics(object):
+    """Records the requests send to the wiki and the time spend on each file, to report where a run spends its time
+
+    The report is available as a dictionary (saved as JSON) and in the Prometheus text format.
+    """
+
+    # upper bounds (in seconds) of the latency histogram buckets
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    # number of slowest files to report
+    SLOWEST_FILES = 10
+
+    def __init__(self):
+        self._started = time.time()
+        self._actions = {}
+        self._files = []
+        self._lock = threading.Lock()
+
+    @property
+    def started(self):
+        return self._started
+
+    @property
+    def requests(self):
+        return sum(stats["count"] for stats in self._actions.values())
+
+    @property
+    def bytes_sent(self):
+        return sum(stats["bytes_sent"] for stats in self._actions.values())
+
+    @property
+    def bytes_received(self):
+        return sum(stats["bytes_received"] for stats in self._actions.values())
+
+    def record_request(self, action, status, latency, sent=0, received=0, retries=0):
+        """Registers a request
+
+        :param action: The API action (or "login") of the request
+        :param status: HTTP status code of the response, "error" when there was no response
+        :param latency: Seconds until the (last) response was received
+        :param sent: Approximate number of bytes send
+        :param received: Number of bytes received
+        :param retries: Number of times the request was resend
+        """
+        with self._lock:
+            stats = self._actions.get(action)
+            if stats is None:
+                stats = {
+                    "count": 0, "statuses": {}, "seconds": 0.0, "max_seconds": 0.0, "bytes_sent": 0,
+                    "bytes_received": 0, "retries": 0, "buckets": [0] * (len(self.LATENCY_BUCKETS) + 1)
+                }
+                self._actions[action] = stats
+            status = str(status)
+            stats["count"] += 1
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+            stats["seconds"] += latency
+            stats["max_seconds"] = max(stats["max_seconds"], latency)
+            stats["bytes_sent"] += sent
+            stats["bytes_received"] += received
+            stats["retries"] += retries
+            stats["buckets"][bisect.bisect_left(self.LATENCY_BUCKETS, latency)] += 1
+
+    def record_file(self, name, seconds, size=0):
+        """Registers the time spend to upload (or skip) a file, keeping only the slowest files"""
+        with self._lock:
+            item = (seconds, str(name), size)
+            if len(self._files) < self.SLOWEST_FILES:
+                heapq.heappush(self._files, item)
+            else:
+                heapq.heappushpop(self._files, item)
+
+    def report(self):
+        """Summary of the recorded requests and files
+
+        :rtype: dict
+        """
+        with self._lock:
+            actions = {}
+            for action, stats in self._actions.items():
+                result = dict((k, v) for k, v in stats.items() if k != "buckets")
+                result["mean_seconds"] = stats["seconds"] / stats["count"]
+                # cumulative counts, like a prometheus histogram
+                histogram = []
+                count = 0
+                for bound, value in zip(self.LATENCY_BUCKETS + ("+Inf",), stats["buckets"]):
+                    count += value
+                    histogram.append({"le": bound, "count": count})
+                result["histogram"] = histogram
+                actions[action] = result
+            files = [
+                {"name": name, "seconds": seconds, "size": size}
+                for seconds, name, size in sorted(self._files, reverse=True)
+            ]
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self._started)),
+            "seconds": time.time() - self._started,
+            "requests": sum(a["count"] for a in actions.values()),
+            "actions": actions,
+            "slowest_files": files,
+        }
+
+    def format_prometheus(self, report=None):
+        """Formats the report in the Prometheus text format, e.g. for the textfile collector of node_exporter"""
+        if report is None:
+            report = self.report()
+        lines = [
+            "# HELP igem_run_duration_seconds Duration of the last run",
+            "# TYPE igem_run_duration_seconds gauge",
+            "igem_run_duration_seconds {:.3f}".format(report["seconds"]),
+            "# HELP igem_run_timestamp_seconds Time the last run started",
+            "# TYPE igem_run_timestamp_seconds gauge",
+            "igem_run_timestamp_seconds {:.0f}".format(self._started),
+        ]
+        actions = sorted(report["actions"].items())
+        lines.extend([
+            "# HELP igem_http_requests_total Requests send to the wiki",
+            "# TYPE igem_http_requests_total counter",
+        ])
+        for action, stats in actions:
+            for status, count in sorted(stats["statuses"].items()):
+                lines.append('igem_http_requests_total{{action="{}",status="{}"}} {}'.format(action, status, count))
+        lines.extend([
+            "# HELP igem_http_request_duration_seconds Latency of the requests send to the wiki",
+            "# TYPE igem_http_request_duration_seconds histogram",
+        ])
+        for action, stats in actions:
+            for bucket in stats["histogram"]:
+                lines.append('igem_http_request_duration_seconds_bucket{{action="{}",le="{}"}} {}'.format(
+                    action, bucket["le"], bucket["count"]
+                ))
+            lines.append('igem_http_request_duration_seconds_sum{{action="{}"}} {:.6f}'.format(
+                action, stats["seconds"]
+            ))
+            lines.append('igem_http_request_duration_seconds_count{{action="{}"}} {}'.format(action, stats["count"]))
+        for name, key, description in (
+                ("igem_http_request_bytes_total", "bytes_sent", "Approximate bytes send to the wiki"),
+                ("igem_http_response_bytes_total", "bytes_received", "Bytes received from the wiki"),
+                ("igem_http_retries_total", "retries", "Requests resend because the wiki was busy"),
+        ):
+            lines.extend(["# HELP {} {}".format(name, description), "# TYPE {} counter".format(name)])
+            for action, stats in actions:
+                lines.append('{}{{action="{}"}} {}'.format(name, action, stats[key]))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _write(location, content):
+        # write to a temporary file first, so a collector never reads a half written file
+        tmp = "{}.tmp".format(location)
+        with open(tmp, "w") as dst:
+            dst.write(content)
+        getattr(os, "replace", os.rename)(tmp, location)
+
+    def save_report(self, location):
+        self._write(location, json.dumps(self.report(), indent=1, sort_keys=True))
+
+    def save_prometheus(self, location):
+        self._write(location, self.format_prometheus())
+
+
 class IGemLogFormatter(logging.Formatter):
 
     LOG_FORMAT = '%(name)s [%(levelname)s]: %(message)s'
@@ -75,11 +985,40 @@ class BaseIGemWikiManager(object):
     api_url = "https://2017.igem.org/wiki/api.php"
     login_url = "https://igem.org/Login2"
 
+    # files of at least this size are assembled and published asynchronously by the server
+    ASYNC_UPLOAD_SIZE = 50 * 1024 * 1024
+    # maximum time to wait for the server to finish an asynchronous upload
+    ASYNC_UPLOAD_TIMEOUT = 600
+    # number of times a chunk is resend before the upload is given up
+    CHUNK_RETRIES = 3
+    # files of at least this size are uploaded in chunks, the first chunk has this size
+    CHUNK_SIZE = 1024 * 1024
+    # limits of the chunk size when it adapts to the connection (the wiki may lower them)
+    CHUNK_SIZE_MIN = 256 * 1024
+    CHUNK_SIZE_MAX = 32 * 1024 * 1024
+    # seconds the sending of a chunk should take when the chunk size adapts to the connection
+    CHUNK_SECONDS = 2.0
+    # errors of the wiki telling that the chunks stashed so far are lost
+    STASH_LOST_ERRORS = ("invalid-file-key", "stashfailed", "stashedfilenotfound", "stashnosuchfilekey")
+    # number of times a request is resend when the server is busy or does not respond
+    REQUEST_RETRIES = 5
+    # first and longest time to wait before a request is resend (in seconds)
+    BACKOFF_BASE = 1.0
+    BACKOFF_MAX = 60.0
+    # actions that can safely be send again when it is unknown whether the server received them
+    IDEMPOTENT_ACTIONS = ("query", "edit", "delete", "parse")
+    # list all titles again when the title index is older, the wiki forgets older recent changes
+    TITLE_INDEX_MAX_AGE = 30 * 24 * 3600
+    # start of the recent changes after a full listing, as margin for differences between our and the wiki's clock
+    TITLE_INDEX_MARGIN = 300
+
     def __init__(self, team=None, year=None):
         if year is None:
             from datetime import datetime as dt
             year = dt.now().year
         self._year = year
+        # the wiki of the edition, unless --api-url points elsewhere
+        self.api_url = self.get_api_url()
         if isinstance(team, str):
             if not team.startswith("Team:"):
                 team = "Team:{}".format(team)
@@ -88,10 +1027,27 @@ class BaseIGemWikiManager(object):
         self._password = None
         self._prefix = None
         self._files = []
-        self._session = requests.Session()
+        self._transport = None
+        self._transport_name = "requests"
+        self._transport_options = {}
+        self._transport_lock = threading.Lock()
         self._token = None
         self._dry = False
         self._quiet = False
+        self._jobs = 1
+        self._journal = IGemUploadJournal()
+        self._throttle = IGemThrottle(maximum=IGemTransport.POOL_SIZE)
+        self._maxlag = 5
+        self._metrics = IGemMetrics()
+        self._report = None
+        self._prometheus = None
+        self._title_index = None
+        self._title_index_synced = False
+        self._session_cache = None
+        self._login_lock = threading.RLock()
+        self._chunk_size = None
+        self._chunk_sizer = None
+        self._chunk_sizer_lock = threading.Lock()
 
     @classmethod
     def get_logger(cls):
@@ -111,7 +1067,7 @@ class BaseIGemWikiManager(object):
 
     @username.setter
     def username(self, u):
-        if isinstance(u, (unicode, str)):
+        if isinstance(u, string_types):
             self._username = u
 
     @property
@@ -120,7 +1076,7 @@ class BaseIGemWikiManager(object):
 
     @password.setter
     def password(self, p):
-        if isinstance(p, (unicode, str)):
+        if isinstance(p, string_types):
             self._password = p
 
     @property
@@ -135,6 +1091,261 @@ class BaseIGemWikiManager(object):
     def token(self):
         return self._token
 
+    @property
+    def jobs(self):
+        """Number of requests we are allowed to run in parallel"""
+        return self._jobs
+
+    @jobs.setter
+    def jobs(self, value):
+        value = int(value)
+        if value < 1:
+            value = 1
+        self._jobs = value
+        self._throttle.maximum = self.pool_size
+
+    @property
+    def pool_size(self):
+        """Number of connections to the wiki, and requests allowed in flight"""
+        return max(self._transport_options.get("pool_size", IGemTransport.POOL_SIZE), self.jobs)
+
+    @property
+    def throttle(self):
+        """Limits and keeps track of the requests in flight
+
+        :rtype: IGemThrottle
+        """
+        return self._throttle
+
+    @property
+    def metrics(self):
+        """Requests and files recorded during this run
+
+        :rtype: IGemMetrics
+        """
+        return self._metrics
+
+    def use_report(self, location=None, prometheus=None):
+        """Sets where the report of the run is saved as JSON and/or as Prometheus textfile"""
+        if location is not None:
+            self._report = location
+        if prometheus is not None:
+            self._prometheus = prometheus
+
+    def save_report(self):
+        if self._report is not None:
+            self.metrics.save_report(self._report)
+        if self._prometheus is not None:
+            self.metrics.save_prometheus(self._prometheus)
+
+    @property
+    def maxlag(self):
+        """Seconds of database replication lag at which the server should refuse our requests"""
+        return self._maxlag
+
+    @maxlag.setter
+    def maxlag(self, value):
+        self._maxlag = value
+
+    @property
+    def transport(self):
+        """The transport used to send requests, created when first used
+
+        :rtype: IGemTransport
+        """
+        with self._transport_lock:
+            if self._transport is None:
+                self._transport = self.create_transport()
+            return self._transport
+
+    def create_transport(self):
+        options = dict(self._transport_options)
+        # keep a connection for every worker
+        options["pool_size"] = self.pool_size
+        if self._transport_name == "asyncio":
+            # only available on python 3 with aiohttp
+            from igem_async import IGemAsyncioTransport
+            return IGemAsyncioTransport(**options)
+        if self._transport_name != "requests":
+            raise ValueError("Unknown transport: {}".format(self._transport_name))
+        return IGemRequestsTransport(**options)
+
+    def use_transport(self, name=None, pool_size=None, keep_alive=None, timeout=None):
+        """Changes the transport (requests or asyncio) or its settings, replacing the current transport if needed"""
+        with self._transport_lock:
+            options = {"pool_size": pool_size, "keep_alive": keep_alive, "timeout": timeout}
+            options = dict((k, v) for k, v in options.items() if v is not None)
+            is_changed = name is not None and name != self._transport_name
+            is_changed = is_changed or any(self._transport_options.get(k) != v for k, v in options.items())
+            if not is_changed:
+                return
+            if self._transport is not None:
+                self._transport.close()
+                self._transport = None
+            if name is not None:
+                self._transport_name = name
+            self._transport_options.update(options)
+        self._throttle.maximum = self.pool_size
+
+    def adopt_session(self, other):
+        """Continues the login session of another manager, sharing its transport (cookies and connections)
+
+        :type other: BaseIGemWikiManager
+        """
+        with self._transport_lock:
+            if self._transport is not None and self._transport is not other.transport:
+                self._transport.close()
+            self._transport = other.transport
+        self._token = other.token
+
+    def adopt_login(self, other):
+        """Continues the login of another manager, which may edit another edition of the wiki
+
+        The transport (cookies and connections) is shared, the token of our wiki is obtained with one request.
+
+        :type other: BaseIGemWikiManager
+        :return: Whether the login is valid for our wiki, when not our own transport is kept
+        """
+        with self._transport_lock:
+            previous = self._transport
+            self._transport = other.transport
+        self._token = None
+        if self.runs_dry() or self.check_session():
+            if previous is not None and previous is not other.transport:
+                previous.close()
+            return True
+        # the transport (and its cookies) still belongs to the other manager
+        with self._transport_lock:
+            self._transport = previous
+        return False
+
+    def match_transport(self, other):
+        """Uses the transport settings (and jobs) of another manager, keeping our cookies when the transport changes
+
+        :type other: BaseIGemWikiManager
+        """
+        with self._transport_lock:
+            is_same = (self._transport_name, self._transport_options, self.jobs) == (
+                other._transport_name, other._transport_options, other.jobs
+            )
+            if is_same:
+                return
+            cookies = []
+            if self._transport is not None:
+                cookies = self._transport.get_cookies()
+                self._transport.close()
+                self._transport = None
+            self._transport_name = other._transport_name
+            self._transport_options = dict(other._transport_options)
+        self.jobs = other.jobs
+        if len(cookies) > 0:
+            self.transport.set_cookies(cookies)
+
+    def detach_session(self):
+        """Forgets the transport and token without closing the transport, e.g. when they belong to another manager"""
+        with self._transport_lock:
+            self._transport = None
+        self._token = None
+
+    def share_connections(self, other):
+        """Sends our requests over the connections of another manager, with our own cookies
+
+        :type other: BaseIGemWikiManager
+        """
+        with self._transport_lock:
+            if self._transport is not None:
+                self._transport.close()
+            self._transport = other.transport.fork()
+
+    def close(self):
+        """Closes the connections of the transport"""
+        with self._transport_lock:
+            if self._transport is not None:
+                self._transport.close()
+                self._transport = None
+
+    @property
+    def journal(self):
+        """Journal of chunked uploads in progress
+
+        :rtype: IGemUploadJournal
+        """
+        return self._journal
+
+    def use_journal(self, location):
+        self._journal = IGemUploadJournal(location).load()
+
+    @property
+    def chunk_size(self):
+        """Size in bytes of the chunks of large uploads, None to adapt it to the connection"""
+        return self._chunk_size
+
+    @chunk_size.setter
+    def chunk_size(self, value):
+        self._chunk_size = int(value) if value is not None else None
+        self._chunk_sizer = None
+
+    @property
+    def chunk_sizer(self):
+        """Chooses the size of the chunks of all uploads, created when the first file is uploaded in chunks
+
+        :rtype: IGemChunkSizer
+        """
+        with self._chunk_sizer_lock:
+            if self._chunk_sizer is None:
+                if self.chunk_size is not None:
+                    self._chunk_sizer = IGemChunkSizer(self.chunk_size, adaptive=False)
+                else:
+                    minimum, maximum = self.get_chunk_limits()
+                    self._chunk_sizer = IGemChunkSizer(
+                        self.CHUNK_SIZE, minimum=minimum, maximum=maximum, target=self.CHUNK_SECONDS
+                    )
+                    self.get_logger().info("Chunk size adapts between {} and {} bytes".format(minimum, maximum))
+            return self._chunk_sizer
+
+    def get_chunk_limits(self):
+        """Returns the smallest and largest chunk size to use, within the limits the wiki reports
+
+        :rtype: (int, int)
+        """
+        minimum, maximum = self.CHUNK_SIZE_MIN, self.CHUNK_SIZE_MAX
+        data = self.create_json(action="query", meta="siteinfo", siprop="general")
+        try:
+            r = self.http_get(self.api_url, params=data)
+        except IGemTransportError as e:
+            self.get_logger().info("Cannot ask the wiki for its upload limits: {}".format(e))
+            r = None
+        if r is not None:
+            general = r.json().get("query", {}).get("general", {})
+            if "maxuploadsize" in general:
+                maximum = min(maximum, int(general["maxuploadsize"]))
+            if "minuploadchunksize" in general:
+                minimum = max(minimum, int(general["minuploadchunksize"]))
+        return min(minimum, maximum), maximum
+
+    @property
+    def title_index(self):
+        """Local index of the titles of the team, None if the wiki is asked every time
+
+        :rtype: IGemTitleIndex | None
+        """
+        return self._title_index
+
+    def use_title_index(self, location):
+        self._title_index = IGemTitleIndex(location).load()
+        self._title_index_synced = False
+
+    @property
+    def session_cache(self):
+        """Cache of login sessions to continue in the next run, None to login every run
+
+        :rtype: IGemSessionCache | None
+        """
+        return self._session_cache
+
+    def use_session_cache(self, location):
+        self._session_cache = IGemSessionCache(location).load()
+
     def runs_dry(self):
         return self._dry is True
 
@@ -147,6 +1358,23 @@ class BaseIGemWikiManager(object):
     def set_quiet(self, state):
         self._quiet = state is True
 
+    def map_jobs(self, func, items):
+        """Applies func to all items, using a pool of workers when more than one job is allowed
+
+        Results are returned in the same order as the items.
+        """
+        items = list(items)
+        if self.jobs <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(self.jobs, len(items)))
+        try:
+            results = pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+        return results
+
     def get_base_host(self):
         return "{}.igem.org".format(self.year)
 
@@ -194,35 +1422,234 @@ class BaseIGemWikiManager(object):
         return "{}{}".format(url, title)
 
     def http_get(self, url, _is_json=True, **kwargs):
-        session = self._session
+        return self.http_request("GET", url, _is_json=_is_json, **kwargs)
+
+    def http_post(self, url, _is_json=True, **kwargs):
+        return self.http_request("POST", url, _is_json=_is_json, **kwargs)
+
+    def http_request(self, method, url, _is_json=True, _location=None, _renew=True, _attempt=0, **kwargs):
+        """Sends a request, waiting and retrying while the server is busy
+
+        Requests rejected by the server (429, 503 or maxlag) are always retried, requests without
+        a response only when they are safe to repeat. Requests rejected because the session or
+        token expired are send again (once) after logging in again.
+
+        :param _location: Download the body of the response (to a GET) to this file
+        :param _attempt: Number of times the request was send already (e.g. by http_many)
+        """
         if self.runs_dry():
+            return None
+        attempt = _attempt
+        while True:
+            error = None
             result = None
-        else:
-            result = session.get(url, **kwargs)
-            if result.status_code == 200:
-                response = result
-                if _is_json:
-                    response = result.json()
-                self.get_logger().debug("Response to {}:\n{}".format(url, response))
-            else:
-                self.get_logger().debug("Response to {}:\n{}".format(url, result))
+            self.throttle.acquire()
+            start = time.time()
+            try:
+                if _location is None:
+                    result = self.transport.request(method, url, **kwargs)
+                else:
+                    result = self.transport.download(url, _location)
+            except IGemTransportError as e:
+                error = e
+            finally:
+                self.throttle.release()
+            latency = time.time() - start
+            delay = self.get_retry_delay(result, attempt)
+            if delay is None:
+                self.throttle.accepted()
+                break
+            can_retry = error is None or self.is_idempotent(method, kwargs)
+            if not can_retry or attempt >= self.REQUEST_RETRIES:
+                break
+            attempt += 1
+            reason = error if error is not None else result.status_code
+            self.get_logger().info("Server is busy ({}), retry {} of {} in {:.1f}s".format(
+                reason, attempt, self.REQUEST_RETRIES, delay
+            ))
+            self.throttle.backoff(delay)
+        self.record_request(
+            url, kwargs, result, latency, retries=attempt, action="download" if _location is not None else None
+        )
+        if error is not None:
+            raise error
+        self.log_response(url, result, _is_json)
+        if _renew and self.is_session_error(result):
+            data = kwargs.get("data") if isinstance(kwargs.get("data"), dict) else kwargs.get("params")
+            token = data.get("token") if isinstance(data, dict) else None
+            if token is not None and self.renew_session(token):
+                data["token"] = self.token
+                return self.http_request(method, url, _is_json=_is_json, _location=_location, _renew=False, **kwargs)
         return result
 
-    def http_post(self, url, _is_json=True, **kwargs):
-        session = self._session
+    @staticmethod
+    def is_session_error(result):
+        """Whether the wiki rejected a request because our session or token is no longer valid"""
+        if result is None or result.status_code != 200:
+            return False
+        head = result.content[:256]
+        if b'"badtoken"' not in head and b'"assertuserfailed"' not in head and b'"notloggedin"' not in head:
+            return False
+        return result.json().get("error", {}).get("code") in ("badtoken", "assertuserfailed", "notloggedin")
+
+    def http_many(self, calls, _is_json=True):
+        """Sends many requests at once, as far as the transport and throttle allow
+
+        :param calls: List of (method, url, keyword arguments)
+        :return: Responses in the same order as the calls, None in a dry run
+        :raises IGemTransportError: When one of the requests failed
+        """
+        calls = list(calls)
         if self.runs_dry():
-            result = None
-        else:
-            result = session.post(url, **kwargs)
-            if result.status_code == 200:
-                response = result
-                if _is_json:
-                    response = result.json()
-                self.get_logger().debug("Response to {}:\n{}".format(url, response))
-            else:
-                self.get_logger().debug("Response to {}:\n{}".format(url, result))
+            return [None] * len(calls)
+        results = []
+        while len(results) < len(calls):
+            # as many requests as the connections and the throttle allow
+            count = self.throttle.acquire_many(min(self.pool_size, len(calls) - len(results)))
+            window = calls[len(results):len(results) + count]
+            start = time.time()
+            try:
+                responses = self.transport.request_many(window)
+            finally:
+                self.throttle.release(count)
+            latency = time.time() - start
+            rejected = []
+            for call, result in zip(window, responses):
+                response = None if isinstance(result, IGemTransportError) else result
+                delay = self.get_retry_delay(response, 0)
+                if delay is not None:
+                    rejected.append((len(results), delay))
+                else:
+                    self.throttle.accepted()
+                    self.record_request(call[1], call[2], result, latency)
+                    self.log_response(call[1], result, _is_json)
+                results.append(result)
+            if len(rejected) > 0:
+                # wait for the server once, then send the rejected requests again on their own
+                delay = max(delay for idx, delay in rejected)
+                self.get_logger().info("Server is busy, resend {} of {} requests in {:.1f}s".format(
+                    len(rejected), len(window), delay
+                ))
+                self.throttle.backoff(delay)
+                for idx, delay in rejected:
+                    method, url, kwargs = calls[idx]
+                    results[idx] = self.http_request(method, url, _is_json=_is_json, _attempt=1, **kwargs)
+        return results
+
+    def get_retry_delay(self, result, attempt):
+        """Returns the seconds to wait before resending a request, None if it should not be resend
+
+        Honors the Retry-After header of the server and otherwise backs off exponentially with jitter.
+
+        :param result: The response, None if no response was received
+        :param attempt: Number of times the request was resend already
+        """
+        if result is not None:
+            is_busy = result.status_code in (429, 503)
+            if not is_busy and result.status_code == 200 and b'"maxlag"' in result.content[:256]:
+                is_busy = result.json().get("error", {}).get("code") == "maxlag"
+            if not is_busy:
+                return None
+        delay = min(self.BACKOFF_MAX, self.BACKOFF_BASE * (2 ** attempt))
+        delay = random.uniform(delay / 2, delay)
+        retry_after = None
+        if result is not None:
+            retry_after = self.parse_retry_after(result.headers.get("Retry-After"))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    @staticmethod
+    def parse_retry_after(value):
+        """Returns the seconds of a Retry-After header (either seconds or a date), None if not given"""
+        result = None
+        if value is not None:
+            try:
+                result = float(value)
+            except ValueError:
+                from email.utils import parsedate_tz, mktime_tz
+                date = parsedate_tz(value)
+                if date is not None:
+                    result = max(0.0, mktime_tz(date) - time.time())
         return result
 
+    def is_idempotent(self, method, kwargs):
+        """Whether a request can safely be send twice"""
+        if method == "GET":
+            return True
+        data = kwargs.get("data")
+        if not isinstance(data, dict):
+            return False
+        return data.get("action") in self.IDEMPOTENT_ACTIONS
+
+    def record_request(self, url, kwargs, result, latency, retries=0, action=None):
+        """Adds a request to the metrics of this run"""
+        for key in ("params", "data"):
+            if isinstance(kwargs.get(key), dict):
+                action = kwargs[key].get("action", action)
+        if action is None:
+            action = "login" if url == self.login_url else "other"
+        status = "error"
+        received = 0
+        if result is not None:
+            status = result.status_code
+            received = len(result.content)
+        self.metrics.record_request(
+            action, status, latency, sent=self.estimate_size(kwargs), received=received, retries=retries
+        )
+
+    @staticmethod
+    def estimate_size(kwargs):
+        """Estimates the number of bytes a request sends, without encoding it"""
+        result = 0
+        for key in ("params", "data"):
+            values = kwargs.get(key)
+            if isinstance(values, dict):
+                result += sum(len(str(k)) + len(str(v)) + 2 for k, v in values.items())
+            elif values is not None:
+                result += len(values)
+        for value in (kwargs.get("files") or {}).values():
+            if isinstance(value, (tuple, list)):
+                value = value[1]
+            if hasattr(value, "__len__"):
+                result += len(value)
+        return result
+
+    def log_response(self, url, result, _is_json=True):
+        logger = self.get_logger()
+        # responses can be large, only format them when they are shown
+        if logger.isEnabledFor(logging.DEBUG):
+            excerpt = ""
+            if _is_json:
+                excerpt = ": {}".format(result.text[:500])
+            logger.debug("Response to {} [{}, {} bytes]{}".format(
+                url, result.status_code, len(result.content), excerpt
+            ))
+
+    def download(self, url, location):
+        """Saves the file at url to location, streaming it to disk
+
+        :return: True when the file was saved
+        """
+        if self.runs_dry():
+            return True
+        # write to a temporary file first, so an interrupted download never looks complete
+        tmp = "{}.tmp".format(location)
+        try:
+            r = self.http_request("GET", url, _is_json=False, _location=tmp)
+            if r.status_code != 200:
+                self.get_logger().warning("Failed to download {}: {}".format(url, r.status_code))
+                return False
+            getattr(os, "replace", os.rename)(tmp, location)
+            return True
+        except IGemTransportError as e:
+            self.get_logger().warning("Failed to download {}: {}".format(url, e))
+            return False
+        finally:
+            # do not leave (part of) a failed download behind
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
     def create_json(self, action, _params=None, **kwargs):
         if _params is None:
             _params = {}
@@ -232,20 +1659,30 @@ class BaseIGemWikiManager(object):
         }
         if self.token is not None:
             result["token"] = self.token
+        if self.maxlag is not None:
+            result["maxlag"] = self.maxlag
         _params = {k: v for k, v in _params.items() if v not in (None, "")}
         result.update(_params)
         kwargs = {k: v for k, v in kwargs.items() if v not in (None, "")}
         result.update(kwargs)
         return result
 
-    def login(self, username=None, password=None):
-        """Login to the iGEM Wiki and obtain token"""
+    def login(self, username=None, password=None, force=False):
+        """Login to the iGEM Wiki and obtain token
+
+        Unless force is set, nothing is done when we have a token already (e.g. of an adopted session)
+        and a session saved by an earlier run is continued when it is still valid.
+        """
         result = False
         if username is not None:
             self.username = username
         if password is not None:
             self.password = password
+        if not force and self.token is not None:
+            return True
         if None not in (self.username, self.password):
+            if not force and self.resume_session():
+                return True
             r1 = self.http_post(self.login_url, data={
                 'return_to': '',
                 'username': self.username,
@@ -259,8 +1696,56 @@ class BaseIGemWikiManager(object):
                 result = True
         if result:
             self.obtain_token()
+            self.save_session()
         return self.token is not None
 
+    def resume_session(self):
+        """Continues the session saved by an earlier run, if the wiki still knows us by it
+
+        :return: True when the session is valid and the token is obtained
+        """
+        if self.session_cache is None or self.runs_dry():
+            return False
+        entry = self.session_cache.find(self.username, self.api_url)
+        if entry is None:
+            return False
+        self.transport.set_cookies(entry.get("cookies", []))
+        if not self.check_session():
+            self.get_logger().info("Saved session of {} has expired".format(self.username))
+            return False
+        self.get_logger().info("Continued saved session of {}".format(self.username))
+        return True
+
+    def check_session(self):
+        """Checks whether the wiki knows us by the cookies of the transport and obtains the token with one request
+
+        :return: True when we are logged in as our user and have a token
+        """
+        params = self.create_json(action="query", meta="userinfo|tokens")
+        params.pop("token", None)
+        query = self.http_get(self.api_url, params=params).json().get("query", {})
+        name = query.get("userinfo", {}).get("name", "")
+        if self.username is None or name.replace("_", " ").lower() != self.username.replace("_", " ").lower():
+            return False
+        self._token = query.get("tokens", {}).get("csrftoken")
+        return self.token is not None
+
+    def save_session(self):
+        if self.session_cache is None or self.runs_dry() or self.token is None:
+            return
+        self.session_cache.record(self.username, self.api_url, self.transport.get_cookies(), self.token)
+
+    def renew_session(self, token):
+        """Logs in again after the wiki rejected token, unless another thread did so already
+
+        :return: True when there is a new token
+        """
+        with self._login_lock:
+            if self.token != token:
+                return self.token is not None
+            self.get_logger().info("Session of {} is no longer valid, login again".format(self.username))
+            return self.login(force=True) and self.token != token
+
     def obtain_token(self):
         params = self.create_json(action='query', meta='tokens')
         r2 = self.http_get(self.api_url, params=params)
@@ -281,63 +1766,335 @@ class BaseIGemWikiManager(object):
         })
         r = self.http_post(self.api_url, data=data)
         if r is not None:
-            result = 'error' not in r.json().keys()
+            response = r.json()
+            result = 'error' not in response.keys()
+            if result and self.title_index is not None:
+                edit = response.get("edit", {})
+                self.title_index.add(page, pageid=edit.get("pageid"), touched=edit.get("newtimestamp"))
         else:
             result = True
         self.get_logger().info("Edit Page {} => {}: {}".format(title, page, result))
         return result
 
-    def page_search(self, prefix, limit=50, apcontinue=None):
-        """Searches for all pages with the given prefix"""
-        results = []
+    def file_title(self, title):
+        """Returns the title of the File page the wiki creates for an upload to title"""
+        page = self.prefix_title(title)
+        # MediaWiki does not allow these characters in file names and replaces them
+        page = re.sub(r"[:/\\]", "-", page)
+        return "File:{}".format(page)
+
+    def query_titles(self, titles, prop, batch_size=50, **kwargs):
+        """Queries properties of many titles, using one request per batch of titles
+
+        :param titles: Full titles (no prefix is added)
+        :param prop: Property to query (e.g. revisions or imageinfo)
+        :param batch_size: Maximum number of titles per request (the API allows 50)
+        :return: Page information per requested title, or None for titles that do not exist
+        :rtype: dict[str, dict | None]
+        """
+        titles = list(titles)
+        results = dict((title, None) for title in titles)
+        calls = []
+        for batch in batched(titles, batch_size):
+            params = self.create_json(action="query", prop=prop, titles="|".join(batch), **kwargs)
+            calls.append(("GET", self.api_url, {"params": params}))
+        for title, page in self.parse_query_titles(titles, batch_size, self.http_many(calls)):
+            results[title] = page
+        return results
+
+    def iter_query_titles(self, titles, prop, batch_size=50, **kwargs):
+        """Like query_titles, but yields (title, page information) while the batches come in
+
+        Only one batch per job is requested at once, so large results (e.g. the content of pages)
+        do not pile up in memory.
+        """
+        for window in batched(titles, batch_size * self.jobs):
+            calls = []
+            for batch in batched(window, batch_size):
+                params = self.create_json(action="query", prop=prop, titles="|".join(batch), **kwargs)
+                calls.append(("GET", self.api_url, {"params": params}))
+            for result in self.parse_query_titles(window, batch_size, self.http_many(calls)):
+                yield result
+
+    @staticmethod
+    def parse_query_titles(titles, batch_size, responses):
+        """Yields (title, page information or None) from the responses to the batches of titles"""
+        for batch, r in zip(batched(titles, batch_size), responses):
+            if r is None:
+                continue
+            content = r.json().get("query", {})
+            # the API normalizes titles (e.g. underscores, capitals), map them back
+            normalized = dict((n.get("from"), n.get("to")) for n in content.get("normalized", []))
+            pages = dict((p.get("title"), p) for p in content.get("pages", {}).values())
+            for title in batch:
+                page = pages.get(normalized.get(title, title))
+                if page is not None and "missing" not in page and "invalid" not in page:
+                    yield title, page
+                else:
+                    yield title, None
+
+    def page_info(self, titles):
+        """Returns the SHA1 and size of the current revision of the given pages
+
+        :rtype: dict[str, dict | None]
+        """
+        pages = dict((self.prefix_title(title), title) for title in titles)
+        info = self.query_titles(pages.keys(), "revisions", rvprop="ids|sha1|size")
+        results = {}
+        for page, title in pages.items():
+            result = None
+            revisions = (info.get(page) or {}).get("revisions", [])
+            if len(revisions) > 0:
+                result = revisions[0]
+            results[title] = result
+        return results
+
+    def file_info(self, titles):
+        """Returns the SHA1, size, url and mime type of the files uploaded to the given titles
+
+        :rtype: dict[str, dict | None]
+        """
+        pages = dict((self.file_title(title), title) for title in titles)
+        info = self.query_titles(pages.keys(), "imageinfo", iiprop="sha1|size|url|mime")
+        results = {}
+        for page, title in pages.items():
+            result = None
+            images = (info.get(page) or {}).get("imageinfo", [])
+            if len(images) > 0:
+                result = images[0]
+            results[title] = result
+        return results
+
+    def iter_pages(self, prefix, limit="max"):
+        """Yields all pages with the given prefix, the next batch is only requested when needed
+
+        :param prefix: Prefix of the titles (the team and prefix are added)
+        :param limit: Number of pages to request at once ("max" lets the server decide)
+        :rtype: collections.Iterable[dict[str, str | int]]
+        """
         prefix = self.prefix_title(prefix)
-        params = self.create_json(
-            action="query", list="allpages", apprefix=prefix, aplimit=limit, apcontinue=apcontinue
-        )
-        r = self.http_get(self.api_url, params=params)
-        if r is not None:
+        if self.title_index is not None and not self.runs_dry():
+            if not self._title_index_synced:
+                self.sync_title_index()
+            for title, page in self.title_index.find(prefix):
+                yield {"ns": 0, "title": title, "pageid": page.get("pageid")}
+            return
+        for page in self.list_pages(prefix, limit=limit):
+            yield page
+
+    def list_pages(self, prefix, limit="max"):
+        """Yields all pages starting with the (complete) prefix, as listed by the wiki"""
+        params = self.create_json(action="query", list="allpages", apprefix=prefix, aplimit=limit)
+        for page in self.iter_query(params, "allpages"):
+            yield page
+
+    def iter_query(self, params, name):
+        """Yields the items of list `name` of a query, requesting the next batch when needed"""
+        params = dict(params)
+        # ask for the `continue` style of continuation
+        params["continue"] = ""
+        while True:
+            r = self.http_get(self.api_url, params=params)
+            if r is None:
+                break
             json = r.json()
-            if "query" in json.keys() and "allpages" in json["query"].keys():
-                results = r.json()["query"]["allpages"]
+            for item in json.get("query", {}).get(name, []):
+                yield item
             # check if we can get more
-            if "query-continue" in json.keys() and "allpages" in json["query-continue"].keys():
-                apcontinue = json["query-continue"]["allpages"]["apcontinue"]
-                results += self.page_search(prefix, limit=limit, apcontinue=apcontinue)
+            if "continue" in json.keys():
+                params.update(json["continue"])
+            elif "query-continue" in json.keys() and name in json["query-continue"].keys():
+                params.update(json["query-continue"][name])
+            else:
+                break
+
+    def recent_changes(self, since):
+        """Yields the changes to pages since the given timestamp, oldest first"""
+        params = self.create_json(
+            action="query", list="recentchanges", rcstart=since, rcdir="newer", rcnamespace=0,
+            rctype="edit|new|log", rcprop="title|ids|timestamp|loginfo", rclimit="max"
+        )
+        for change in self.iter_query(params, "recentchanges"):
+            yield change
+
+    @staticmethod
+    def parse_timestamp(value):
+        """Converts a timestamp of the wiki (e.g. 2017-10-01T12:00:00Z) to seconds since the epoch"""
+        import calendar
+        return calendar.timegm(time.strptime(value, "%Y-%m-%dT%H:%M:%SZ"))
+
+    @staticmethod
+    def format_timestamp(value):
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(value))
+
+    def sync_title_index(self):
+        """Brings the title index up to date with the recent changes of the wiki
+
+        All titles are listed again when the index is new, is of another team or is too old.
+
+        :raises ValueError: When there is no team (or prefix), as the index would hold the whole wiki
+        """
+        index = self.title_index
+        scope = self.prefix_title("")
+        if scope == "":
+            raise ValueError("The title index needs a team or prefix")
+        synced = index.synced
+        is_outdated = synced is None or index.scope != scope
+        if not is_outdated:
+            is_outdated = time.time() - self.parse_timestamp(synced) > self.TITLE_INDEX_MAX_AGE
+        if is_outdated:
+            start = self.format_timestamp(time.time() - self.TITLE_INDEX_MARGIN)
+            index.reset(scope)
+            for page in self.list_pages(scope):
+                index.add(page.get("title"), pageid=page.get("pageid"))
+            index.mark_synced(start)
+            self.get_logger().info("Listed {} titles of {}".format(len(index.find(scope)), scope))
+        else:
+            changes = 0
+            for change in self.recent_changes(synced):
+                self.apply_change(change)
+                changes += 1
+            self.get_logger().info("Updated title index of {} with {} changes".format(scope, changes))
+        self._title_index_synced = True
+
+    def apply_change(self, change):
+        """Updates the title index with a change from the recent changes"""
+        index = self.title_index
+        title = change.get("title", "")
+        timestamp = change.get("timestamp")
+        kind = change.get("type")
+        if kind in ("new", "edit"):
+            index.add(title, pageid=change.get("pageid"), touched=timestamp)
+        elif kind == "log" and change.get("logtype") == "delete":
+            if change.get("logaction") == "restore":
+                index.add(title, pageid=change.get("pageid"), touched=timestamp)
+            else:
+                index.discard(title)
+        elif kind == "log" and change.get("logtype") == "move":
+            index.discard(title)
+            target = change.get("logparams", {}).get("target_title")
+            if target is not None:
+                index.add(target, pageid=change.get("pageid"), touched=timestamp)
+        if timestamp is not None:
+            index.mark_synced(timestamp)
+
+    def find_file(self, digest):
+        """Searches the wiki for an uploaded file with the given SHA1
+
+        :return: The name, SHA1, url and mime type of the first file found or None
+        :rtype: dict[str, str] | None
+        """
+        return self.find_files([digest])[0]
+
+    def find_files(self, digests):
+        """Searches the wiki for uploaded files with the given SHA1's, sending all searches at once
+
+        :rtype: list[dict[str, str] | None]
+        """
+        results = []
+        calls = []
+        for digest in digests:
+            params = self.create_json(
+                action="query", list="allimages", aisha1=digest, aiprop="sha1|url|mime", ailimit=1
+            )
+            calls.append(("GET", self.api_url, {"params": params}))
+        for r in self.http_many(calls):
+            result = None
+            if r is not None:
+                images = r.json().get("query", {}).get("allimages", [])
+                if len(images) > 0:
+                    result = images[0]
+            results.append(result)
         return results
 
-    def delete(self, title, reason=None):
-        """Deletes a title"""
+    def page_search(self, prefix, limit="max"):
+        """Searches for all pages with the given prefix
+
+        :rtype: list[dict[str, str | int]]
+        """
+        return list(self.iter_pages(prefix, limit=limit))
+
+    def delete(self, title, reason=None, confirm=True):
+        """Deletes a title
+
+        :param confirm: Ask before deleting the page (unless we run quietly)
+        """
         result = False
         # generate page name
         page = self.prefix_title(title)
-        # generate POST data
-        data = self.create_json(action="delete", title=page, reason=reason)
         response = True
-        if not self.is_quiet():
+        if confirm and not self.is_quiet():
             response = ask_confirm("Do you really want to DELETE page {} => {}?".format(title, page))
         if response:
-            r = self.http_post(self.api_url, data=data)
-            if r is None:
-                result = True
-            else:
-                result = "error" not in r.json().keys()
+            result = self.delete_page(page, reason=reason) is None
         self.get_logger().info("Delete Page {} => {}: {}".format(title, page, result))
         return result
 
-    def upload(self, title, path, comment=None, chunk_size=1024*1024):
+    def delete_page(self, page, reason=None):
+        """Deletes a page without asking
+
+        :param page: Full title of the page
+        :return: None when the page is deleted, otherwise the error reported by the wiki
+        """
+        data = self.create_json(action="delete", title=page, reason=reason)
+        try:
+            r = self.http_post(self.api_url, data=data)
+        except IGemTransportError as e:
+            return "no response ({})".format(e)
+        return self.parse_delete(page, r)
+
+    def parse_delete(self, page, r):
+        """Returns the error of a delete response, None when the page is deleted (or in a dry run)"""
+        if r is None:
+            return None
+        error = r.json().get("error")
+        if error is None:
+            if self.title_index is not None:
+                self.title_index.discard(page)
+            return None
+        return error.get("code", "error")
+
+    def delete_pages(self, pages, reason=None):
+        """Deletes many pages without asking, as many at once as the transport and throttle allow
+
+        :param pages: Full titles of the pages
+        :return: List of (page, error) in the same order, error is None when the page is deleted
+        """
+        pages = list(pages)
+        calls = []
+        for page in pages:
+            data = self.create_json(action="delete", title=page, reason=reason)
+            calls.append(("POST", self.api_url, {"data": data}))
+        try:
+            responses = self.http_many(calls)
+        except IGemTransportError:
+            # delete the pages one by one, a page that is gone already was deleted by the failed batch
+            errors = [self.delete_page(page, reason=reason) for page in pages]
+            errors = [None if error == "missingtitle" else error for error in errors]
+            return list(zip(pages, errors))
+        errors = []
+        for page, r in zip(pages, responses):
+            if self.is_session_error(r):
+                # logs in again and sends it once more
+                errors.append(self.delete_page(page, reason=reason))
+            else:
+                errors.append(self.parse_delete(page, r))
+        return list(zip(pages, errors))
+
+    def upload(self, title, path, comment=None, chunk_size=None):
         """Will upload a file as an (image)attachment
 
         :param title: The name of the page
         :param path: Path to file to read
         :param comment: Comment to send with upload
-        :param chunk_size: Size of the chunks to upload file in  (Default 1 MB)
+        :param chunk_size: Size of the chunks to upload file in (Default: the chunk size of the manager)
         :rtype: dict[str, str | bool | int | float]
         """
         # result = {'result': False}
         page = self.prefix_title(title)
         # get total file size
         fs = os.path.getsize(path)
-        if fs < chunk_size:
+        if fs < (chunk_size or self.chunk_size or self.CHUNK_SIZE):
             result = self._upload_file(page, path, comment=comment)
         else:
             result = self._upload_chunks(page, path, comment=comment, chunk_size=chunk_size)
@@ -348,7 +2105,7 @@ class BaseIGemWikiManager(object):
         data = self.create_json(
             action="upload", filename=page, comment=comment
         )
-        files = {'file': open(source, 'rb')}
+        files = {'file': (os.path.basename(source), IGemFilePart(source), "application/octet-stream")}
         r = self.http_post(self.api_url, files=files, data=data)
         if r is None:
             result['result'] = True
@@ -371,65 +2128,170 @@ class BaseIGemWikiManager(object):
                 result["mime"] = upload["imageinfo"]["mime"]
         return result
 
-    def _upload_chunks(self, page, source, comment=None, chunk_size=1024*1024):
+    def _upload_chunks(self, page, source, comment=None, chunk_size=None):
+        """Uploads a file in chunks to the stash and publishes it when all chunks are received
+
+        Every offset confirmed by the server is written to the journal, so an interrupted upload
+        continues at the last confirmed offset instead of starting over.
+        Unless a chunk size is given, the chunk sizer adapts the size of each chunk to the throughput
+        and failures of the chunks before it.
+        """
         result = {'result': False}
+        sizer = self.chunk_sizer if chunk_size is None else IGemChunkSizer(chunk_size, adaptive=False)
         # get total file size
         fs = os.path.getsize(source)
-        # get file content
-        offset = 0
-        filekey = None
-        with open(source, "rb") as src:
-            while True:
-                chunk = src.read(chunk_size)
-                if not chunk:
-                    result["result"] = True
-                    break
-                # send piece
-                response = self._upload_chunk(page, chunk, offset, fs, key=filekey, comment=comment)
-                if "filekey" in response.keys():
-                    filekey = filekey
-                if 'offset' in response.keys():
-                    offset = offset
+        use_async = fs >= self.ASYNC_UPLOAD_SIZE
+        # continue where an earlier attempt stopped
+        state = self.journal.resume(page, source)
+        filekey = state.get("filekey")
+        offset = state.get("offset", 0)
+        if offset > 0:
+            self.get_logger().info("Resume upload of {} at {} of {} bytes".format(page, offset, fs))
+        # all chunks may have been received before the interruption
+        finished = filekey is not None and offset >= fs
+        attempts = 0
+        start, sent, sizes = time.time(), 0, []
+        while not finished:
+            # the chunk is read from the file while it is send
+            chunk = IGemFilePart(source, offset, min(sizer.size, fs - offset))
+            sizes.append(len(chunk))
+            # send piece
+            chunk_start = time.time()
+            response = self._upload_chunk(
+                page, chunk, offset, fs, key=filekey, comment=comment, use_async=use_async
+            )
+            elapsed = time.time() - chunk_start
+            status = response.get("result")
+            if status in ("Continue", "Success", "Poll"):
+                sizer.sent(len(chunk), elapsed)
+                sent += len(chunk)
+                self.get_logger().info("Sent {} bytes of {} at offset {} in {:.2f}s, next chunk {} bytes".format(
+                    len(chunk), page, offset, elapsed, sizer.size
+                ))
+                attempts = 0
+                filekey = response.get("filekey") or filekey
+                if status == "Continue":
+                    offset = int(response.get("offset") or offset + len(chunk))
                 else:
-                    offset += chunk_size
-                if response.get("result") == "Success":
-                    result["result"] = True
-                    break
-                if "error" in response.keys():
-                    break
+                    offset = fs
+                self.journal.record(page, source, filekey, offset)
+                if status == "Poll":
+                    # the server is assembling the chunks
+                    status = self._poll_upload(filekey).get("result")
+                if status == "Continue":
+                    continue
+                finished = status == "Success"
+                break
+            error = response.get("error") or ""
+            attempts += 1
+            sizer.failed()
+            if filekey is not None and error in self.STASH_LOST_ERRORS:
+                # the server forgot about our stash, start over
+                self.get_logger().info("Stash of {} is lost ({}), restart upload".format(page, error))
+                self.journal.forget(page)
+                filekey = None
+                offset = 0
+            if attempts > self.CHUNK_RETRIES:
+                self.get_logger().warning("Upload of {} failed at offset {}: {}".format(page, offset, error))
+                break
+            self.get_logger().info("Resend chunk of {} at offset {} (attempt {})".format(page, offset, attempts))
+        elapsed = max(time.time() - start, 1e-3)
+        # the last chunk is only what was left of the file
+        full = sizes[:-1] or sizes or [0]
+        self.get_logger().info("Sent {} bytes of {} in {} chunks ({} chunk size {}-{}) in {:.1f}s: {:.0f} KB/s".format(
+            sent, page, len(sizes), "adaptive" if sizer.is_adaptive else "fixed", min(full), max(full), elapsed,
+            sent / elapsed / 1024
+        ))
+        result["result"] = finished
         if result.get("result"):
             # commit
-            data = self.create_json(action="upload", filename=page, filekey=filekey, comment=comment)
-            r = self.http_post(self.api_url, data=data)
-            if r is None:
-                result['result'] = True
-                result['url'] = "-- DRY RUN + {} --".format(page)
-                result["mime"] = "text/plain"
-            else:
-                upload = r.json().get("upload")
-                if upload is not None and "imageinfo" in upload.keys():
-                    result["result"] = True
-                    result["url"] = upload["imageinfo"]["url"]
-                    result["mime"] = upload["imageinfo"]["mime"]
+            result = self._publish_upload(page, filekey, comment=comment, use_async=use_async)
+            if result.get("result"):
+                self.journal.forget(page)
         return result
 
-    def _upload_chunk(self, page, chunk, offset, filesize, key=None, comment=None):
+    def _upload_chunk(self, page, chunk, offset, filesize, key=None, comment=None, use_async=False):
+        """Sends one chunk (an IGemFilePart) of a file to the stash"""
         result = {'result': False}
         data = self.create_json(
-            action='upload', filename=page, filesize=filesize, offset=offset, chunk=chunk,
+            action='upload', filename=page, filesize=filesize, offset=offset, stash=1,
             filekey=key, comment=comment
         )
-        r = self.http_post(self.api_url, data=data)
+        if use_async:
+            data["async"] = 1
+        files = {'chunk': (os.path.basename(page), chunk, "application/octet-stream")}
+        try:
+            r = self.http_post(self.api_url, data=data, files=files)
+        except IGemTransportError as e:
+            result['error'] = "http-error"
+            self.get_logger().info("Failed to send chunk of {}: {}".format(page, e))
+            return result
         if r is None:
             result['result'] = 'Success'
             result['offset'] = filesize
             result['filekey'] = "-- DRY RUN KEY --"
         else:
-            upload = r.json().get("upload")
+            content = r.json()
+            upload = content.get("upload")
             if upload is not None:
                 result['result'] = upload.get("result")
                 result['filekey'] = upload.get("filekey")
                 result['offset'] = upload.get("offset")
+            if "error" in content.keys():
+                result['error'] = content["error"].get("code")
+        return result
+
+    def _poll_upload(self, filekey):
+        """Waits until the server finished an asynchronous step of an upload
+
+        :rtype: dict
+        """
+        result = {'result': "Error"}
+        delay = 1
+        deadline = time.time() + self.ASYNC_UPLOAD_TIMEOUT
+        while time.time() < deadline:
+            data = self.create_json(action="upload", filekey=filekey, checkstatus=1)
+            r = self.http_post(self.api_url, data=data)
+            if r is None:
+                result = {'result': "Success"}
+                break
+            upload = r.json().get("upload")
+            if upload is None:
+                break
+            if upload.get("result") != "Poll":
+                result = upload
+                break
+            self.get_logger().debug("Waiting for upload {}: {}".format(filekey, upload.get("stage")))
+            time.sleep(delay)
+            delay = min(delay * 2, 10)
+        return result
+
+    def _publish_upload(self, page, filekey, comment=None, use_async=False):
+        """Publishes a completely stashed file under its title"""
+        result = {'result': False}
+        data = self.create_json(
+            action="upload", filename=page, filekey=filekey, comment=comment, ignorewarnings=1
+        )
+        if use_async:
+            data["async"] = 1
+        r = self.http_post(self.api_url, data=data)
+        if r is None:
+            result['result'] = True
+            result['url'] = "-- DRY RUN + {} --".format(page)
+            result["mime"] = "text/plain"
+        else:
+            upload = r.json().get("upload")
+            if upload is not None and upload.get("result") == "Poll":
+                upload = self._poll_upload(filekey)
+            if upload is not None and upload.get("result") == "Success":
+                info = upload.get("imageinfo")
+                if info is None:
+                    # asynchronous publishing does not always report the file information
+                    info = self.file_info([page]).get(page)
+                if info is not None:
+                    result["result"] = True
+                    result["url"] = info["url"]
+                    result["mime"] = info["mime"]
         return result
 
     @classmethod
@@ -437,7 +2299,7 @@ class BaseIGemWikiManager(object):
         parser = cls.create_parser()
         arguments = vars(parser.parse_args())
         verbosity = arguments.get("verbose")
-        if verbosity > 0:
+        if verbosity is not None and verbosity > 0:
             level = 60 - (verbosity * 10)
             if level < 0:
                 level = 0
@@ -445,24 +2307,69 @@ class BaseIGemWikiManager(object):
             root_log.setLevel(level)
             hdlr = IGemStreamHandler(level=level)
             root_log.addHandler(hdlr)
-        if "ini" in arguments.keys():
+        return cls.run_arguments(arguments)
+
+    @classmethod
+    def run_arguments(cls, arguments, settings=None, session=None, manager=None):
+        """Executes the action given by the parsed command line arguments
+
+        :param settings: Settings of the ini file, loaded from the ini file in the arguments when None
+        :param session: Manager whose login session (transport and token) is continued and kept open
+        :param manager: Manager of an earlier run with the same settings, reused (with its caches) for the
+            files and action of these arguments
+        """
+        if settings is None:
             ini_file = arguments.get("ini")
-            settings = dict(cls.load_ini(ini_file))
-            for k, v in arguments.items():
-                if v is not None:
-                    settings[k] = v
-            arguments = settings
-        # build object
-        team = arguments.get("team")
-        year = arguments.get("year")
-        result = cls(team=team, year=year)
-        # now we parse them
-        result.parse_arguments(arguments)
+            settings = {}
+            if ini_file is not None:
+                settings = dict(cls.load_ini(ini_file))
+        settings = dict(settings)
+        for k, v in arguments.items():
+            if v is not None:
+                settings[k] = v
+        arguments = settings
+        if manager is None:
+            # build object
+            team = arguments.get("team")
+            year = arguments.get("year")
+            result = cls(team=team, year=year)
+            # now we parse them
+            result.parse_arguments(arguments)
+        else:
+            result = manager
+            result.reset()
+            result.set_files(arguments.get("files"))
+        if session is not None:
+            session.match_transport(result)
+            result.adopt_session(session)
         # get what should be done
         action = arguments.get("action")
-        result.execute(action)
+        try:
+            result.execute(action)
+        finally:
+            if session is None:
+                result.close()
+            else:
+                # keep a renewed token, the transport stays with the session
+                session.adopt_session(result)
+                result.detach_session()
+            result.save_report()
+            if result.title_index is not None and not result.runs_dry():
+                result.title_index.save()
+        if result.throttle.retries > 0:
+            print("## Waited {:.1f}s for the server ({} requests resend)".format(
+                result.throttle.waited, result.throttle.retries
+            ))
         return result
 
+    def reset(self):
+        """Forgets the state of the previous run (metrics, throttle, files), keeping the settings and stores"""
+        self._metrics = IGemMetrics()
+        self._throttle = IGemThrottle()
+        self._throttle.maximum = self.pool_size
+        self._title_index_synced = False
+        self._files = []
+
     def execute(self, action):
         pass
 
@@ -490,6 +2397,44 @@ class BaseIGemWikiManager(object):
             '-v', dest="verbose", action="count",
             help="Print log messages to the console, use multiple to increase detail."
         )
+        parser.add_argument(
+            '-j', '--jobs', dest="jobs", type=int,
+            help="Number of requests to send in parallel (defaults to 1)"
+        )
+        parser.add_argument(
+            '--transport', choices=("requests", "asyncio"),
+            help="How requests are send: requests (default) or asyncio (requires aiohttp)"
+        )
+        parser.add_argument(
+            '--pool-size', dest="pool_size", type=int,
+            help="Maximum number of connections to the wiki (defaults to 10 or the number of jobs)"
+        )
+        parser.add_argument(
+            '--timeout', type=float, help="Seconds to wait for a response of the wiki"
+        )
+        parser.add_argument(
+            '--maxlag', type=int,
+            help="Let the server refuse requests when its database lags this many seconds (default 5)"
+        )
+        parser.add_argument(
+            '--report', help="Save a report of the requests and the slowest files of the run as JSON to this file"
+        )
+        parser.add_argument(
+            '--prometheus', help="Save the metrics of the run to this file, in the Prometheus text format"
+        )
+        parser.add_argument(
+            '--session', help="Location to save the login session in, so the next run does not have to login again"
+        )
+        parser.add_argument(
+            '--index', help="Location of a local index of the team's titles, used to search without listing all pages"
+        )
+        parser.add_argument(
+            '--journal', help="Location of the journal used to resume interrupted uploads of large files"
+        )
+        parser.add_argument(
+            '--chunk-size', dest="chunk_size",
+            help="Size in MB of the chunks of large uploads, or auto (default) to adapt it to the connection"
+        )
         parser.add_argument(
             '--ini', help="Location of the ini file to load commonly used paramets"
         )
@@ -509,6 +2454,12 @@ class BaseIGemWikiManager(object):
         parser.add_argument(
             '--prefix', help="Prefix to add before each title"
         )
+        parser.add_argument(
+            '--api-url', dest="api_url", help="Location of api.php (e.g. of a test wiki)"
+        )
+        parser.add_argument(
+            '--login-url', dest="login_url", help="Location of the login form (e.g. of a test wiki)"
+        )
         return parser
 
     def parse_arguments(self, arguments):
@@ -529,7 +2480,49 @@ class BaseIGemWikiManager(object):
         prefix = arguments.get("prefix")
         if prefix is not None:
             self.prefix = prefix
-        files = arguments.get("files")
+        api_url = arguments.get("api_url")
+        if api_url is not None:
+            self.api_url = api_url
+        login_url = arguments.get("login_url")
+        if login_url is not None:
+            self.login_url = login_url
+        jobs = arguments.get("jobs")
+        if jobs is not None:
+            self.jobs = jobs
+        journal = arguments.get("journal")
+        if journal is not None:
+            self.use_journal(journal)
+        chunk_size = arguments.get("chunk_size")
+        if chunk_size is not None and str(chunk_size).lower() != "auto":
+            self.chunk_size = float(chunk_size) * 1024 * 1024
+        self.use_report(arguments.get("report"), prometheus=arguments.get("prometheus"))
+        index = arguments.get("index")
+        if index is not None and self.prefix_title("") == "":
+            print("## Ignoring the title index {}, it needs a team or prefix".format(index))
+        elif index is not None:
+            self.use_title_index(index)
+        session = arguments.get("session")
+        if session is not None:
+            self.use_session_cache(session)
+        maxlag = arguments.get("maxlag")
+        if maxlag is not None:
+            self.maxlag = int(maxlag)
+        pool_size = arguments.get("pool_size")
+        if pool_size is not None:
+            pool_size = int(pool_size)
+        keep_alive = arguments.get("keep_alive")
+        if keep_alive is not None:
+            keep_alive = self.parse_bool(keep_alive, default=True)
+        timeout = arguments.get("timeout")
+        if timeout is not None:
+            timeout = float(timeout)
+        self.use_transport(
+            arguments.get("transport"), pool_size=pool_size, keep_alive=keep_alive, timeout=timeout
+        )
+        self.set_files(arguments.get("files"))
+
+    def set_files(self, files):
+        """Sets the patterns (or titles) given on the command line"""
         if not isinstance(files, (tuple, list)):
             files = [files]
         self._files = files
@@ -554,9 +2547,41 @@ class BaseIGemWikiManager(object):
                 print("Cannot load {}:\n{}".format(location, e))
         return results
 
+    @staticmethod
+    def load_ini_sections(location):
+        """Loads the settings of every section of an ini file, in order
+
+        :rtype: list[(str, list[(str, str)])]
+        """
+        results = []
+        if os.path.exists(location):
+            try:
+                cfg = configparser.SafeConfigParser()
+                cfg.read(location)
+                results = [(section, cfg.items(section)) for section in cfg.sections()]
+            except configparser.Error as e:
+                print("Cannot load {}:\n{}".format(location, e))
+        return results
+
 
 class IGemWikiManager(BaseIGemWikiManager):
-    """implements actions like edit, search and delete"""
+    """implements actions like edit, search, delete and pull"""
+
+    # file in the output directory that remembers the revisions pulled before
+    PULL_STATE = ".igem_pull.json"
+
+    def __init__(self, team=None, year=None):
+        super(IGemWikiManager, self).__init__(team=team, year=year)
+        self._output = "wiki"
+
+    @property
+    def output(self):
+        """Directory the pull action saves the pages and files in"""
+        return self._output
+
+    @output.setter
+    def output(self, value):
+        self._output = value
 
     def execute(self, action):
         if action == "search":
@@ -564,37 +2589,169 @@ class IGemWikiManager(BaseIGemWikiManager):
         if action == "delete":
             if self.login():
                 self.execute_delete()
+        if action == "pull":
+            self.execute_pull()
 
     def execute_search(self):
         for pattern in self._files:
-            results = self.page_search(pattern)
             uri = self.prefix_title(pattern)
             print("## Pages starting with '{}':".format(uri))
-            for idx, result in enumerate(results):
+            for idx, result in enumerate(self.iter_pages(pattern)):
                 print("{index:3}. {title} [{page_id}]".format(
                     index=idx, title=result.get("title"), page_id=result.get("pageid"))
                 )
 
     def execute_delete(self):
+        # find all pages first, so we only have to ask once
+        pages = []
+        seen = set()
         for title in self._files:
-            results = self.page_search(title)
-            # process the pages
-            pages = filter(lambda p: p is not None, [p.get("title") for p in results])
-            # now delete them
-            results = 0
-            print("## Found {} pages matching to {}".format(len(pages), title))
-            for page in pages:
-                results += 1 if self.delete(page) else 0
-            print("## Deleted {} pages".format(results))
+            found = 0
+            for page in self.iter_pages(title):
+                page = page.get("title")
+                if page is None or page in seen:
+                    continue
+                found += 1
+                seen.add(page)
+                pages.append(page)
+            print("## Found {} pages matching to {}".format(found, title))
+        if len(pages) == 0:
+            return
+        for idx, page in enumerate(pages):
+            print("{:3}. {}".format(idx, page))
+        if not self.is_quiet() and not ask_confirm("Do you really want to DELETE these {} pages?".format(len(pages))):
+            return
+        results = self.delete_pages(pages)
+        print("## Results:")
+        for page, error in results:
+            print("  {:<8} {}".format("deleted" if error is None else "FAILED", page))
+            if error is not None:
+                print("           {}".format(error))
+        deleted = len([error for page, error in results if error is None])
+        print("## Deleted {} of {} pages".format(deleted, len(results)))
+
+    def execute_pull(self):
+        """Saves the pages (as wikitext) and files of the team in the output directory
+
+        Pages and files that did not change since the previous pull are not downloaded again.
+        Pages left out of a batch by the wiki (when the result would be too large) are requested on
+        their own, pages that still cannot be pulled are reported as failed.
+        """
+        state = IGemStore(os.path.join(self.output, self.PULL_STATE)).load()
+        titles = []
+        seen = set()
+        for pattern in self._files:
+            for page in self.iter_pages(pattern):
+                if page.get("title") not in seen:
+                    seen.add(page.get("title"))
+                    titles.append(page.get("title"))
+        # only ask the content of pages with a new revision
+        changed = []
+        for title, page in self.iter_query_titles(titles, "revisions", rvprop="ids"):
+            if page is None:
+                continue
+            entry = state.get(title, {})
+            revid = (page.get("revisions") or [{}])[0].get("revid")
+            if revid is None or entry.get("revid") != revid or not os.path.exists(self.pull_location(title)):
+                changed.append(title)
+        pulled = 0
+        missing = []
+        # pages are written as their batch comes in
+        for title, page in self.iter_query_titles(changed, "revisions", rvprop="ids|content"):
+            if self.pull_page(state, title, page):
+                pulled += 1
+            else:
+                missing.append(title)
+        failed = []
+        for title, page in self.iter_query_titles(missing, "revisions", batch_size=1, rvprop="ids|content"):
+            if self.pull_page(state, title, page):
+                pulled += 1
+            else:
+                self.get_logger().warning("Failed to pull {}".format(title))
+                failed.append(title)
+        print("## Pulled {} of {} pages ({} unchanged, {} failed)".format(
+            pulled, len(titles), len(titles) - len(changed), len(failed)
+        ))
+        for title in failed:
+            print("  FAILED   {}".format(title))
+        # files are listed with their url and checksum, so we only download changed files
+        files = []
+        for pattern in self._files:
+            prefix = self.file_title(pattern)[len("File:"):]
+            params = self.create_json(
+                action="query", list="allimages", aiprefix=prefix, aiprop="sha1|size|url", ailimit="max"
+            )
+            for f in self.iter_query(params, "allimages"):
+                key = "File:{}".format(f.get("name"))
+                if key in seen:
+                    continue
+                seen.add(key)
+                location = self.pull_location(key)
+                if state.get(key, {}).get("sha1") == f.get("sha1") and os.path.exists(location):
+                    continue
+                files.append((key, location, f))
+
+        def download(item):
+            key, location, f = item
+            self.make_directory(os.path.dirname(location))
+            result = self.download(f.get("url"), location)
+            if result:
+                state.set(key, {"sha1": f.get("sha1")})
+            return result
+
+        downloaded = len([result for result in self.map_jobs(download, files) if result])
+        print("## Downloaded {} of {} changed files".format(downloaded, len(files)))
+        if not self.runs_dry():
+            state.save()
+
+    def pull_page(self, state, title, page):
+        """Writes the content of a page returned by a revisions query
+
+        :return: False when the response holds no revision of the page
+        """
+        if page is None or len(page.get("revisions", [])) == 0:
+            return False
+        revision = page["revisions"][0]
+        self.write_page(self.pull_location(title), revision.get("*", revision.get("content", "")))
+        state.set(title, {"revid": revision.get("revid")})
+        return True
+
+    def pull_location(self, title):
+        """Location of a pulled title, e.g. Team:Name/index => <output>/Team/Name/index.wiki"""
+        parts = [part for part in re.split(r"[:/]", title) if part not in ("", ".", "..")]
+        if len(parts) > 0 and parts[0] == "File":
+            return os.path.join(self.output, *parts)
+        return "{}.wiki".format(os.path.join(self.output, *parts))
+
+    def write_page(self, location, content):
+        if self.runs_dry():
+            return
+        self.make_directory(os.path.dirname(location))
+        with io.open(location, "w", encoding="utf-8", newline="") as dst:
+            dst.write(content)
+
+    @staticmethod
+    def make_directory(location):
+        try:
+            os.makedirs(location)
+        except OSError:
+            if not os.path.isdir(location):
+                raise
 
     @classmethod
     def create_parser(cls, parser=None):
         parser = super(IGemWikiManager, cls).create_parser(parser)
         parser.description = "Simple Interface to the iGEM Wiki"
+        parser.add_argument(
+            '-o', '--output', help="Directory to save the pulled pages and files in (defaults to wiki)"
+        )
         return parser
 
     def parse_arguments(self, arguments):
         super(IGemWikiManager, self).parse_arguments(arguments)
+        output = arguments.get("output")
+        if output is not None:
+            self.output = output
 
 if __name__ == "__main__":
     IGemWikiManager.run()
@@ -0,0 +1,628 @@
+#!/usr/bin/env python
+"""Local stand-in for the iGEM Wiki, to test and benchmark the scripts without touching the real wiki
+
+Implements the parts of the login form and api.php used by igem_manager.py and igem_upload.py:
+login, tokens, edit, upload (including chunked, stashed and asynchronous uploads), allpages,
+revisions, imageinfo, allimages, recentchanges and delete. Every request can be delayed and requests can be
+refused at random, like a busy wiki would.
+
+Run it with:
+
+    python igem_mock_server.py --port 8080 --latency 0.05 --error-rate 0.01
+
+and point the scripts at it with `--api-url http://localhost:8080/wiki/api.php` and
+`--login-url http://localhost:8080/Login2`.
+
+Copyright under MIT License, see LICENSE.
+"""
+
+from __future__ import print_function
+from email.parser import BytesParser
+import hashlib
+import json
+import mimetypes
+import random
+import re
+import threading
+import time
+import uuid
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qsl
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qsl
+
+__author__ = "Joeri Jongbloets <joeri@jongbloets.net>"
+
+
+class IGemMockError(Exception):
+    """An API error, reported to the client as {"error": {"code": ..., "info": ...}}"""
+
+    def __init__(self, code, info=""):
+        super(IGemMockError, self).__init__(info)
+        self.code = code
+        self.info = info
+
+
+class IGemMockWiki(object):
+    """State of the mock wiki: users, sessions, pages, files and stashed uploads"""
+
+    MAX_LIMIT = 500
+    # reported as maxuploadsize, like the default of MediaWiki
+    MAX_UPLOAD_SIZE = 100 * 1024 * 1024
+    # bytes of page content in one response, the rest is left to the next request (like $wgAPIMaxResultSize)
+    MAX_RESULT_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, users=None, base_url="http://localhost"):
+        if users is None:
+            users = {}
+        self._users = dict(users)
+        self._sessions = {}
+        self._pages = {}
+        self._files = {}
+        self._stash = {}
+        self._changes = []
+        self._next_id = 1
+        self._lock = threading.RLock()
+        self.base_url = base_url
+
+    # helpers
+
+    def _new_id(self):
+        with self._lock:
+            result = self._next_id
+            self._next_id += 1
+        return result
+
+    @staticmethod
+    def normalize(title):
+        title = title.replace("_", " ").strip()
+        return title[:1].upper() + title[1:]
+
+    @staticmethod
+    def file_name(name):
+        # MediaWiki does not allow these characters in file names
+        name = re.sub(r"[:/\\]", "-", name).replace(" ", "_")
+        return name[:1].upper() + name[1:]
+
+    @staticmethod
+    def timestamp(t=None):
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(t))
+
+    def file_url(self, name):
+        return "{}/wiki/images/{}".format(self.base_url.rstrip("/"), name)
+
+    def image_info(self, f):
+        return {
+            "sha1": f["sha1"], "size": len(f["content"]), "url": self.file_url(f["name"]),
+            "mime": f["mime"], "timestamp": f["timestamp"]
+        }
+
+    def log_change(self, kind, title, pageid, **kwargs):
+        """Adds a change to the recent changes"""
+        change = {"type": kind, "ns": 6 if title.startswith("File:") else 0, "title": title, "pageid": pageid}
+        change.update(kwargs)
+        with self._lock:
+            change["rcid"] = self._new_id()
+            change["timestamp"] = self.timestamp()
+            self._changes.append(change)
+
+    # sessions
+
+    def login(self, username, password):
+        """Returns a new session id if the credentials are right"""
+        result = None
+        if username is not None and self._users.get(username) == password:
+            result = uuid.uuid4().hex
+            with self._lock:
+                self._sessions[result] = {"user": username, "token": uuid.uuid4().hex + "+\\"}
+        return result
+
+    def session(self, session_id):
+        return self._sessions.get(session_id)
+
+    # api
+
+    def handle(self, params, files, session):
+        action = params.get("action")
+        method = getattr(self, "action_{}".format(action), None)
+        if method is None:
+            raise IGemMockError("badvalue", "Unrecognized value for parameter 'action': {}".format(action))
+        if action in ("edit", "upload", "delete"):
+            if session is None and "assert" in params:
+                raise IGemMockError("assertuserfailed")
+            # like MediaWiki, the token is checked first (anonymous users have the token "+\\")
+            if params.get("token") != (session["token"] if session is not None else "+\\"):
+                raise IGemMockError("badtoken", "Invalid CSRF token.")
+            if session is None:
+                raise IGemMockError("permissiondenied")
+        return method(params, files, session)
+
+    def action_query(self, params, files, session):
+        result = {}
+        meta = params.get("meta", "").split("|")
+        if "tokens" in meta:
+            token = session["token"] if session is not None else "+\\"
+            result.setdefault("tokens", {})["csrftoken"] = token
+        if "userinfo" in meta:
+            if session is None:
+                result["userinfo"] = {"id": 0, "name": "127.0.0.1", "anon": ""}
+            else:
+                result["userinfo"] = {"id": 1, "name": session["user"]}
+        if "siteinfo" in meta:
+            result["general"] = {
+                "sitename": "iGEM", "maxuploadsize": self.MAX_UPLOAD_SIZE, "minuploadchunksize": 1024
+            }
+        response = {"query": result}
+        if params.get("list") == "allpages":
+            self.list_allpages(params, response)
+        if params.get("list") == "allimages":
+            self.list_allimages(params, response)
+        if params.get("list") == "recentchanges":
+            self.list_recentchanges(params, response)
+        if "titles" in params:
+            self.prop_titles(params, response)
+        return response
+
+    def list_allpages(self, params, response):
+        namespace = int(params.get("apnamespace", 0))
+        prefix = self.normalize(params.get("apprefix", "")) if params.get("apprefix") else ""
+        limit = params.get("aplimit", "10")
+        limit = self.MAX_LIMIT if limit == "max" else min(int(limit), self.MAX_LIMIT)
+        start = params.get("apcontinue", params.get("apfrom", ""))
+        with self._lock:
+            if namespace == 6:
+                titles = sorted(self._files.keys())
+                entries = [(n, self._files[n]["pageid"], "File:" + n) for n in titles]
+            else:
+                titles = sorted(self._pages.keys())
+                entries = [(t, self._pages[t]["pageid"], t) for t in titles]
+        entries = [e for e in entries if e[0].startswith(prefix) and e[0] >= start]
+        pages = [{"pageid": pageid, "ns": namespace, "title": title} for name, pageid, title in entries[:limit]]
+        response["query"]["allpages"] = pages
+        if len(entries) > limit:
+            response["continue"] = {"apcontinue": entries[limit][0], "continue": "-||"}
+
+    def list_allimages(self, params, response):
+        digest = params.get("aisha1")
+        prefix = self.file_name(params.get("aiprefix", ""))
+        limit = params.get("ailimit", "10")
+        limit = self.MAX_LIMIT if limit == "max" else min(int(limit), self.MAX_LIMIT)
+        start = params.get("aicontinue", "")
+        with self._lock:
+            files = [f for f in self._files.values() if digest is None or f["sha1"] == digest]
+        files = [f for f in sorted(files, key=lambda x: x["name"]) if f["name"].startswith(prefix)]
+        files = [f for f in files if f["name"] >= start]
+        images = []
+        for f in files[:limit]:
+            image = self.image_info(f)
+            image["name"] = f["name"]
+            image["title"] = "File:" + f["name"]
+            images.append(image)
+        response["query"]["allimages"] = images
+        if len(files) > limit:
+            response["continue"] = {"aicontinue": files[limit]["name"], "continue": "-||"}
+
+    def list_recentchanges(self, params, response):
+        limit = params.get("rclimit", "10")
+        limit = self.MAX_LIMIT if limit == "max" else min(int(limit), self.MAX_LIMIT)
+        newer = params.get("rcdir", "older") == "newer"
+        namespaces = [int(ns) for ns in params.get("rcnamespace", "").split("|") if ns != ""]
+        kinds = params.get("rctype", "edit|new|log").split("|")
+        with self._lock:
+            changes = list(self._changes)
+        if not newer:
+            changes.reverse()
+        # rcstart is the first timestamp to list, in the direction of rcdir
+        start = params.get("rcstart")
+        if start is not None:
+            changes = [c for c in changes if (c["timestamp"] >= start if newer else c["timestamp"] <= start)]
+        changes = [c for c in changes if c["type"] in kinds and (len(namespaces) == 0 or c["ns"] in namespaces)]
+        offset = int(params.get("rccontinue", 0))
+        response["query"]["recentchanges"] = changes[offset:offset + limit]
+        if len(changes) > offset + limit:
+            response["continue"] = {"rccontinue": str(offset + limit), "continue": "-||"}
+
+    def prop_titles(self, params, response):
+        titles = params["titles"].split("|")
+        if len(titles) > 50:
+            raise IGemMockError("toomanyvalues", "Too many values supplied for parameter 'titles'")
+        props = params.get("prop", "").split("|")
+        rvprop = params.get("rvprop", "ids|timestamp").split("|")
+        normalized = []
+        pages = {}
+        missing = -1
+        size = 0
+        for title in titles:
+            target = self.normalize(title)
+            if target != title:
+                normalized.append({"from": title, "to": target})
+            with self._lock:
+                if target.startswith("File:"):
+                    entry = self._files.get(target[len("File:"):])
+                else:
+                    entry = self._pages.get(target)
+            if entry is None:
+                pages[str(missing)] = {"ns": 0, "title": target, "missing": ""}
+                missing -= 1
+                continue
+            page = {"pageid": entry["pageid"], "ns": 6 if target.startswith("File:") else 0, "title": target}
+            if "revisions" in props and "text" in entry:
+                revision = {}
+                if "ids" in rvprop:
+                    revision["revid"] = entry["revid"]
+                if "sha1" in rvprop:
+                    revision["sha1"] = entry["sha1"]
+                if "size" in rvprop:
+                    revision["size"] = len(entry["text"].encode("utf-8"))
+                if "timestamp" in rvprop:
+                    revision["timestamp"] = entry["timestamp"]
+                if "content" in rvprop:
+                    revision["contentformat"] = "text/x-wiki"
+                    revision["*"] = entry["text"]
+                    size += len(entry["text"].encode("utf-8"))
+                if size <= self.MAX_RESULT_SIZE:
+                    page["revisions"] = [revision]
+                elif "continue" not in response:
+                    # the pages after this one come without their revisions
+                    response["continue"] = {"rvcontinue": "{}|{}".format(entry["pageid"], entry["revid"]),
+                                            "continue": "||"}
+                    response["warnings"] = {"result": {
+                        "*": "This result was truncated because it would otherwise be larger than the limit"
+                    }}
+            if "info" in props:
+                page["lastrevid"] = entry.get("revid")
+                page["touched"] = entry["timestamp"]
+            if "imageinfo" in props and "content" in entry:
+                page["imageinfo"] = [self.image_info(entry)]
+            pages[str(entry["pageid"])] = page
+        if len(normalized) > 0:
+            response["query"]["normalized"] = normalized
+        response["query"]["pages"] = pages
+
+    def action_edit(self, params, files, session):
+        title = self.normalize(params.get("title", ""))
+        text = params.get("text", "").replace("\r\n", "\n").rstrip()
+        if title == "":
+            raise IGemMockError("missingparam", "The title parameter must be set.")
+        with self._lock:
+            page = self._pages.get(title)
+            kind = "edit"
+            if page is None:
+                page = {"pageid": self._new_id()}
+                self._pages[title] = page
+                kind = "new"
+            page.update({
+                "text": text, "sha1": hashlib.sha1(text.encode("utf-8")).hexdigest(),
+                "revid": self._new_id(), "timestamp": self.timestamp()
+            })
+            self.log_change(kind, title, page["pageid"], revid=page["revid"])
+        return {"edit": {
+            "result": "Success", "pageid": page["pageid"], "title": title, "newrevid": page["revid"],
+            "newtimestamp": page["timestamp"]
+        }}
+
+    def action_delete(self, params, files, session):
+        title = self.normalize(params.get("title", ""))
+        with self._lock:
+            if title.startswith("File:") and title[len("File:"):] in self._files:
+                pageid = self._files.pop(title[len("File:"):])["pageid"]
+            elif title in self._pages:
+                pageid = self._pages.pop(title)["pageid"]
+            else:
+                raise IGemMockError("missingtitle", "The page you specified doesn't exist.")
+            self.log_change("log", title, pageid, logtype="delete", logaction="delete")
+        return {"delete": {"title": title, "reason": params.get("reason", ""), "logid": self._new_id()}}
+
+    def action_upload(self, params, files, session):
+        if "checkstatus" in params:
+            return self.upload_status(params)
+        if "chunk" in files:
+            return self.upload_chunk(params, files["chunk"])
+        name = self.file_name(params.get("filename", ""))
+        if "file" in files:
+            content = files["file"]
+        elif "filekey" in params:
+            with self._lock:
+                stash = self._stash.get(params["filekey"])
+            if stash is None or not stash["complete"]:
+                raise IGemMockError("stashfailed", "No stashed file for key {}".format(params["filekey"]))
+            content = bytes(stash["content"])
+        else:
+            raise IGemMockError("missingparam", "One of the parameters filekey, file, url is required.")
+        with self._lock:
+            exists = name in self._files
+        if exists and "ignorewarnings" not in params:
+            key = self.stash(content)
+            return {"upload": {"result": "Warning", "warnings": {"exists": name}, "filekey": key}}
+        if "async" in params and "filekey" in params:
+            with self._lock:
+                self._stash[params["filekey"]].update({"publish": name, "stage": "publish"})
+            return {"upload": {"result": "Poll", "stage": "queued"}}
+        return {"upload": self.publish(name, content)}
+
+    def stash(self, content, complete=True):
+        key = "{}.stash".format(uuid.uuid4().hex[:16])
+        with self._lock:
+            self._stash[key] = {"content": bytearray(content), "complete": complete, "stage": None}
+        return key
+
+    def publish(self, name, content):
+        with self._lock:
+            f = self._files.get(name)
+            if f is None:
+                f = {"pageid": self._new_id(), "name": name}
+                self._files[name] = f
+            f.update({
+                "content": bytes(content), "sha1": hashlib.sha1(content).hexdigest(),
+                "mime": mimetypes.guess_type(name)[0] or "application/octet-stream",
+                "timestamp": self.timestamp()
+            })
+            self.log_change("log", "File:" + name, f["pageid"], logtype="upload", logaction="upload")
+            info = self.image_info(f)
+        return {"result": "Success", "filename": name, "imageinfo": info}
+
+    def upload_chunk(self, params, chunk):
+        size = int(params.get("filesize", 0))
+        offset = int(params.get("offset", 0))
+        key = params.get("filekey")
+        with self._lock:
+            if key is None:
+                if offset != 0:
+                    raise IGemMockError("stashfailed", "Missing filekey for offset {}".format(offset))
+                key = self.stash(b"", complete=False)
+            stash = self._stash.get(key)
+            if stash is None:
+                raise IGemMockError("stashfailed", "No stashed file for key {}".format(key))
+            if offset != len(stash["content"]):
+                error = IGemMockError("stashfailed", "Offset mismatch: expected {}".format(len(stash["content"])))
+                raise error
+            stash["content"].extend(chunk)
+            received = len(stash["content"])
+        if received < size:
+            return {"upload": {"result": "Continue", "offset": received, "filekey": key}}
+        with self._lock:
+            stash["complete"] = True
+        if "async" in params:
+            with self._lock:
+                stash["stage"] = "assembling"
+            return {"upload": {"result": "Poll", "stage": "queued", "filekey": key}}
+        return {"upload": {"result": "Success", "filekey": key}}
+
+    def upload_status(self, params):
+        with self._lock:
+            stash = self._stash.get(params.get("filekey"))
+        if stash is None:
+            raise IGemMockError("stashfailed", "No stashed file for key {}".format(params.get("filekey")))
+        if stash["stage"] == "publish":
+            result = self.publish(stash["publish"], stash["content"])
+            with self._lock:
+                stash["stage"] = None
+            return {"upload": result}
+        stash["stage"] = None
+        return {"upload": {"result": "Success", "filekey": params.get("filekey")}}
+
+    def download(self, name):
+        with self._lock:
+            f = self._files.get(name)
+        if f is None:
+            return None
+        return f["content"], f["mime"]
+
+
+class IGemMockHandler(BaseHTTPRequestHandler):
+    """Serves the login form, api.php and uploaded files of the mock wiki"""
+
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, do not wait for the ACK of the headers
+    disable_nagle_algorithm = True
+    SESSION_COOKIE = "igem_session"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+    @property
+    def wiki(self):
+        return self.server.wiki
+
+    def get_session_id(self):
+        cookies = self.headers.get("Cookie", "")
+        for cookie in cookies.split(";"):
+            name, _, value = cookie.strip().partition("=")
+            if name == self.SESSION_COOKIE:
+                return value
+        return None
+
+    def send_body(self, status, body, content_type="application/json; charset=utf-8", headers=None):
+        if not isinstance(body, bytes):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_request(self):
+        """Returns the query/form parameters and uploaded files of the request"""
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query, keep_blank_values=True))
+        files = {}
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length > 0 else b""
+        self.server.count(length)
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            message = BytesParser().parsebytes(
+                "Content-Type: {}\r\n\r\n".format(content_type).encode("utf-8") + body
+            )
+            for part in message.get_payload():
+                name = part.get_param("name", header="content-disposition")
+                content = part.get_payload(decode=True)
+                if part.get_param("filename", header="content-disposition") is not None:
+                    files[name] = content
+                else:
+                    params[name] = content.decode("utf-8")
+        elif len(body) > 0:
+            params.update(dict(parse_qsl(body.decode("utf-8"), keep_blank_values=True)))
+        return url.path, params, files
+
+    def handle_request(self):
+        path, params, files = self.read_request()
+        self.server.delay()
+        if path.endswith("/Login2"):
+            return self.handle_login(params)
+        if path.endswith("/Login_Confirmed"):
+            return self.send_body(200, "<html><body>Login confirmed</body></html>", "text/html")
+        if path.startswith("/wiki/images/"):
+            return self.handle_download(path[len("/wiki/images/"):])
+        if not path.endswith("/api.php"):
+            return self.send_body(404, "Not Found", "text/plain")
+        # simulate a busy server
+        failure = self.server.failure()
+        if failure == "unavailable":
+            return self.send_body(503, "Service Unavailable", "text/plain", {"Retry-After": "1"})
+        if failure == "maxlag" and "maxlag" in params:
+            body = {"error": {"code": "maxlag", "info": "Waiting for a database server: 6 seconds lagged."}}
+            return self.send_body(200, json.dumps(body), headers={"Retry-After": "1", "X-Database-Lag": "6"})
+        session = self.wiki.session(self.get_session_id())
+        try:
+            result = self.wiki.handle(params, files, session)
+        except IGemMockError as e:
+            result = {"error": {"code": e.code, "info": e.info}}
+        self.send_body(200, json.dumps(result))
+
+    def handle_login(self, params):
+        session = self.wiki.login(params.get("username"), params.get("password"))
+        if session is None:
+            return self.send_body(200, "<html><body>Login failed</body></html>", "text/html")
+        self.send_response(302)
+        self.send_header("Location", "/Login_Confirmed")
+        self.send_header("Set-Cookie", "{}={}; Path=/".format(self.SESSION_COOKIE, session))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def handle_download(self, name):
+        result = self.wiki.download(name)
+        if result is None:
+            return self.send_body(404, "Not Found", "text/plain")
+        self.send_body(200, result[0], result[1])
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+
+class IGemMockServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server of the mock wiki, with latency and error injection
+
+    :param latency: Seconds every request is delayed
+    :param jitter: Maximum number of seconds added at random to the latency
+    :param error_rate: Fraction of API requests refused with 503 Service Unavailable
+    :param maxlag_rate: Fraction of API requests refused with a maxlag error
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, users=None, latency=0.0, jitter=0.0, error_rate=0.0, maxlag_rate=0.0,
+                 verbose=False):
+        HTTPServer.__init__(self, address, IGemMockHandler)
+        host, port = self.server_address[:2]
+        self.wiki = IGemMockWiki(users=users, base_url="http://{}:{}".format(host, port))
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.maxlag_rate = maxlag_rate
+        self.verbose = verbose
+        self.requests = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return self.wiki.base_url
+
+    @property
+    def api_url(self):
+        return "{}/wiki/api.php".format(self.url)
+
+    @property
+    def login_url(self):
+        return "{}/Login2".format(self.url)
+
+    def count(self, length):
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += length
+
+    def delay(self):
+        delay = self.latency
+        if self.jitter > 0:
+            delay += random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def failure(self):
+        """Decides at random whether a request should be refused and how"""
+        value = random.random()
+        if value < self.error_rate:
+            return "unavailable"
+        if value < self.error_rate + self.maxlag_rate:
+            return "maxlag"
+        return None
+
+    def start(self):
+        """Serves in a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, name="IGemMockServer")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def create_parser():
+    import argparse
+    parser = argparse.ArgumentParser(description="Local stand-in for the iGEM Wiki api.php")
+    parser.add_argument('--host', default="127.0.0.1", help="Address to listen on")
+    parser.add_argument('--port', type=int, default=8080, help="Port to listen on")
+    parser.add_argument(
+        '--user', action="append", default=None,
+        help="Account as username:password, can be given multiple times (default test:test)"
+    )
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds every request is delayed")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Maximum random seconds added to the latency")
+    parser.add_argument('--error-rate', dest="error_rate", type=float, default=0.0,
+                        help="Fraction of API requests refused with 503")
+    parser.add_argument('--maxlag-rate', dest="maxlag_rate", type=float, default=0.0,
+                        help="Fraction of API requests refused with a maxlag error")
+    parser.add_argument('-v', dest="verbose", action="store_true", help="Log every request")
+    return parser
+
+
+if __name__ == "__main__":
+    arguments = create_parser().parse_args()
+    users = dict(u.split(":", 1) for u in (arguments.user or ["test:test"]))
+    server = IGemMockServer(
+        (arguments.host, arguments.port), users=users, latency=arguments.latency, jitter=arguments.jitter,
+        error_rate=arguments.error_rate, maxlag_rate=arguments.maxlag_rate, verbose=arguments.verbose
+    )
+    print("Serving the mock iGEM Wiki at {}".format(server.api_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
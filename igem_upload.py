@@ -5,28 +5,92 @@
 Copyright under MIT License, see LICENSE.
 """
 from __future__ import print_function
-from igem_manager import BaseIGemWikiManager
+from igem_manager import BaseIGemWikiManager, IGemDigestCache, IGemStore, sha1_digest
+from collections import OrderedDict
+import fnmatch
 import os
+import posixpath
+import re
 import sys
+import threading
+import time
 
 if sys.version_info[0] < 3:
     from urlparse import urlparse, urlunparse
+    from HTMLParser import HTMLParser
+    unescape = HTMLParser().unescape
 else:
     from urllib.parse import urlparse, urlunparse
+    from html import unescape
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # backport for Python 2
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 __author__ = "Joeri Jongbloets <joeri@jongbloets.net>"
 
 
+def walk_files(location, enter=None):
+    """Yields the path and stat result of every file below a directory, in sorted order
+
+    With scandir the type of every entry comes from the directory listing, so only files are stat'ed.
+
+    :param enter: Called with every directory before it is listed, return False to skip the directory
+    :rtype: collections.Iterable[(str, os.stat_result)]
+    """
+    stack = [location]
+    while len(stack) > 0:
+        folder = stack.pop()
+        if enter is not None and enter(folder) is False:
+            continue
+        files, folders = [], []
+        try:
+            if scandir is not None:
+                for entry in scandir(folder):
+                    try:
+                        if entry.is_dir():
+                            folders.append(entry.path)
+                        elif entry.is_file():
+                            files.append((entry.path, entry.stat()))
+                    except OSError:
+                        # removed while we were looking
+                        continue
+            else:
+                for name in os.listdir(folder):
+                    path = os.path.join(folder, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    if os.path.isdir(path):
+                        folders.append(path)
+                    else:
+                        files.append((path, stat))
+        except OSError:
+            continue
+        for result in sorted(files):
+            yield result
+        # visit the sub directories in order
+        stack.extend(sorted(folders, reverse=True))
+
+
 class IGemFile(object):
 
     IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'bmp', 'gif')
 
-    def __init__(self, path, destination=None, prefix=None, mime=None, **kwargs):
+    def __init__(self, path, destination=None, prefix=None, mime=None, size=None, **kwargs):
         self._path = path
         self._destination = destination
         self._prefix = prefix
         self._url = None
         self._mime = mime
+        self._digest = None
+        self._size = size
         self._arguments = kwargs
 
     @property
@@ -39,8 +103,17 @@ class IGemFile(object):
 
     @property
     def full_path(self):
+        if self.prefix is None:
+            return self.path
         return os.path.join(self.prefix, self.path)
 
+    @property
+    def relative_path(self):
+        """Path of the file relative to its prefix, i.e. the path used by links in the site"""
+        if self.prefix is None:
+            return self.path
+        return os.path.relpath(self.path, self.prefix).replace(os.sep, "/")
+
     @property
     def extension(self):
         extension = os.path.splitext(self.path)[1]
@@ -70,6 +143,38 @@ class IGemFile(object):
     def mime(self, m):
         self._mime = m
 
+    @property
+    def size(self):
+        """Size of the file in bytes, as found when it was collected"""
+        if self._size is None:
+            self._size = os.path.getsize(self.path)
+        return self._size
+
+    @size.setter
+    def size(self, s):
+        self._size = s
+
+    @property
+    def digest(self):
+        """SHA1 of the file content, None when not calculated yet"""
+        return self._digest
+
+    @digest.setter
+    def digest(self, d):
+        self._digest = d
+
+    def link_keys(self):
+        """All names a link to this file can use: destination, path, full path and url, with and without ./
+
+        :rtype: set[str]
+        """
+        result = set()
+        for name in (self.destination, self.path, self.full_path, self.relative_path, self.url):
+            if name is not None:
+                result.add(name)
+                result.add(name.strip("./"))
+        return result
+
     def exists(self):
         return os.path.exists(self.path)
 
@@ -92,13 +197,390 @@ class IGemFile(object):
         return "{} => {}".format(self.path, self.destination)
 
 
+class IGemBundle(IGemFile):
+    """A stylesheet or script made by concatenating several others, in order"""
+
+    def __init__(self, members, extension):
+        name = sha1_digest("\n".join(m.path for m in members))[:10]
+        name = "bundles/{}.{}".format(name, extension)
+        super(IGemBundle, self).__init__(name, destination=name)
+        self._members = list(members)
+
+    @property
+    def members(self):
+        """Files in the bundle
+
+        :rtype: list[IGemFile]
+        """
+        return self._members
+
+    def exists(self):
+        return all(m.exists() for m in self.members)
+
+    def __str__(self):
+        return "{} files => {}".format(len(self.members), self.destination)
+
+
+class IGemHtmlRewriter(object):
+    """Rewrites attributes of HTML tags in a single pass over the document
+
+    Only the values of the attributes changed by the handler are replaced, everything else
+    (whitespace, comments, case, quotes) is kept exactly as it was.
+    The handler is called with the (lower case) tag name and a dictionary of its (unescaped)
+    attributes and returns a dictionary with the new values of the attributes to change.
+    When the handler returns None instead, the element is removed.
+    The optional text handler is called with the tag name and content of script and style
+    elements and returns the new content.
+    """
+
+    TAG_PATTERN = re.compile(
+        r'<!--.*?-->|<(?P<name>[a-zA-Z][^\s/>]*)(?P<attributes>(?:[^>"\']|"[^"]*"|\'[^\']*\')*)>', re.S
+    )
+    ATTRIBUTE_PATTERN = re.compile(
+        r'(?P<name>[^\s"\'>/=]+)(?:\s*=\s*(?:"(?P<dq>[^"]*)"|\'(?P<sq>[^\']*)\'|(?P<uq>[^\s"\'>]+)))?'
+    )
+    # the content of these tags is not HTML and should not be scanned for tags
+    RAW_TEXT_TAGS = ("script", "style")
+
+    def __init__(self, handler, text_handler=None):
+        self._handler = handler
+        self._text_handler = text_handler
+        self._end_patterns = {}
+
+    def rewrite(self, html):
+        """Returns the document with the attributes changed by the handler
+
+        :type html: str
+        :rtype: str
+        """
+        results = []
+        position = 0
+        while True:
+            match = self.TAG_PATTERN.search(html, position)
+            if match is None:
+                break
+            name = match.group("name")
+            if name is None:
+                # a comment, keep as is
+                results.append(html[position:match.end()])
+                position = match.end()
+                continue
+            name = name.lower()
+            results.append(html[position:match.start()])
+            tag = self.rewrite_tag(name, match)
+            position = match.end()
+            is_raw = name in self.RAW_TEXT_TAGS and not match.group("attributes").rstrip().endswith("/")
+            if tag is None:
+                # drop the element, including its content
+                if is_raw:
+                    position = self.find_end(name, html, position)[1]
+                continue
+            results.append(tag)
+            if is_raw:
+                # skip to the end tag
+                end = self.find_end(name, html, position)[0]
+                text = html[position:end]
+                if self._text_handler is not None:
+                    text = self._text_handler(name, text)
+                results.append(text)
+                position = end
+        results.append(html[position:])
+        return "".join(results)
+
+    def find_end(self, name, html, position):
+        """Returns the start and end of the end tag of a raw text element"""
+        pattern = self._end_patterns.get(name)
+        if pattern is None:
+            pattern = re.compile(r'</{}\s*>'.format(name), re.I)
+            self._end_patterns[name] = pattern
+        match = pattern.search(html, position)
+        if match is None:
+            return len(html), len(html)
+        return match.span()
+
+    def rewrite_tag(self, name, match):
+        """Returns the tag with the values of the changed attributes replaced, None to remove it"""
+        tag = match.group(0)
+        offset = match.start("attributes") - match.start()
+        spans = {}
+        attributes = {}
+        for attribute in self.ATTRIBUTE_PATTERN.finditer(match.group("attributes")):
+            key = attribute.group("name").lower()
+            if key in attributes:
+                # like browsers, only the first occurrence counts
+                continue
+            for group in ("dq", "sq", "uq"):
+                if attribute.group(group) is not None:
+                    attributes[key] = unescape(attribute.group(group))
+                    spans[key] = (attribute.start(group) + offset, attribute.end(group) + offset, group)
+                    break
+            else:
+                attributes[key] = ""
+        changes = self._handler(name, attributes)
+        if changes is None:
+            return None
+        # replace from the end, so the spans before it stay valid
+        for key in sorted(changes.keys(), key=lambda k: spans.get(k, (0,))[0], reverse=True):
+            if key not in spans:
+                continue
+            start, end, quote = spans[key]
+            value = changes[key].replace("&", "&amp;")
+            if quote == "sq":
+                value = value.replace("'", "&#39;")
+            else:
+                value = value.replace('"', "&quot;")
+            if quote == "uq":
+                value = '"{}"'.format(value)
+            tag = tag[:start] + value + tag[end:]
+        return tag
+
+
+class IGemCssRewriter(object):
+    """Rewrites the url(...) and @import references of a stylesheet
+
+    The stylesheet is tokenized lazily, so only the pieces of the result are kept in memory.
+    The handler is called with the kind of reference (import or url) and the (unquoted) reference
+    and returns the new reference, or None to keep it.
+    """
+
+    STRING = r'"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\''
+    TOKEN_PATTERN = re.compile(
+        r'/\*.*?\*/'
+        r'|@import\s+(?:url\(\s*(?P<import_url>{s}|[^)\'"\s]*)\s*\)|(?P<import>{s}))'
+        r'|url\(\s*(?P<url>{s}|[^)\'"\s]*)\s*\)'
+        r'|{s}'.format(s=STRING), re.I | re.S
+    )
+    IMPORT_PATTERN = re.compile(
+        r'/\*.*?\*/'
+        r'|(?P<rule>@import\s+(?:url\(\s*(?:{s}|[^)\'"\s]*)\s*\)|{s})[^;]*;\s*)'
+        r'|{s}'.format(s=STRING), re.I | re.S
+    )
+
+    def __init__(self, handler):
+        self._handler = handler
+
+    @classmethod
+    def split_imports(cls, stylesheet):
+        """Returns the @import rules of a stylesheet and the stylesheet without them
+
+        :rtype: (list[str], str)
+        """
+        imports = []
+
+        def remove(match):
+            if match.group("rule") is None:
+                return match.group(0)
+            imports.append(match.group("rule").strip())
+            return ""
+
+        return imports, cls.IMPORT_PATTERN.sub(remove, stylesheet)
+
+    def rewrite(self, stylesheet):
+        """Returns the stylesheet with the references changed by the handler"""
+        return "".join(self.iter_rewrite(stylesheet))
+
+    def iter_rewrite(self, stylesheet):
+        """Yields the pieces of the rewritten stylesheet"""
+        position = 0
+        for match in self.TOKEN_PATTERN.finditer(stylesheet):
+            for kind, group in (("import", "import_url"), ("import", "import"), ("url", "url")):
+                if match.group(group) is not None:
+                    break
+            else:
+                # comments and strings are kept as is
+                continue
+            start, end = match.span(group)
+            yield stylesheet[position:start]
+            yield self.rewrite_reference(kind, match.group(group))
+            position = end
+        yield stylesheet[position:]
+
+    def rewrite_reference(self, kind, reference):
+        quote = ""
+        if reference[:1] in ("'", '"'):
+            quote = reference[0]
+            reference = reference[1:-1]
+        result = self._handler(kind, reference)
+        if result is None or result == reference:
+            # kept as it was, including its escapes
+            return "{q}{r}{q}".format(q=quote, r=reference)
+        if quote != "":
+            result = result.replace(quote, "\\" + quote)
+        elif re.search(r'[\s()\'"]', result):
+            quote = '"'
+            result = result.replace(quote, "\\" + quote)
+        return "{q}{r}{q}".format(q=quote, r=result)
+
+
+class IGemManifest(IGemStore):
+    """Remembers the content hash, url and mime type of every uploaded title
+
+    Entries are keyed by the destination title of the file.
+    """
+
+    def find(self, f, digest):
+        """Returns the entry of the file if its content did not change since the last upload
+
+        :type f: IGemFile
+        :rtype: dict[str, str] | None
+        """
+        result = None
+        entry = self.get(f.destination)
+        if isinstance(entry, dict) and entry.get("hash") == digest:
+            result = entry
+        return result
+
+    def record(self, f, digest):
+        """Stores the hash, url and mime type of an uploaded file
+
+        :type f: IGemFile
+        """
+        self.set(f.destination, {"hash": digest, "url": f.url, "mime": f.mime})
+
+
+class IGemWatcher(object):
+    """Detects files that are added, changed or removed in directories
+
+    Waits for changes with inotify where available (Linux, with the inotify_simple package), otherwise
+    compares the modification time and size of all files every interval.
+    """
+
+    def __init__(self, roots, interval=1.0):
+        self._roots = list(roots)
+        self._interval = interval
+        self._inotify = None
+        self._watches = set()
+        try:
+            import inotify_simple
+            self._inotify = inotify_simple.INotify()
+            self._inotify_flags = (
+                inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.CREATE | inotify_simple.flags.DELETE |
+                inotify_simple.flags.MODIFY | inotify_simple.flags.MOVED_FROM | inotify_simple.flags.MOVED_TO
+            )
+        except (ImportError, OSError):
+            pass
+        self._state = self.scan()
+
+    @property
+    def uses_inotify(self):
+        return self._inotify is not None
+
+    def scan(self):
+        """Returns the modification time and size of all files in the directories
+
+        :rtype: dict[str, (float, int)]
+        """
+        results = {}
+        for root in self._roots:
+            for path, stat in walk_files(root, enter=self.add_watch):
+                results[os.path.normpath(path)] = (stat.st_mtime, stat.st_size)
+        return results
+
+    def add_watch(self, location):
+        if self._inotify is not None and location not in self._watches:
+            try:
+                self._inotify.add_watch(location, self._inotify_flags)
+                self._watches.add(location)
+            except OSError:
+                pass
+        return True
+
+    def changes(self):
+        """Returns the files changed (or added) and removed since the last call
+
+        :rtype: (set[str], set[str])
+        """
+        state = self.scan()
+        changed = set(path for path, stat in state.items() if self._state.get(path) != stat)
+        removed = set(self._state.keys()) - set(state.keys())
+        self._state = state
+        return changed, removed
+
+    def wait_for_event(self, timeout):
+        """Waits timeout seconds or, with inotify, until something happens
+
+        :return: Whether the files may have changed
+        """
+        if self._inotify is None:
+            time.sleep(timeout)
+            return True
+        events = self._inotify.read(timeout=int(timeout * 1000))
+        return len(events) > 0
+
+    def wait(self, debounce=1.0):
+        """Blocks until files changed, then until no changes were seen for debounce seconds
+
+        A rebuild writes many files in a burst, those are returned together.
+
+        :rtype: (set[str], set[str])
+        """
+        changed, removed = set(), set()
+        is_waiting = True
+        while True:
+            timeout = self._interval if is_waiting else debounce
+            if self.wait_for_event(timeout):
+                new_changed, new_removed = self.changes()
+            else:
+                new_changed, new_removed = set(), set()
+            if len(new_changed) + len(new_removed) == 0:
+                if not is_waiting:
+                    return changed, removed
+                continue
+            is_waiting = False
+            changed = (changed - new_removed) | new_changed
+            removed = (removed - new_changed) | new_removed
+
+
 class IGemUploader(BaseIGemWikiManager):
 
+    # maximum number of rewritten links to remember
+    REWRITE_CACHE_SIZE = 4096
+    # seconds between checks for changes in watch mode, and of quiet before the changes are uploaded
+    WATCH_INTERVAL = 1.0
+    WATCH_DEBOUNCE = 1.0
+
     def __init__(self, team=None, year=None):
         super(IGemUploader, self).__init__(team=team, year=year)
         self._files_collected = []
         self._files_uploaded = []
         self._strip_paths = False
+        self._lock = threading.Lock()
+        self._manifest = None
+        self._force = False
+        self._files_skipped = []
+        self._files_existing = {}
+        self._files_index = {}
+        self._files_keys = {}
+        self._files_by_path = {}
+        self._files_version = 0
+        self._rewrite_cache = OrderedDict()
+        self._bundle = False
+        self._bundles_index = {}
+        self._bundles_by_page = {}
+        # links of every prepared file, to find the pages to fix when a file they link to changes
+        self._dependencies = {}
+        self._local = threading.local()
+        self._watched = {}
+        self._include = []
+        self._exclude = []
+        self._digest_cache = IGemDigestCache()
+
+    def reset(self):
+        """Forgets the files of the previous run
+
+        The manifest, content hashes, rewritten links and the index of the files on the wiki are kept, a file
+        registered again replaces the entry of its earlier run.
+        """
+        super(IGemUploader, self).reset()
+        with self._lock:
+            self._files_collected = []
+            self._files_uploaded = []
+            self._files_skipped = []
+            self._files_existing = {}
+            self._bundles_index = {}
+            self._bundles_by_page = {}
+            self._dependencies = {}
+            self._watched = {}
 
     @property
     def collected_files(self):
@@ -116,6 +598,79 @@ class IGemUploader(BaseIGemWikiManager):
         """
         return self._files_uploaded
 
+    @property
+    def skipped_files(self):
+        """List of files that were not uploaded, because they did not change since the last upload
+
+        :rtype: list[IGemFile]
+        """
+        return self._files_skipped
+
+    @property
+    def manifest(self):
+        """Manifest of previous uploads, None if we do not keep track of them
+
+        :rtype: IGemManifest | None
+        """
+        return self._manifest
+
+    def use_manifest(self, location):
+        self._manifest = IGemManifest(location).load()
+        self.get_logger().info("Loaded manifest {} with {} entries".format(location, len(self._manifest)))
+
+    def do_bundle(self):
+        return self._bundle is True
+
+    def set_bundle(self, state):
+        self._bundle = state is True
+
+    def is_forced(self):
+        return self._force is True
+
+    def set_force(self, state):
+        self._force = state is True
+
+    @property
+    def digest_cache(self):
+        """Content hashes of the files, can be shared with other uploaders
+
+        :rtype: IGemDigestCache
+        """
+        return self._digest_cache
+
+    @digest_cache.setter
+    def digest_cache(self, cache):
+        self._digest_cache = cache
+
+    @property
+    def include(self):
+        """Patterns of the files to collect, all files when empty
+
+        :rtype: list[str]
+        """
+        return self._include
+
+    def set_include(self, patterns):
+        self._include = self.parse_patterns(patterns)
+
+    @property
+    def exclude(self):
+        """Patterns of the files and directories to skip
+
+        :rtype: list[str]
+        """
+        return self._exclude
+
+    def set_exclude(self, patterns):
+        self._exclude = self.parse_patterns(patterns)
+
+    @staticmethod
+    def parse_patterns(patterns):
+        """Accepts a list of patterns, or comma separated patterns (from the ini file)"""
+        if isinstance(patterns, str):
+            patterns = patterns.split(",")
+        return [p.strip() for p in patterns if p.strip() != ""]
+
     def do_strip(self):
         return self._strip_paths is True
 
@@ -129,17 +684,18 @@ class IGemUploader(BaseIGemWikiManager):
             if self.login():
                 uploads = self.upload_files()
                 self.get_logger().info("Uploaded {} files".format(uploads))
+        if action == "plan":
+            self.plan_files()
+        if action == "watch":
+            if self.login():
+                self.watch_files()
 
     def collect_patterns(self, patterns):
-        results = []
-        for pattern in patterns:
-            result = self.collect_pattern(pattern)
-            results.extend(result)
-            self.get_logger().debug("Collected {} files matching pattern {}".format(
-                    len(result), pattern
-                )
-            )
-        # do post processing ?!
+        """Collects the files matching the patterns as the files to upload
+
+        :rtype: list[IGemFile]
+        """
+        results = self.match_patterns(patterns)
         self._files_collected = results
         self.get_logger().debug("Collected {} files in total".format(
                 len(results)
@@ -147,105 +703,566 @@ class IGemUploader(BaseIGemWikiManager):
         )
         return results
 
+    def match_patterns(self, patterns):
+        """Finds the files matching the patterns, skipping files that would get the title of another file
+
+        A file matched by more than one pattern is only returned once.
+
+        :rtype: list[IGemFile]
+        """
+        results = []
+        paths = set()
+        titles = {}
+        for pattern in patterns:
+            count = 0
+            for f in self.iter_pattern(pattern):
+                path = os.path.normpath(f.path)
+                if path in paths:
+                    continue
+                paths.add(path)
+                # compare the titles the wiki will use, uploads get a File page without slashes
+                title = self.destination_name(f)
+                title = self.file_title(title) if f.is_resource() else self.prefix_title(title)
+                other = titles.setdefault(title, f)
+                if other is not f:
+                    print("## Skipped {}, {} already uploads to {}".format(f.path, other.path, title))
+                    continue
+                results.append(f)
+                count += 1
+            self.get_logger().debug("Collected {} files matching pattern {}".format(count, pattern))
+        return results
+
     def collect_pattern(self, pattern, base=None):
+        return list(self.iter_pattern(pattern, base=base))
+
+    def iter_pattern(self, pattern, base=None):
+        """Yields the files matching a pattern, including all files in the directories it matches
+
+        :rtype: collections.Iterable[IGemFile]
+        """
         import glob
-        results = []
         if self.do_strip() and base is None:
             base = os.path.dirname(pattern)
-        for source in glob.glob(pattern):
-            if os.path.exists(source):
-                if os.path.isdir(source):
-                    # take all files from the directory
-                    results.extend(self.collect_pattern(os.path.join(source, "*"), base=base))
-                if os.path.isfile(source):
-                    result = self.collect_file(source, base=base)
-                    # TODO: Duplicate destination check?!
-                    results.append(result)
-        # squash files
-        return results
-
-    def collect_file(self, source, base=None):
+        # glob and walk_files keep the directory of the pattern in front of the paths they return
+        root = os.path.dirname(pattern)
+        offset = len(os.path.join(root, "")) if root != "" else 0
+
+        def enter(folder):
+            # like glob, skip hidden directories
+            hidden = folder != source and os.path.basename(folder).startswith(".")
+            return not hidden and not self.is_excluded(folder[offset:])
+
+        for source in sorted(glob.glob(pattern)):
+            try:
+                stat = os.stat(source)
+            except OSError:
+                continue
+            if os.path.isdir(source):
+                # take all files from the directory
+                for path, stat in walk_files(source, enter=enter):
+                    hidden = os.path.basename(path).startswith(".")
+                    if not hidden and self.is_collected(path[offset:]):
+                        yield self.collect_file(path, base=base, size=stat.st_size)
+            elif self.is_collected(source[offset:]):
+                yield self.collect_file(source, base=base, size=stat.st_size)
+
+    def is_excluded(self, path):
+        """Whether the file or directory matches an exclude pattern, by its name or path (relative to the pattern)"""
+        if len(self.exclude) == 0:
+            return False
+        path = path.replace(os.sep, "/")
+        name = posixpath.basename(path)
+        return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(path, p) for p in self.exclude)
+
+    def is_collected(self, path):
+        if self.is_excluded(path):
+            return False
+        if len(self.include) == 0:
+            return True
+        path = path.replace(os.sep, "/")
+        name = posixpath.basename(path)
+        return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(path, p) for p in self.include)
+
+    def collect_file(self, source, base=None, size=None):
         destination = None
         if base is not None:
             # remove pattern from the file name
             destination = source.replace(base, "", 1)
-        return IGemFile(source, destination=destination, prefix=base)
+        return IGemFile(source, destination=destination, prefix=base, size=size)
 
     def upload_files(self):
         results = 0
+        if self.do_bundle():
+            self.bundle_files()
         # collected files is a list of IGemFile objects
-        files = self.collected_files
+        files = list(self.collected_files)
         # first we upload resources so we can update their destinations
-        resources = filter(lambda f: f.is_resource(), files)
-        print("## Uploading {} resources".format(len(resources)))
-        for resource in resources:
-            results += 1 if self.upload_resource(resource) else 0
+        resources = [f for f in files if f.is_resource()]
+        self.find_existing_resources(resources)
+        results += self.upload_phase("resources", resources, self.upload_resource)
         # upload all stylesheets
-        resources = filter(lambda f: f.is_stylesheet(), files)
-        print("## Uploading {} stylesheets".format(len(resources)))
-        for resource in resources:
-            results += 1 if self.upload_stylesheet(resource) else 0
-        resources = filter(lambda f: f.is_javascript(), files)
-        print("## Uploading {} javascripts".format(len(resources)))
-        for resource in resources:
-            results += 1 if self.upload_stylesheet(resource) else 0
+        resources = [f for f in files if f.is_stylesheet()]
+        results += self.upload_phase("stylesheets", resources, self.upload_stylesheet)
+        resources = [f for f in files if f.is_javascript()]
+        results += self.upload_phase("javascripts", resources, self.upload_javascript)
         # upload all html
-        resources = filter(lambda f: f.is_html(), files)
-        print("## Uploading {} html files".format(len(resources)))
-        for resource in resources:
-            results += 1 if self.upload_html(resource) else 0
+        resources = [f for f in files if f.is_html()]
+        results += self.upload_phase("html files", resources, self.upload_html)
+        if len(self.skipped_files) > 0:
+            print("## Skipped {} files already on the wiki".format(len(self.skipped_files)))
+        if self.manifest is not None and not self.runs_dry():
+            self.manifest.save()
         return results
 
+    def bundle_files(self):
+        """Combines the stylesheets and scripts included by each page into one bundle of each
+
+        Bundles keep the order in which the page includes the files, and include every file once.
+        Pages including the same files share the bundle. The bundles replace the files they contain
+        in the collected files, unless a page includes a file without bundling it.
+
+        :return: The bundles created
+        :rtype: list[IGemBundle]
+        """
+        index = {}
+        for f in self.collected_files:
+            if f.is_stylesheet() or f.is_javascript():
+                for key in f.link_keys():
+                    index.setdefault(key, f)
+        self._bundles_index = index
+        bundles = {}
+        # files still needed on their own, like stylesheets imported by other stylesheets
+        required = set()
+        for f in self.collected_files:
+            if f.is_stylesheet() and f.exists():
+                required.update(self.find_imports(f))
+        pages = [f for f in self.collected_files if f.is_html() and f.exists()]
+        for page in pages:
+            self.resolve_destination(page)
+            members = []
+
+            def collect(tag, attributes):
+                link = self.include_link(tag, attributes)
+                if link is not None:
+                    members.append(self.find_bundle_member(link[1]))
+                return {}
+
+            IGemHtmlRewriter(collect).rewrite(self.read_content(page))
+            page_bundles = {}
+            for extension in ("css", "js"):
+                files = []
+                for member in members:
+                    if member is not None and member.extension == extension and member not in files:
+                        files.append(member)
+                if len(files) < 2:
+                    required.update(files)
+                    continue
+                key = tuple(f.path for f in files)
+                if key not in bundles:
+                    bundles[key] = IGemBundle(files, extension)
+                for f in files:
+                    page_bundles[f] = bundles[key]
+            self._bundles_by_page[page.destination] = page_bundles
+        bundled = set(f for bundle in bundles.values() for f in bundle.members) - required
+        with self._lock:
+            for f in bundled:
+                self.collected_files.remove(f)
+            self.collected_files.extend(bundles.values())
+        print("## Bundled {} stylesheets and scripts into {} bundles".format(len(bundled), len(bundles)))
+        return list(bundles.values())
+
+    def find_imports(self, f):
+        """Returns the collected stylesheets a stylesheet includes with @import
+
+        :rtype: list[IGemFile]
+        """
+        results = []
+        folder = posixpath.dirname(f.relative_path)
+
+        def collect(kind, reference):
+            parts = urlparse(reference)
+            if kind == "import" and parts.scheme == "" and parts.netloc == "" and parts.path != "":
+                path = parts.path
+                if not path.startswith("/"):
+                    path = posixpath.normpath(posixpath.join(folder, path))
+                member = self.find_bundle_member(path)
+                if member is not None:
+                    results.append(member)
+            return None
+
+        IGemCssRewriter(collect).rewrite(self.read_content(f))
+        return results
+
+    @staticmethod
+    def include_link(tag, attributes):
+        """Returns the attribute and link of a tag including a stylesheet or script, None for other tags
+
+        :rtype: tuple[str, str] | None
+        """
+        result = None
+        if tag == "link" and "stylesheet" in attributes.get("rel", "").split() and "href" in attributes:
+            result = ("href", attributes["href"])
+        if tag == "script" and "src" in attributes:
+            result = ("src", attributes["src"])
+        return result
+
+    def find_bundle_member(self, link):
+        """Returns the collected stylesheet or script a link refers to
+
+        :rtype: IGemFile | None
+        """
+        result = self._bundles_index.get(link)
+        if result is None:
+            result = self._bundles_index.get(link.strip("./"))
+        return result
+
+    def find_existing_resources(self, files):
+        """Looks up which resources are already on the wiki with exactly the same content
+
+        First checks the titles the files would be uploaded to (in batches), then searches
+        the remaining files by their SHA1, in case they were uploaded under another name.
+
+        :type files: list[IGemFile]
+        :return: The wiki information of every file already on the wiki
+        :rtype: dict[str, dict[str, str]]
+        """
+        if self.is_forced():
+            return self._files_existing
+        candidates = []
+        for f in files:
+            if not f.exists():
+                continue
+            self.resolve_destination(f)
+            f.digest = self.digest_cache.digest(f.path)
+            if self.manifest is None or self.manifest.find(f, f.digest) is None:
+                candidates.append(f)
+        info = self.file_info([f.destination for f in candidates])
+        missing = []
+        for f in candidates:
+            remote = info.get(f.destination)
+            if remote is not None and remote.get("sha1") == f.digest:
+                self._files_existing[f.destination] = remote
+            else:
+                missing.append(f)
+        for f, remote in zip(missing, self.find_files([m.digest for m in missing])):
+            if remote is not None:
+                self._files_existing[f.destination] = remote
+        self.get_logger().info("Found {} of {} resources on the wiki".format(
+            len(self._files_existing), len(files)
+        ))
+        return self._files_existing
+
+    def upload_phase(self, name, files, method):
+        """Uploads one group of files, in parallel when more than one job is allowed
+
+        A phase is finished before the next one starts, so later phases can link to its files.
+
+        :type files: list[IGemFile]
+        :return: Number of files uploaded successfully
+        :rtype: int
+        """
+        print("## Uploading {} {}".format(len(files), name))
+        results = self.map_jobs(method, files)
+        return len([r for r in results if r])
+
+    def plan_files(self):
+        """Compares the collected files with the current state of the wiki
+
+        Prints for every file whether an upload would create, change or keep its title.
+        Pages are compared using the prepared content, i.e. what upload would actually send.
+        Unless running dry, the files to keep are recorded in the manifest (when used), so the next
+        upload skips them.
+
+        :return: The action per file (create, change or keep)
+        :rtype: list[tuple[IGemFile, str]]
+        """
+        results = []
+        if self.do_bundle():
+            self.bundle_files()
+        files = list(self.collected_files)
+        for f in files:
+            self.resolve_destination(f)
+        # resources first, their urls are needed to prepare the pages
+        resources = [f for f in files if f.is_resource() and f.exists()]
+        info = self.file_info([f.destination for f in resources])
+        for f in resources:
+            remote = info.get(f.destination)
+            digest = self.digest_cache.digest(f.path)
+            if remote is not None:
+                f.url = remote.get("url")
+                f.mime = remote.get("mime")
+                self.register_file(f)
+            results.append((f, self.plan_action(remote, digest), digest))
+        # pages will be available at their prefixed url
+        pages = [f for f in files if not f.is_resource() and f.exists()]
+        for f in pages:
+            f.url = self.prefix_url(f.destination)
+            self.register_file(f)
+        info = self.page_info([f.destination for f in pages])
+        for f in pages:
+            content = self.prepare_content(f)
+            # the wiki stores pages with normalized line endings and without trailing whitespace
+            digest = sha1_digest(content.replace("\r\n", "\n").rstrip())
+            results.append((f, self.plan_action(info.get(f.destination), digest), sha1_digest(content)))
+        counts = {}
+        print("## Plan for {} files".format(len(results)))
+        for f, action, digest in results:
+            print("{action:6} {title}".format(action=action, title=f.destination))
+            counts[action] = counts.get(action, 0) + 1
+        print("## {} to create, {} to change, {} unchanged".format(
+            counts.get("create", 0), counts.get("change", 0), counts.get("keep", 0)
+        ))
+        if self.manifest is not None and not self.runs_dry():
+            # remember unchanged files, so the next upload can skip them
+            for f, action, digest in results:
+                if action == "keep":
+                    self.manifest.record(f, digest)
+            self.manifest.save()
+        return [(f, action) for f, action, digest in results]
+
+    @staticmethod
+    def plan_action(remote, digest):
+        """Decides what an upload would do, given the remote revision (or file) information"""
+        result = "create"
+        if remote is not None:
+            result = "change"
+            if remote.get("sha1") == digest:
+                result = "keep"
+        return result
+
     def upload_file(self, f, content=None):
         """Core function acts as interface between edit and the upload methods
 
+        Files that did not change since the last upload (according to the manifest) are skipped.
+
         :type f: IGemFile
         """
+        start = time.time()
         result = False
+        digest = None
+        size = 0
         if f.is_resource():
             # upload using the upload method
             if f.exists():
-                result = self.upload(f.destination, f.path)
-                url = result.get("url")
-                mime = result.get("mime")
-                if url is not None:
-                    f.url = url
-                if mime is not None:
-                    f.mime = mime
+                if f.digest is None:
+                    f.digest = self.digest_cache.digest(f.path)
+                digest = f.digest
+                size = f.size
+                if self.skip_unchanged(f, digest) or self.skip_existing(f, digest):
+                    result = True
+                else:
+                    response = self.upload(f.destination, f.path)
+                    result = response.get("result") is True
+                    self.get_logger().debug("Uploaded {}: {}".format(f, result))
+                    url = response.get("url")
+                    mime = response.get("mime")
+                    if url is not None:
+                        f.url = url
+                    if mime is not None:
+                        f.mime = mime
         else:
             if content is None and f.exists():
-                with open(f.path, "rb") as src:
-                    content = "".join(src.readlines())
+                content = self.read_content(f)
             if content is not None:
-                result = self.edit(f.destination, content)
-                self.get_logger().debug("Uploaded {}: {}".format(f, result))
-                f.url = self.prefix_url(f.destination)
+                digest = sha1_digest(content)
+                size = len(content)
+                if self.skip_unchanged(f, digest):
+                    result = True
+                else:
+                    result = self.edit(f.destination, content)
+                    self.get_logger().debug("Uploaded {}: {}".format(f, result))
+                    f.url = self.prefix_url(f.destination)
         if result:
-            self.collected_files.remove(f)
-            self.uploaded_files.append(f)
+            if self.manifest is not None and not self.runs_dry():
+                self.manifest.record(f, digest)
+            self.register_file(f)
+        self.metrics.record_file(f.destination, time.time() - start, size)
+        return result
+
+    def watch_files(self):
+        """Uploads the collected files, then uploads the files that change until interrupted
+
+        Only changed files are uploaded, together with the pages and stylesheets that link to a file
+        that got a new url (e.g. a new image). With bundles, all files are uploaded again (but the
+        manifest still skips unchanged files).
+        """
+        self._watched = dict((os.path.normpath(f.path), f) for f in self.collected_files)
+        self.upload_files()
+        roots = self.watch_roots()
+        watcher = IGemWatcher(roots, interval=self.WATCH_INTERVAL)
+        print("## Watching {} for changes{}, press Ctrl+C to stop".format(
+            ", ".join(roots), " (inotify)" if watcher.uses_inotify else ""
+        ))
+        try:
+            while True:
+                changed, removed = watcher.wait(debounce=self.WATCH_DEBOUNCE)
+                self.upload_changes(changed, removed)
+        except KeyboardInterrupt:
+            print("## Stopped watching")
+
+    def watch_roots(self):
+        """Directories to watch: the part of each pattern before the first wildcard"""
+        results = []
+        for pattern in self._files:
+            root = pattern
+            while any(c in root for c in "*?["):
+                root = os.path.dirname(root)
+            if os.path.isfile(root):
+                root = os.path.dirname(root)
+            root = root if root != "" else "."
+            if root not in results:
+                results.append(root)
+        return results
+
+    def upload_changes(self, changed, removed):
+        """Uploads changed files and the files that link to a file that got a new url
+
+        :param changed: Paths of the files that were added or changed
+        :param removed: Paths of the files that were removed (these stay on the wiki)
+        :return: Number of files uploaded
+        """
+        changed = set(os.path.normpath(path) for path in changed)
+        for path in removed:
+            f = self._watched.pop(os.path.normpath(path), None)
+            if f is not None:
+                print("## Removed {}, it stays on the wiki as {}".format(path, f.destination))
+        if len(set(changed) - set(self._watched.keys())) > 0:
+            # match again to find the new files, with the destination the pattern gives them
+            for f in self.match_patterns(self._files):
+                self._watched.setdefault(os.path.normpath(f.path), f)
+        files = [self._watched[path] for path in sorted(changed) if path in self._watched]
+        if len(files) == 0:
+            return 0
+        print("## {} files changed".format(len(files)))
+        for f in files:
+            # the content changed, so its checksum did too
+            f.digest = None
+        if self.do_bundle():
+            self._files_collected = list(self._watched.values())
+            return self.upload_files()
+        results = 0
+        moved = set()
+        phases = (
+            ("resources", IGemFile.is_resource, self.upload_resource),
+            ("stylesheets", IGemFile.is_stylesheet, self.upload_stylesheet),
+            ("javascripts", IGemFile.is_javascript, self.upload_javascript),
+            ("html files", IGemFile.is_html, self.upload_html),
+        )
+        for name, is_kind, method in phases:
+            # files linking to a file with a new url need their links fixed
+            dependents = [f for f in self.find_dependents(moved) if f not in files]
+            phase = [f for f in files if is_kind(f)] + [f for f in dependents if is_kind(f)]
+            if len(phase) == 0:
+                continue
+            urls = dict((f, f.url) for f in phase)
+            results += self.upload_phase(name, phase, method)
+            moved.update(f for f in phase if f.url != urls[f])
+        if self.manifest is not None and not self.runs_dry():
+            self.manifest.save()
+        return results
+
+    def register_file(self, f):
+        """Marks a file as present on the wiki, so links to it can be resolved
+
+        :type f: IGemFile
+        """
+        with self._lock:
+            if f in self.collected_files:
+                self.collected_files.remove(f)
+            if f not in self._files_keys:
+                self.uploaded_files.append(f)
+            self.index_file(f)
+
+    def index_file(self, f):
+        """Adds all names of the file to the link index, replacing the names it was indexed with before
+
+        Must be called with the lock held.
+
+        :type f: IGemFile
+        """
+        if f in self._files_keys:
+            # links that resolved to the old names of the file are no longer valid
+            self._rewrite_cache.clear()
+        for key in self._files_keys.pop(f, ()):
+            if self._files_index.get(key) is f:
+                del self._files_index[key]
+        # the same file collected in an earlier run (e.g. of the daemon)
+        path = os.path.normpath(f.path)
+        earlier = self._files_by_path.get(path)
+        if earlier is not None and earlier is not f:
+            if (earlier.destination, earlier.url, earlier.mime) != (f.destination, f.url, f.mime):
+                self._rewrite_cache.clear()
+            for key in self._files_keys.pop(earlier, ()):
+                if self._files_index.get(key) is earlier:
+                    del self._files_index[key]
+        self._files_by_path[path] = f
+        # links that did not resolve to a file may resolve to this one
+        self._files_version += 1
+        keys = f.link_keys()
+        for key in keys:
+            # the first file registered under a name keeps it
+            self._files_index.setdefault(key, f)
+        self._files_keys[f] = keys
+
+    def skip_unchanged(self, f, digest):
+        """Checks the manifest whether the file was uploaded before with the same content
+
+        When it was, the stored url and mime type are restored on the file.
+
+        :type f: IGemFile
+        :rtype: bool
+        """
+        result = False
+        if self.manifest is not None and not self.is_forced():
+            entry = self.manifest.find(f, digest)
+            if entry is not None:
+                f.url = entry.get("url")
+                f.mime = entry.get("mime")
+                with self._lock:
+                    self.skipped_files.append(f)
+                self.get_logger().info("Skipped unchanged {}".format(f))
+                result = True
         return result
 
+    def skip_existing(self, f, digest):
+        """Checks whether a file with the same content is already on the wiki
+
+        When it is, the url and mime type of that file are used instead of uploading it again.
+
+        :type f: IGemFile
+        :rtype: bool
+        """
+        result = False
+        remote = self._files_existing.get(f.destination)
+        if remote is not None and remote.get("sha1") == digest:
+            f.url = remote.get("url")
+            f.mime = remote.get("mime")
+            with self._lock:
+                self.skipped_files.append(f)
+            self.get_logger().info("Skipped {}, already on the wiki as {}".format(f, f.url))
+            result = True
+        return result
+
+    def read_content(self, f):
+        """Reads the (text) content of a file
+
+        :type f: IGemFile
+        :rtype: str
+        """
+        with open(f.path, "rb") as src:
+            content = src.read()
+        return content.decode("utf-8")
+
     def upload_html(self, f):
         """Upload HTML files
 
         :type f: IGemFile
         """
         result = False
-        # remove any .html extension from the file
-        if f.destination is None:
-            f.destination = f.path
-        name = f.destination
-        name = name.lstrip("./")
-        if name.endswith(".html"):
-            name = name.replace(".html", "")
-        f.destination = self.prefix_title(name)
+        self.resolve_destination(f)
         if f.exists():
-            # obtain content
-            with open(f.path, "rb") as src:
-                content = "".join(src.readlines())
-            # process content
-            content = self.prepare_html(content)
-            self.upload_file(f, content)
+            content = self.prepare_content(f)
+            result = self.upload_file(f, content)
         return result
 
     def upload_stylesheet(self, f):
@@ -254,100 +1271,272 @@ class IGemUploader(BaseIGemWikiManager):
          :type f: IGemFile
         """
         result = False
-        if f.destination is None:
-            f.destination = f.path
-        name = f.destination
-        name = name.lstrip("./")
-        if name.endswith(".css"):
-            name = name.replace(".css", "")
-        f.destination = self.prefix_title(name)
+        self.resolve_destination(f)
         if f.exists():
-            # obtain content
-            with open(f.path, "rb") as src:
-                content = "".join(src.readlines())
-            # process content
-            content = self.prepare_stylesheet(content)
-            self.upload_file(f, content)
+            content = self.prepare_content(f)
+            result = self.upload_file(f, content)
         return result
 
     def upload_javascript(self, f):
-        """Upload a CSS Stylesheet
+        """Upload a JavaScript
 
          :type f: IGemFile
         """
         result = False
-        if f.destination is None:
-            f.destination = f.path
-        name = f.destination
-        name = name.lstrip("./")
-        if name.endswith(".css"):
-            name = name.replace(".css", "")
-        f.destination = self.prefix_title(name)
+        self.resolve_destination(f)
         if f.exists():
-            # obtain content
-            with open(f.path, "rb") as src:
-                content = "".join(src.readlines())
-            # process content
-            content = self.prepare_javascript(content)
-            self.upload_file(f, content)
+            content = self.prepare_content(f)
+            result = self.upload_file(f, content)
         return result
 
     def upload_resource(self, f):
         """Upload resources like Images, PDFs etc."""
         result = False
-        if f.destination is None:
-            f.destination = f.path
-        name = f.destination
-        name = name.lstrip("./")
-        name = self.prefix_title(name)
-        f.destination = self.prefix_title(name)
+        self.resolve_destination(f)
         if f.exists():
             self.get_logger().info("Upload attachment {}".format(f))
             result = self.upload_file(f)
         return result
 
-    def prepare_html(self, html):
-        from bs4 import BeautifulSoup
-        doc = BeautifulSoup(html, "html.parser")
+    def resolve_destination(self, f):
+        """Determines the title of the file on the wiki and stores it as its destination
+
+        HTML and CSS files lose their extension, all other files keep it.
+
+        :type f: IGemFile
+        :rtype: str
+        """
+        f.destination = self.prefix_title(self.destination_name(f))
+        return f.destination
+
+    def destination_name(self, f):
+        """Title the file will get on the wiki (before the team prefix), without changing its destination
+
+        :type f: IGemFile
+        :rtype: str
+        """
+        name = f.destination
+        if name is None:
+            name = f.path
+        name = name.lstrip("./")
+        if name.endswith(".html") and f.is_html():
+            name = name.replace(".html", "")
+        if name.endswith(".css") and f.is_stylesheet():
+            name = name.replace(".css", "")
+        return name
+
+    def prepare_content(self, f):
+        """Reads the content of a HTML, CSS or JS file and fixes the links in it
+
+        The links found are remembered as dependencies of the file.
+
+        :type f: IGemFile
+        :rtype: str
+        """
+        is_outer = getattr(self._local, "links", None) is None
+        if is_outer:
+            self._local.links = {}
+        try:
+            if isinstance(f, IGemBundle):
+                return self.prepare_bundle(f)
+            content = self.read_content(f)
+            if f.is_html():
+                content = self.prepare_html(content, base=f.destination)
+            if f.is_stylesheet():
+                content = self.prepare_stylesheet(content, base=f.destination)
+            if f.is_javascript():
+                content = self.prepare_javascript(content)
+            return content
+        finally:
+            if is_outer:
+                with self._lock:
+                    self._dependencies[f] = self._local.links
+                self._local.links = None
+
+    def find_dependents(self, files):
+        """Returns the prepared files that link to one of the given files
+
+        Links that did not resolve before are looked up again, as they may refer to a new file.
+
+        :type files: collections.Iterable[IGemFile]
+        :rtype: set[IGemFile]
+        """
+        files = set(files)
+        results = set()
+        with self._lock:
+            dependencies = list(self._dependencies.items())
+        for f, links in dependencies:
+            for link, target in links.items():
+                if target is None:
+                    target = self.find_actual_link(link)
+                if target in files:
+                    results.add(f)
+                    break
+        return results
+
+    def prepare_bundle(self, bundle):
+        """Concatenates the prepared content of the files in a bundle
+
+        :type bundle: IGemBundle
+        :rtype: str
+        """
+        results = []
+        for f in bundle.members:
+            self.resolve_destination(f)
+            results.append(self.prepare_content(f))
+        if bundle.is_stylesheet():
+            # browsers ignore @import rules after other rules, so they go first
+            imports = []
+            for idx, content in enumerate(results):
+                rules, results[idx] = IGemCssRewriter.split_imports(content)
+                imports.extend(rules)
+            if len(imports) > 0:
+                results.insert(0, "\n".join(imports))
+        separator = "\n"
+        if bundle.is_javascript():
+            # protect against scripts without a final semicolon
+            separator = "\n;\n"
+        return separator.join(results)
+
+    def prepare_html(self, html, base=None):
+        """Inspect a HTML page on URL's we should change
+
+        :param base: Title of the page, used to resolve relative references in styles
+            and to find the bundles of the page
+        """
+        bundles = self._bundles_by_page.get(base, {})
+        included = set()
+
+        def fix_tag(tag, attributes):
+            link = None
+            if len(bundles) > 0:
+                link = self.include_link(tag, attributes)
+            if link is not None:
+                bundle = bundles.get(self.find_bundle_member(link[1]))
+                if bundle is not None:
+                    # include the bundle instead of the first file in it, drop the others
+                    if bundle in included:
+                        return None
+                    included.add(bundle)
+                    attributes = dict(attributes)
+                    attributes[link[0]] = bundle.destination
+            return self.fix_html_tag(tag, attributes, base=base)
+
+        rewriter = IGemHtmlRewriter(
+            fix_tag, lambda tag, text: self.prepare_stylesheet(text, base=base) if tag == "style" else text
+        )
+        return rewriter.rewrite(html)
+
+    def fix_html_tag(self, tag, attributes, base=None):
+        """Fixes the links to stylesheets, scripts, pages and images in a HTML tag
+
+        :return: New values of the changed attributes
+        :rtype: dict[str, str]
+        """
+        result = {}
         # fix all stylesheet imports
-        elements = doc.find_all("link", rel="stylesheet")
-        for e in elements:
-            href = e.get("href")
-            if href is not None:
-                uri = self.fix_stylesheet_link(href)
-                self.get_logger().debug("Changed stylesheet href {} to {}".format(href, uri))
-                e["href"] = uri
-        elements = doc.find_all("script")
+        href = attributes.get("href")
+        if tag == "link" and "stylesheet" in attributes.get("rel", "").split() and href is not None:
+            result["href"] = self.rewrite_link("stylesheet", href)
+            self.get_logger().debug("Changed stylesheet href {} to {}".format(href, result["href"]))
         # fix all javascript imports
-        for e in elements:
-            src = e.get("src")
-            if src is not None:
-                uri = self.fix_javascript_source(src)
-                self.get_logger().debug("Changed script src {} to {}".format(src, uri))
-                e["src"] = uri
+        src = attributes.get("src")
+        if tag == "script" and src is not None:
+            result["src"] = self.rewrite_link("javascript", src)
+            self.get_logger().debug("Changed script src {} to {}".format(src, result["src"]))
         # fix all links
-        elements = doc.find_all("a")
-        for e in elements:
-            href = e.get("href")
-            if href is not None:
-                uri = self.fix_html_link(href)
-                self.get_logger().debug("Changed link href {} to {}".format(href, uri))
-                e["href"] = uri
+        if tag == "a" and href is not None:
+            result["href"] = self.rewrite_link("html", href)
+            self.get_logger().debug("Changed link href {} to {}".format(href, result["href"]))
         # fix all image links
-        elements = doc.find_all("img")
-        for e in elements:
-            src = e.get("src")
-            if src is not None:
-                uri = self.fix_image_link(src)
-                self.get_logger().debug("Changed img src {} to {}".format(src, uri))
-                e["src"] = uri
-        # write to string
-        result = doc.prettify()
+        if tag == "img" and src is not None:
+            result["src"] = self.rewrite_link("image", src)
+            self.get_logger().debug("Changed img src {} to {}".format(src, result["src"]))
+        # fix references in inline styles
+        style = attributes.get("style")
+        if style is not None and "url(" in style.lower():
+            result["style"] = self.prepare_stylesheet(style, base=base)
+        return result
+
+    def rewrite_link(self, kind, link):
+        """Fixes a link, remembering the result for the next time the same link is fixed
+
+        Results that used an uploaded file stay valid until that file is registered again, other
+        results until any file is registered (as it might be the file the link refers to).
+
+        :param kind: Type of link: stylesheet, javascript, image or html
+        :rtype: str
+        """
+        key = (kind, link)
+        with self._lock:
+            entry = self._rewrite_cache.pop(key, None)
+            if entry is not None and entry[1] in (None, self._files_version):
+                # put it back as most recently used
+                self._rewrite_cache[key] = entry
+                self.add_dependency(link, entry[2])
+                return entry[0]
+            version = self._files_version
+        fix = {
+            "stylesheet": self.fix_stylesheet_link,
+            "javascript": self.fix_javascript_source,
+            "image": self.fix_image_link,
+            "html": self.fix_html_link,
+        }[kind]
+        result = fix(link)
+        target = self.find_actual_link(link)
+        # page links do not depend on the uploaded files
+        if kind == "html" or target is not None:
+            version = None
+        with self._lock:
+            self._rewrite_cache[key] = (result, version, target)
+            while len(self._rewrite_cache) > self.REWRITE_CACHE_SIZE:
+                self._rewrite_cache.popitem(last=False)
+        self.add_dependency(link, target)
         return result
 
-    def prepare_stylesheet(self, stylesheet):
-        """Inspect a stylesheet on URL's we should change"""
-        result = stylesheet
+    def add_dependency(self, link, target):
+        """Remembers that the file being prepared (in this thread) links to target, None if not uploaded"""
+        links = getattr(self._local, "links", None)
+        if links is not None:
+            links[link] = target
+
+    def prepare_stylesheet(self, stylesheet, base=None):
+        """Inspect a stylesheet on URL's we should change
+
+        :param base: Title of the stylesheet (or page), used to resolve relative references
+        """
+        rewriter = IGemCssRewriter(lambda kind, link: self.fix_css_link(kind, link, base=base))
+        return rewriter.rewrite(stylesheet)
+
+    def fix_css_link(self, kind, link, base=None):
+        """Fixes an url(...) or @import reference in a stylesheet
+
+        Relative references are resolved against the title of the stylesheet, which mirrors its path.
+
+        :param kind: import or url
+        :return: The new reference or None to keep it
+        """
+        result = None
+        parts = urlparse(link)
+        # leave data URIs, fragments and references without a path alone
+        if parts.scheme not in ("", "http", "https") or parts.path == "":
+            return result
+        path = parts.path
+        if parts.netloc == "" and not path.startswith("/") and base is not None:
+            path = posixpath.normpath(posixpath.join(posixpath.dirname(base), path))
+        # look up the file without query (e.g. ?v=1.0) or fragment
+        target = urlunparse((parts.scheme, parts.netloc, path, parts.params, "", ""))
+        if kind == "import":
+            result = self.rewrite_link("stylesheet", target)
+        else:
+            result = self.rewrite_link("image", target)
+            if parts.query != "":
+                result += "&" if "?" in result else "?"
+                result += parts.query
+            if parts.fragment != "":
+                result += "#" + parts.fragment
+        if result != link:
+            self.get_logger().debug("Changed stylesheet {} {} to {}".format(kind, link, result))
         return result
 
     def prepare_javascript(self, script):
@@ -442,30 +1631,20 @@ class IGemUploader(BaseIGemWikiManager):
         return url
 
     def find_actual_link(self, fn):
-        """Searches through the uploaded files list to get the actual link of the files
+        """Looks up the uploaded file a link or source refers to
 
         This can be a link or an source but will always return the actual destination
+
+        :rtype: IGemFile | None
         """
-        url = self.prefix_title(fn)
         result = None
-
-        def is_match(f):
-            matches_names = fn in (f.destination, f.path, f.full_path, f.url)
-            matches_paths = fn.strip("./") in (
-                f.destination.strip("./"), f.path.strip("./"), f.full_path.strip("./"), f.url.strip("./")
-            )
-            matches_url = url in (f.destination, f.url)
-            return matches_names or matches_paths or matches_url
-
-        matches = filter(is_match, self.uploaded_files)
-        if len(matches) > 0:
-            self.get_logger().debug("Matched {} to:\n{}".format(fn, [str(m) for m in matches]))
-            match = matches[0]
-            result = match
+        for key in (fn, fn.strip("./"), self.prefix_title(fn)):
+            result = self._files_index.get(key)
+            if result is not None:
+                self.get_logger().debug("Matched {} to: {}".format(fn, result))
+                break
         return result
 
-
-
     @classmethod
     def create_parser(cls, parser=None):
         parser = super(IGemUploader, cls).create_parser(parser)
@@ -473,6 +1652,25 @@ class IGemUploader(BaseIGemWikiManager):
         parser.add_argument(
             '--strip', action="store_true", help="Remove pattern from filename", default=None
         )
+        parser.add_argument(
+            '--bundle', action="store_true", default=None,
+            help="Combine the stylesheets and scripts included by each page into one of each"
+        )
+        parser.add_argument(
+            '--manifest', help="Location of the manifest used to skip files that did not change since the last upload"
+        )
+        parser.add_argument(
+            '--include', action="append",
+            help="Only collect files matching this pattern (e.g. '*.html'), can be given more than once"
+        )
+        parser.add_argument(
+            '--exclude', action="append",
+            help="Skip files and directories matching this pattern (e.g. '*.map'), can be given more than once"
+        )
+        parser.add_argument(
+            '--force', action="store_true", default=None,
+            help="Upload all files, even those that did not change according to the manifest"
+        )
         return parser
 
     def parse_arguments(self, arguments):
@@ -480,6 +1678,21 @@ class IGemUploader(BaseIGemWikiManager):
         do_strip = arguments.get("strip")
         if do_strip is not None:
             self.set_strip(self.parse_bool(do_strip))
+        do_bundle = arguments.get("bundle")
+        if do_bundle is not None:
+            self.set_bundle(self.parse_bool(do_bundle))
+        manifest = arguments.get("manifest")
+        if manifest is not None:
+            self.use_manifest(manifest)
+        force = arguments.get("force")
+        if force is not None:
+            self.set_force(self.parse_bool(force))
+        include = arguments.get("include")
+        if include is not None:
+            self.set_include(include)
+        exclude = arguments.get("exclude")
+        if exclude is not None:
+            self.set_exclude(exclude)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,731 @@
+"""Tests of igem_manager.py, HTTP is tested against an in-process mock wiki"""
+
+from email.parser import BytesParser
+from igem_batch import IGemBatchJob, run_batch
+from igem_manager import BaseIGemWikiManager, IGemChunkSizer, IGemDigestCache, IGemFilePart, \
+    IGemMultipartEncoder, IGemRequestsTransport, IGemResponse, IGemTransportError, IGemUploadJournal, \
+    IGemWikiManager, batched
+from igem_mock_server import IGemMockServer
+import contextlib
+import hashlib
+import igem_daemon
+import igem_manager
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+__author__ = "Joeri Jongbloets <joeri@jongbloets.net>"
+
+
+class MockWikiTestCase(unittest.TestCase):
+    """Runs a manager against a mock wiki of its own"""
+
+    def setUp(self):
+        self.server = IGemMockServer(("127.0.0.1", 0), users={"test": "test"}).start()
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.folder)
+
+    def create_page(self, title, text="text"):
+        self.server.wiki.action_edit({"title": title, "text": text}, None, None)
+
+    def create_manager(self, **arguments):
+        settings = {
+            "api_url": self.server.api_url, "login_url": self.server.login_url, "username": "test",
+            "password": "test", "quiet": True, "files": [""],
+        }
+        settings.update(arguments)
+        manager = IGemWikiManager(team="Test", year=2017)
+        manager.parse_arguments(settings)
+        self.addCleanup(manager.close)
+        return manager
+
+    @staticmethod
+    def run_action(manager, action):
+        """Runs the action and returns what it printed"""
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            manager.execute(action)
+        return output.getvalue()
+
+
+class TestBatched(unittest.TestCase):
+
+    def test_batches(self):
+        self.assertEqual(list(batched(range(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+
+    def test_exact_batches(self):
+        self.assertEqual(list(batched(range(4), 2)), [[0, 1], [2, 3]])
+
+    def test_empty(self):
+        self.assertEqual(list(batched([], 50)), [])
+
+    def test_generator(self):
+        # items are only taken when the next batch is needed
+        taken = []
+
+        def items():
+            for i in range(5):
+                taken.append(i)
+                yield i
+
+        batches = batched(items(), 2)
+        self.assertEqual(next(batches), [0, 1])
+        self.assertEqual(taken, [0, 1])
+
+
+class TestContinuePagination(unittest.TestCase):
+
+    TITLES = ["Team:Test/page{}".format(i) for i in range(7)]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = IGemMockServer(("127.0.0.1", 0), users={"test": "test"}).start()
+        for title in cls.TITLES + ["Team:Other/page"]:
+            cls.server.wiki.action_edit({"title": title, "text": "text"}, None, None)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.manager = BaseIGemWikiManager(team="Test", year=2017)
+        self.manager.parse_arguments({"api_url": self.server.api_url, "login_url": self.server.login_url})
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_all_batches(self):
+        start = self.server.requests
+        pages = self.manager.page_search("", limit=2)
+        self.assertEqual([page["title"] for page in pages], self.TITLES)
+        # 7 titles in batches of 2
+        self.assertEqual(self.server.requests - start, 4)
+
+    def test_one_batch(self):
+        start = self.server.requests
+        pages = self.manager.page_search("")
+        self.assertEqual(len(pages), len(self.TITLES))
+        self.assertEqual(self.server.requests - start, 1)
+
+    def test_lazy(self):
+        start = self.server.requests
+        pages = self.manager.iter_pages("", limit=2)
+        self.assertEqual(next(pages)["title"], self.TITLES[0])
+        self.assertEqual(next(pages)["title"], self.TITLES[1])
+        self.assertEqual(self.server.requests - start, 1)
+        # the next batch is only requested when needed
+        self.assertEqual(next(pages)["title"], self.TITLES[2])
+        self.assertEqual(self.server.requests - start, 2)
+
+    def test_prefix(self):
+        pages = self.manager.page_search("page1")
+        self.assertEqual([page["title"] for page in pages], ["Team:Test/page1"])
+
+
+class TestIGemUploadJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.location = os.path.join(self.folder, "journal.json")
+        self.source = os.path.join(self.folder, "movie.mp4")
+        with open(self.source, "wb") as dst:
+            dst.write(b"0" * 1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_resume(self):
+        journal = IGemUploadJournal(self.location)
+        journal.record("Team:Test/movie.mp4", self.source, "key", 512)
+        # entries are saved right away, so they survive an interruption
+        journal = IGemUploadJournal(self.location).load()
+        self.assertEqual(journal.resume("Team:Test/movie.mp4", self.source), {"filekey": "key", "offset": 512})
+
+    def test_unknown(self):
+        journal = IGemUploadJournal(self.location)
+        self.assertEqual(journal.resume("Team:Test/movie.mp4", self.source), {})
+
+    def test_changed_source(self):
+        journal = IGemUploadJournal(self.location)
+        journal.record("Team:Test/movie.mp4", self.source, "key", 512)
+        with open(self.source, "ab") as dst:
+            dst.write(b"1")
+        self.assertEqual(journal.resume("Team:Test/movie.mp4", self.source), {})
+
+    def test_other_source(self):
+        journal = IGemUploadJournal(self.location)
+        journal.record("Team:Test/movie.mp4", self.source, "key", 512)
+        other = os.path.join(self.folder, "other.mp4")
+        shutil.copy2(self.source, other)
+        self.assertEqual(journal.resume("Team:Test/movie.mp4", other), {})
+
+    def test_expired(self):
+        journal = IGemUploadJournal(self.location)
+        journal.record("Team:Test/movie.mp4", self.source, "key", 512)
+        entry = journal.get("Team:Test/movie.mp4")
+        entry["time"] = time.time() - IGemUploadJournal.MAX_AGE - 1
+        journal.set("Team:Test/movie.mp4", entry)
+        self.assertEqual(journal.resume("Team:Test/movie.mp4", self.source), {})
+
+    def test_forget(self):
+        journal = IGemUploadJournal(self.location)
+        journal.record("Team:Test/movie.mp4", self.source, "key", 512)
+        journal.forget("Team:Test/movie.mp4")
+        journal = IGemUploadJournal(self.location).load()
+        self.assertEqual(journal.resume("Team:Test/movie.mp4", self.source), {})
+
+
+class TestRequestsTransport(MockWikiTestCase):
+
+    def create_transport(self, pool_size=4):
+        transport = IGemRequestsTransport(pool_size=pool_size)
+        self.addCleanup(transport.close)
+        return transport
+
+    def query(self, title):
+        return "GET", self.server.api_url, {"params": {"action": "query", "titles": title, "format": "json"}}
+
+    @staticmethod
+    def titles(response):
+        return [page["title"] for page in response.json()["query"]["pages"].values()]
+
+    def test_request_many(self):
+        titles = ["Team:Test/page{}".format(i) for i in range(10)]
+        responses = self.create_transport().request_many([self.query(title) for title in titles])
+        # in the order of the calls
+        self.assertEqual([self.titles(r) for r in responses], [[title] for title in titles])
+
+    def test_failed(self):
+        calls = [self.query("Team:Test/a"), ("GET", "http://127.0.0.1:1/api.php", {}), self.query("Team:Test/b")]
+        responses = self.create_transport().request_many(calls)
+        self.assertIsInstance(responses[1], IGemTransportError)
+        self.assertEqual(self.titles(responses[2]), ["Team:Test/b"])
+
+    def test_fork(self):
+        transport = self.create_transport()
+        fork = transport.fork()
+        response = fork.request("POST", self.server.login_url, data={"username": "test", "password": "test"})
+        self.assertTrue(response.url.endswith("Login_Confirmed"))
+        # the fork has its own cookies
+        self.assertEqual(len(fork.get_cookies()), 1)
+        self.assertEqual(transport.get_cookies(), [])
+        # closing the fork leaves the shared connections open
+        fork.close()
+        method, url, kwargs = self.query("Team:Test/a")
+        self.assertEqual(self.titles(transport.request(method, url, **kwargs)), ["Team:Test/a"])
+
+
+class TestAsyncioTransport(TestRequestsTransport):
+
+    def create_transport(self, pool_size=4):
+        try:
+            from igem_async import IGemAsyncioTransport
+            transport = IGemAsyncioTransport(pool_size=pool_size)
+        except ImportError as e:
+            self.skipTest(str(e))
+        self.addCleanup(transport.close)
+        return transport
+
+
+class TestRetries(MockWikiTestCase):
+
+    def setUp(self):
+        super(TestRetries, self).setUp()
+        # the first requests are refused, the mock wiki asks to retry after 1 second
+        self.failures = []
+        self.server.failure = lambda: self.failures.pop(0) if len(self.failures) > 0 else None
+        self.manager = self.create_manager(jobs=4)
+        self.manager.BACKOFF_BASE = 0.01
+
+    def test_retried(self):
+        self.create_page("Team:Test/page")
+        self.failures = ["maxlag", "unavailable"]
+        self.assertEqual([page["title"] for page in self.manager.page_search("")], ["Team:Test/page"])
+        self.assertEqual(self.manager.throttle.retries, 2)
+        self.assertGreaterEqual(self.manager.throttle.waited, 2.0)
+        self.assertEqual(self.manager.metrics.report()["actions"]["query"]["retries"], 2)
+
+    def test_many_resent(self):
+        digests = []
+        for i in range(4):
+            content = "file {}".format(i).encode("utf-8")
+            self.server.wiki.publish("Team-Test-{}.txt".format(i), content)
+            digests.append(hashlib.sha1(content).hexdigest())
+        # half of the requests sent at once are refused
+        self.failures = [None, "maxlag", None, "maxlag"]
+        files = self.manager.find_files(digests)
+        self.assertEqual([f["name"] for f in files], ["Team-Test-{}.txt".format(i) for i in range(4)])
+        # waited once for all refused requests, and sends fewer requests at once
+        self.assertEqual(self.manager.throttle.retries, 1)
+        self.assertLess(self.manager.throttle.limit, self.manager.throttle.maximum)
+        self.assertEqual(self.manager.metrics.report()["actions"]["query"]["retries"], 2)
+
+    def test_retry_delay(self):
+        busy = IGemResponse(429, self.server.api_url, {"Retry-After": "3"}, b"")
+        self.assertEqual(self.manager.get_retry_delay(busy, 0), 3.0)
+        ok = IGemResponse(200, self.server.api_url, {}, b'{"query": {}}')
+        self.assertIsNone(self.manager.get_retry_delay(ok, 0))
+        # without a response: exponential backoff with jitter
+        delay = self.manager.get_retry_delay(None, 3)
+        self.assertTrue(0.04 <= delay <= 0.08, delay)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(BaseIGemWikiManager.parse_retry_after("120"), 120.0)
+        self.assertIsNone(BaseIGemWikiManager.parse_retry_after(None))
+        self.assertEqual(BaseIGemWikiManager.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+
+
+class TestMetrics(MockWikiTestCase):
+
+    def test_report(self):
+        self.create_page("Team:Test/page")
+        manager = self.create_manager(
+            report=os.path.join(self.folder, "report.json"), prometheus=os.path.join(self.folder, "report.prom")
+        )
+        start = self.server.requests
+        manager.page_search("")
+        manager.page_search("page")
+        manager.save_report()
+        with open(os.path.join(self.folder, "report.json")) as src:
+            report = json.load(src)
+        self.assertEqual(report["requests"], self.server.requests - start)
+        self.assertEqual(report["actions"]["query"]["statuses"], {"200": 2})
+        self.assertEqual(report["actions"]["query"]["histogram"][-1], {"le": "+Inf", "count": 2})
+        self.assertGreater(report["actions"]["query"]["bytes_received"], 0)
+        with open(os.path.join(self.folder, "report.prom")) as src:
+            prometheus = src.read()
+        self.assertIn('igem_http_requests_total{action="query",status="200"} 2\n', prometheus)
+        self.assertIn('igem_http_request_duration_seconds_count{action="query"} 2\n', prometheus)
+
+    def test_slowest_files(self):
+        manager = self.create_manager()
+        for i in range(15):
+            manager.metrics.record_file("file{}".format(i), i, size=i * 10)
+        files = manager.metrics.report()["slowest_files"]
+        self.assertEqual([f["name"] for f in files], ["file{}".format(i) for i in range(14, 4, -1)])
+
+
+class TestDeletePages(MockWikiTestCase):
+
+    TITLES = ["Team:Test/page{}".format(i) for i in range(6)]
+
+    def setUp(self):
+        super(TestDeletePages, self).setUp()
+        for title in self.TITLES + ["Team:Other/page"]:
+            self.create_page(title)
+        self.questions = []
+        self.ask_confirm = igem_manager.ask_confirm
+        igem_manager.ask_confirm = lambda question, max_attempts=1: self.questions.append(question) or self.confirm
+
+    def tearDown(self):
+        igem_manager.ask_confirm = self.ask_confirm
+        super(TestDeletePages, self).tearDown()
+
+    def test_delete_pages(self):
+        manager = self.create_manager(jobs=4)
+        self.assertTrue(manager.login())
+        results = manager.delete_pages(self.TITLES + ["Team:Test/missing"])
+        self.assertEqual(results, [(title, None) for title in self.TITLES] + [("Team:Test/missing", "missingtitle")])
+        self.assertEqual(sorted(self.server.wiki._pages), ["Team:Other/page"])
+
+    def test_confirm_once(self):
+        self.confirm = True
+        output = self.run_action(self.create_manager(quiet=False), "delete")
+        self.assertEqual(self.questions, ["Do you really want to DELETE these 6 pages?"])
+        self.assertIn("## Deleted 6 of 6 pages", output)
+        self.assertEqual(sorted(self.server.wiki._pages), ["Team:Other/page"])
+
+    def test_refused(self):
+        self.confirm = False
+        self.run_action(self.create_manager(quiet=False), "delete")
+        self.assertEqual(len(self.questions), 1)
+        self.assertEqual(len(self.server.wiki._pages), 7)
+
+
+class TestTitleIndex(MockWikiTestCase):
+
+    def setUp(self):
+        super(TestTitleIndex, self).setUp()
+        self.location = os.path.join(self.folder, "index.json")
+        for title in ("Team:Test/a", "Team:Test/b", "Team:Other/c"):
+            self.create_page(title)
+
+    def search(self, prefix=""):
+        manager = self.create_manager(index=self.location)
+        start = self.server.requests
+        titles = [page["title"] for page in manager.page_search(prefix)]
+        manager.title_index.save()
+        return titles, self.server.requests - start
+
+    def test_listed_once(self):
+        self.assertEqual(self.search(), (["Team:Test/a", "Team:Test/b"], 1))
+        # the next run only asks for the recent changes
+        self.create_page("Team:Test/c")
+        self.create_page("Team:Other/d")
+        self.server.wiki.action_delete({"title": "Team:Test/a"}, None, None)
+        self.assertEqual(self.search(), (["Team:Test/b", "Team:Test/c"], 1))
+
+    def test_prefix(self):
+        self.search()
+        self.assertEqual(self.search("b"), (["Team:Test/b"], 1))
+
+    def test_own_changes(self):
+        manager = self.create_manager(index=self.location)
+        manager.page_search("")
+        self.assertTrue(manager.login())
+        manager.edit("new", "text")
+        manager.delete_page("Team:Test/a")
+        # the changes are known without asking the wiki
+        start = self.server.requests
+        self.assertEqual([page["title"] for page in manager.page_search("")], ["Team:Test/b", "Team:Test/new"])
+        self.assertEqual(self.server.requests, start)
+
+
+class TestPull(MockWikiTestCase):
+
+    def setUp(self):
+        super(TestPull, self).setUp()
+        self.output = os.path.join(self.folder, "wiki")
+        self.create_page("Team:Test/index", "index " * 20)
+        self.create_page("Team:Test/about/team", "team " * 20)
+        self.create_page("Team:Test/contact", "contact " * 20)
+        self.create_page("Team:Other/index")
+        self.server.wiki.publish("Team-Test-logo.png", b"logo")
+
+    def pull(self):
+        return self.run_action(self.create_manager(output=self.output), "pull")
+
+    def read(self, *parts):
+        with open(os.path.join(self.output, *parts), "rb") as src:
+            return src.read()
+
+    def test_pull(self):
+        output = self.pull()
+        self.assertIn("## Pulled 3 of 3 pages (0 unchanged, 0 failed)", output)
+        self.assertIn("## Downloaded 1 of 1 changed files", output)
+        self.assertEqual(self.read("Team", "Test", "index.wiki"), ("index " * 20).strip().encode("utf-8"))
+        self.assertEqual(self.read("Team", "Test", "about", "team.wiki"), ("team " * 20).strip().encode("utf-8"))
+        self.assertEqual(self.read("File", "Team-Test-logo.png"), b"logo")
+        self.assertFalse(os.path.exists(os.path.join(self.output, "Team", "Other")))
+
+    def test_unchanged(self):
+        self.pull()
+        self.create_page("Team:Test/contact", "changed")
+        output = self.pull()
+        self.assertIn("## Pulled 1 of 3 pages (2 unchanged, 0 failed)", output)
+        self.assertIn("## Downloaded 0 of 0 changed files", output)
+        self.assertEqual(self.read("Team", "Test", "contact.wiki"), b"changed")
+
+    def test_truncated(self):
+        # the wiki leaves pages out of a response that would be too large
+        self.server.wiki.MAX_RESULT_SIZE = 200
+        output = self.pull()
+        self.assertIn("## Pulled 3 of 3 pages (0 unchanged, 0 failed)", output)
+        self.assertEqual(self.read("Team", "Test", "contact.wiki"), ("contact " * 20).strip().encode("utf-8"))
+
+    def test_failed(self):
+        # even on its own the page is too large
+        self.server.wiki.MAX_RESULT_SIZE = 150
+        output = self.pull()
+        self.assertIn("## Pulled 2 of 3 pages (0 unchanged, 1 failed)", output)
+        self.assertIn("  FAILED   Team:Test/contact", output)
+
+
+class TestSessionCache(MockWikiTestCase):
+
+    def setUp(self):
+        super(TestSessionCache, self).setUp()
+        self.location = os.path.join(self.folder, "session.json")
+
+    def login(self):
+        manager = self.create_manager(session=self.location)
+        start = self.server.requests
+        self.assertTrue(manager.login())
+        return manager, self.server.requests - start
+
+    def test_resume(self):
+        first, requests = self.login()
+        self.assertEqual(oct(os.stat(self.location).st_mode & 0o777), oct(0o600))
+        second, requests = self.login()
+        # one request checks the session and gets the token
+        self.assertEqual(requests, 1)
+        self.assertEqual(second.token, first.token)
+
+    def test_expired(self):
+        first, requests = self.login()
+        self.server.wiki._sessions.clear()
+        second, requests = self.login()
+        # checked, then logged in again
+        self.assertGreater(requests, 1)
+        self.assertNotEqual(second.token, first.token)
+        self.assertEqual(self.login()[0].token, second.token)
+
+    def test_renew(self):
+        manager, requests = self.login()
+        # the session expires during the run
+        self.server.wiki._sessions.clear()
+        self.assertTrue(manager.edit("page", "text"))
+        self.assertEqual(self.server.wiki._pages["Team:Test/page"]["text"], "text")
+        self.assertEqual(self.login()[0].token, manager.token)
+
+
+class TestDaemon(MockWikiTestCase):
+
+    def setUp(self):
+        super(TestDaemon, self).setUp()
+        self.create_page("Team:Test/index")
+        self.socket = os.path.join(self.folder, "daemon.sock")
+        ini = os.path.join(self.folder, "igem.ini")
+        with open(ini, "w") as dst:
+            dst.write("[igem]\nteam = Test\nyear = 2017\nusername = test\npassword = test\n")
+            dst.write("api_url = {}\nlogin_url = {}\n".format(self.server.api_url, self.server.login_url))
+        script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "igem_daemon.py")
+        self.daemon = subprocess.Popen(
+            [sys.executable, script, "serve", "--socket", self.socket, "--ini", ini],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.time() + 10
+        while not os.path.exists(self.socket) and time.time() < deadline:
+            time.sleep(0.05)
+
+    def tearDown(self):
+        if self.daemon.poll() is None:
+            self.daemon.kill()
+        self.daemon.wait()
+        super(TestDaemon, self).tearDown()
+
+    def send(self, *arguments):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            code = igem_daemon.send_command({"arguments": list(arguments), "cwd": self.folder}, self.socket)
+        return code, output.getvalue()
+
+    def test_commands(self):
+        code, output = self.send("search", "")
+        self.assertEqual(code, 0)
+        self.assertIn("## Pages starting with 'Team:Test':", output)
+        self.assertIn("Team:Test/index", output)
+        # the next command continues the session of the daemon
+        start = self.server.requests
+        code, output = self.send("-q", "delete", "index")
+        self.assertIn("## Deleted 1 of 1 pages", output)
+        self.assertEqual(self.server.requests - start, 2)
+
+    def test_watch(self):
+        code, output = self.send("watch", "site/*")
+        self.assertEqual(code, 2)
+        self.assertIn("The daemon cannot watch", output)
+
+    def test_stop(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(igem_daemon.send_command({"stop": True}, self.socket), 0)
+        self.assertEqual(self.daemon.wait(10), 0)
+        self.assertFalse(os.path.exists(self.socket))
+
+
+class TestMultipartEncoder(MockWikiTestCase):
+
+    def setUp(self):
+        super(TestMultipartEncoder, self).setUp()
+        self.location = os.path.join(self.folder, "movie.mp4")
+        with open(self.location, "wb") as dst:
+            dst.write(os.urandom(300 * 1024))
+
+    def test_body(self):
+        encoder = IGemMultipartEncoder(
+            {"action": "upload", "comment": None},
+            {"chunk": ("movie.mp4", IGemFilePart(self.location, offset=1000, length=100 * 1024), "video/mp4")}
+        )
+        body = b"".join(encoder)
+        self.assertEqual(len(body), len(encoder))
+        # can be send again
+        self.assertEqual(b"".join(encoder), body)
+        message = BytesParser().parsebytes(
+            "Content-Type: {}\r\n\r\n".format(encoder.content_type).encode("utf-8") + body
+        )
+        parts = dict((part.get_param("name", header="content-disposition"), part) for part in message.get_payload())
+        self.assertEqual(sorted(parts), ["action", "chunk"])
+        self.assertEqual(parts["action"].get_payload(decode=True), b"upload")
+        self.assertEqual(parts["chunk"].get_filename(), "movie.mp4")
+        with open(self.location, "rb") as src:
+            self.assertEqual(parts["chunk"].get_payload(decode=True), src.read()[1000:1000 + 100 * 1024])
+
+    def test_blocks(self):
+        part = IGemFilePart(self.location, offset=10)
+        blocks = list(part.iter_blocks(block_size=64 * 1024))
+        self.assertEqual(len(part), 300 * 1024 - 10)
+        self.assertEqual(max(len(block) for block in blocks), 64 * 1024)
+
+    def test_upload(self):
+        manager = self.create_manager()
+        self.assertTrue(manager.login())
+        # one request, and in chunks
+        self.assertTrue(manager.upload("movie.mp4", self.location)["result"])
+        self.assertTrue(manager.upload("movie2.mp4", self.location, chunk_size=100 * 1024)["result"])
+        with open(self.location, "rb") as src:
+            content = src.read()
+        self.assertEqual(self.server.wiki.download("Team-Test-movie.mp4")[0], content)
+        self.assertEqual(self.server.wiki.download("Team-Test-movie2.mp4")[0], content)
+
+
+class TestIGemChunkSizer(unittest.TestCase):
+
+    MB = 1024 * 1024
+
+    def create_sizer(self, size=MB):
+        return IGemChunkSizer(size, minimum=self.MB // 4, maximum=32 * self.MB, target=2.0)
+
+    def test_grows_at_most_double(self):
+        sizer = self.create_sizer()
+        # 100 MB/s would allow chunks of 200 MB
+        sizer.sent(self.MB, 0.01)
+        self.assertEqual(sizer.size, 2 * self.MB)
+        sizer.sent(2 * self.MB, 0.02)
+        self.assertEqual(sizer.size, 4 * self.MB)
+
+    def test_maximum(self):
+        sizer = self.create_sizer(16 * self.MB)
+        for _ in range(5):
+            sizer.sent(sizer.size, 0.01)
+        self.assertEqual(sizer.size, 32 * self.MB)
+
+    def test_shrinks_when_slow(self):
+        sizer = self.create_sizer(4 * self.MB)
+        # 0.5 MB/s, so 2 seconds fit 1 MB, but it shrinks at most by half per chunk
+        sizer.sent(4 * self.MB, 8.0)
+        self.assertEqual(sizer.size, 2 * self.MB)
+
+    def test_failed(self):
+        sizer = self.create_sizer()
+        sizer.failed()
+        self.assertEqual(sizer.size, self.MB // 2)
+        for _ in range(5):
+            sizer.failed()
+        self.assertEqual(sizer.size, self.MB // 4)
+
+    def test_last_chunk_ignored(self):
+        sizer = self.create_sizer()
+        sizer.sent(1000, 1.0)
+        self.assertIsNone(sizer.rate)
+        self.assertEqual(sizer.size, self.MB)
+
+    def test_steps(self):
+        sizer = self.create_sizer()
+        # 2 seconds fit 1.33 MB, rounded down to 21 steps of 64 KB
+        sizer.sent(self.MB, 1.5)
+        self.assertEqual(sizer.size, 21 * IGemChunkSizer.STEP)
+
+    def test_fixed(self):
+        sizer = IGemChunkSizer(self.MB, adaptive=False)
+        sizer.sent(self.MB, 0.01)
+        sizer.failed()
+        self.assertEqual(sizer.size, self.MB)
+        self.assertIsNotNone(sizer.rate)
+
+
+class TestIGemDigestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.location = os.path.join(self.folder, "logo.png")
+        with open(self.location, "wb") as dst:
+            dst.write(b"logo")
+        self.reads = []
+        self.sha1_file = igem_manager.sha1_file
+
+        def sha1_file(path):
+            self.reads.append(path)
+            return self.sha1_file(path)
+
+        igem_manager.sha1_file = sha1_file
+
+    def tearDown(self):
+        igem_manager.sha1_file = self.sha1_file
+        shutil.rmtree(self.folder)
+
+    def test_digest(self):
+        cache = IGemDigestCache()
+        self.assertEqual(cache.digest(self.location), hashlib.sha1(b"logo").hexdigest())
+
+    def test_read_once(self):
+        cache = IGemDigestCache()
+        cache.digest(self.location)
+        # the same file by another path
+        cache.digest(os.path.join(self.folder, ".", "logo.png"))
+        self.assertEqual(len(self.reads), 1)
+        self.assertEqual(len(cache), 1)
+
+    def test_changed(self):
+        cache = IGemDigestCache()
+        cache.digest(self.location)
+        with open(self.location, "ab") as dst:
+            dst.write(b"!")
+        self.assertEqual(cache.digest(self.location), hashlib.sha1(b"logo!").hexdigest())
+        self.assertEqual(len(self.reads), 2)
+
+
+class TestBatchRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        # every edition has a wiki of its own
+        self.servers = {}
+        for year in ("2017", "2018"):
+            self.servers[year] = IGemMockServer(("127.0.0.1", 0), users={"test": "test"}).start()
+        self.get_api_url = BaseIGemWikiManager.get_api_url
+        servers, get_api_url = self.servers, self.get_api_url
+        BaseIGemWikiManager.get_api_url = lambda manager: (
+            servers[str(manager.year)].api_url if str(manager.year) in servers else get_api_url(manager)
+        )
+
+    def tearDown(self):
+        BaseIGemWikiManager.get_api_url = self.get_api_url
+        for server in self.servers.values():
+            server.stop()
+        shutil.rmtree(self.folder)
+
+    def create_job(self, team, year):
+        site = os.path.join(self.folder, team)
+        os.makedirs(site)
+        with open(os.path.join(site, "index.html"), "w") as dst:
+            dst.write("<p>{} {}</p>".format(team, year))
+        return IGemBatchJob("{}-{}".format(team, year), {
+            "team": team, "year": year, "username": "test", "password": "test", "strip": "1",
+            "login_url": self.servers[year].login_url, "files": os.path.join(site, "*"),
+        })
+
+    def test_editions(self):
+        jobs = [self.create_job("A", "2017"), self.create_job("B", "2018"), self.create_job("C", "2017")]
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_batch(jobs)
+        self.assertEqual([job.error for job in jobs], [None, None, None])
+        # each job uploads to the wiki of its edition
+        self.assertEqual(sorted(self.servers["2017"].wiki._pages), ["Team:A/index", "Team:C/index"])
+        self.assertEqual(sorted(self.servers["2018"].wiki._pages), ["Team:B/index"])
+        self.assertEqual(self.servers["2018"].wiki._pages["Team:B/index"]["text"], "<p>B 2018</p>")
+        # the jobs of the same user on the same wiki share one login
+        self.assertEqual(len(self.servers["2017"].wiki._sessions), 1)
+        self.assertEqual(len(self.servers["2018"].wiki._sessions), 1)
+
+    def test_api_url(self):
+        # unless the settings point the job to another wiki
+        job = self.create_job("A", "2018")
+        job.settings["api_url"] = self.servers["2017"].api_url
+        job.settings["login_url"] = self.servers["2017"].login_url
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_batch([job])
+        self.assertEqual(sorted(self.servers["2017"].wiki._pages), ["Team:A/index"])
+        self.assertEqual(self.servers["2018"].wiki._pages, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
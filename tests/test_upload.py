@@ -0,0 +1,575 @@
+"""Tests of igem_upload.py, uploads are tested against an in-process mock wiki"""
+
+from igem_mock_server import IGemMockServer
+from igem_upload import IGemBundle, IGemCssRewriter, IGemFile, IGemHtmlRewriter, IGemManifest, IGemUploader
+import contextlib
+import igem_upload
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+__author__ = "Joeri Jongbloets <joeri@jongbloets.net>"
+
+
+class MockWikiTestCase(unittest.TestCase):
+    """Uploads a site in a temporary directory to a mock wiki of its own"""
+
+    def setUp(self):
+        self.server = IGemMockServer(("127.0.0.1", 0), users={"test": "test"}).start()
+        self.folder = tempfile.mkdtemp()
+        self.site = os.path.join(self.folder, "site")
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.folder)
+
+    def create_file(self, name, content, site=None):
+        location = os.path.join(site or self.site, name)
+        if not os.path.exists(os.path.dirname(location)):
+            os.makedirs(os.path.dirname(location))
+        with open(location, "wb") as dst:
+            dst.write(content if isinstance(content, bytes) else content.encode("utf-8"))
+        return location
+
+    def create_uploader(self, site=None, **arguments):
+        settings = {
+            "api_url": self.server.api_url, "login_url": self.server.login_url, "username": "test",
+            "password": "test", "quiet": True, "strip": True, "files": [os.path.join(site or self.site, "*")],
+        }
+        settings.update(arguments)
+        uploader = IGemUploader(team="Test", year=2017)
+        uploader.parse_arguments(settings)
+        self.addCleanup(uploader.close)
+        return uploader
+
+    @staticmethod
+    def run_action(uploader, action="upload"):
+        """Runs the action and returns what it printed"""
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            uploader.execute(action)
+        return output.getvalue()
+
+    def page(self, title):
+        """Text of a page of the team on the mock wiki, None if there is no such page"""
+        return self.server.wiki._pages.get("Team:Test/{}".format(title), {}).get("text")
+
+    def file_url(self, name):
+        return self.server.wiki.file_url("Team-Test-{}".format(name.replace("/", "-")))
+
+
+class TestUploadFiles(MockWikiTestCase):
+
+    def setUp(self):
+        super(TestUploadFiles, self).setUp()
+        self.create_file("index.html", (
+            '<link rel="stylesheet" href="style.css"><script src="app.js"></script>'
+            '<img src="img/logo.png"><a href="about.html">about</a>'
+        ))
+        self.create_file("about.html", '<img src="./img/photo.jpg">')
+        self.create_file("style.css", 'body { background: url(img/logo.png) }')
+        self.create_file("app.js", 'var a = 1;')
+        self.create_file("img/logo.png", b"logo")
+        self.create_file("img/photo.jpg", b"photo")
+
+    def check_site(self):
+        self.assertEqual(self.server.wiki.download("Team-Test-img-logo.png")[0], b"logo")
+        self.assertEqual(self.server.wiki.download("Team-Test-img-photo.jpg")[0], b"photo")
+        self.assertEqual(self.page("style"), "body { background: url(" + self.file_url("img/logo.png") + ") }")
+        self.assertEqual(self.page("app.js"), 'var a = 1;')
+        # resources are uploaded before the pages, so the pages link to their urls
+        self.assertEqual(self.page("index"), (
+            '<link rel="stylesheet" href="http://2017.igem.org/Team:Test/style?action=raw&amp;ctype=text/css">'
+            '<script src="http://2017.igem.org/Team:Test/app.js?action=raw&amp;ctype=text/javascript"></script>'
+            '<img src="{}"><a href="http://2017.igem.org/Team:Test/about">about</a>'
+        ).format(self.file_url("img/logo.png")))
+        self.assertEqual(self.page("about"), '<img src="{}">'.format(self.file_url("img/photo.jpg")))
+
+    def test_upload(self):
+        uploader = self.create_uploader()
+        self.run_action(uploader)
+        self.check_site()
+        # uploaded files are no longer collected
+        self.assertEqual(len(uploader.collected_files), 0)
+        self.assertEqual(len(uploader.uploaded_files), 6)
+
+    def test_jobs(self):
+        uploader = self.create_uploader(jobs=4)
+        self.run_action(uploader)
+        self.check_site()
+        self.assertEqual(len(uploader.uploaded_files), 6)
+
+
+class TestIGemManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.location = os.path.join(self.folder, "manifest.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def create_file(self, destination="Team:Test/logo.png"):
+        f = IGemFile("logo.png", destination=destination, mime="image/png")
+        f.url = "https://2017.igem.org/wiki/images/logo.png"
+        return f
+
+    def test_find_same_content(self):
+        manifest = IGemManifest(self.location)
+        f = self.create_file()
+        manifest.record(f, "abc")
+        entry = manifest.find(f, "abc")
+        self.assertEqual(entry, {"hash": "abc", "url": f.url, "mime": "image/png"})
+
+    def test_find_changed_content(self):
+        manifest = IGemManifest(self.location)
+        f = self.create_file()
+        manifest.record(f, "abc")
+        self.assertIsNone(manifest.find(f, "def"))
+        self.assertIsNone(manifest.find(self.create_file("Team:Test/other.png"), "abc"))
+
+    def test_save_and_load(self):
+        manifest = IGemManifest(self.location)
+        f = self.create_file()
+        manifest.record(f, "abc")
+        self.assertTrue(manifest.save())
+        # nothing changed since, so nothing is written
+        self.assertFalse(manifest.save())
+        manifest = IGemManifest(self.location).load()
+        self.assertEqual(manifest.find(f, "abc")["url"], f.url)
+
+    def test_load_broken_file(self):
+        with open(self.location, "w") as dst:
+            dst.write("{not json")
+        manifest = IGemManifest(self.location).load()
+        self.assertEqual(len(manifest), 0)
+
+
+class TestSkipExisting(MockWikiTestCase):
+
+    def setUp(self):
+        super(TestSkipExisting, self).setUp()
+        self.create_file("img/logo.png", b"logo")
+        self.run_action(self.create_uploader())
+        self.other = os.path.join(self.folder, "other")
+
+    def test_same_title(self):
+        uploader = self.create_uploader()
+        self.run_action(uploader)
+        self.assertEqual([f.url for f in uploader.skipped_files], [self.file_url("img/logo.png")])
+
+    def test_other_title(self):
+        # found by its SHA1, so the page links to the file already on the wiki
+        self.create_file("images/team-logo.png", b"logo", site=self.other)
+        self.create_file("index.html", '<img src="images/team-logo.png">', site=self.other)
+        uploader = self.create_uploader(site=self.other)
+        self.run_action(uploader)
+        self.assertIsNone(self.server.wiki.download("Team-Test-images-team-logo.png"))
+        self.assertEqual(len(uploader.skipped_files), 1)
+        self.assertEqual(self.page("index"), '<img src="{}">'.format(self.file_url("img/logo.png")))
+
+    def test_changed_content(self):
+        self.create_file("img/logo.png", b"new logo", site=self.other)
+        uploader = self.create_uploader(site=self.other)
+        self.run_action(uploader)
+        self.assertEqual(self.server.wiki.download("Team-Test-img-logo.png")[0], b"new logo")
+        self.assertEqual(uploader.skipped_files, [])
+
+    def test_force(self):
+        uploader = self.create_uploader(force=True)
+        self.run_action(uploader)
+        self.assertEqual(uploader.skipped_files, [])
+        self.assertEqual(len(uploader.uploaded_files), 1)
+
+
+class TestLinkIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.uploader = IGemUploader(team="Test", year=2017)
+        self.logo = IGemFile(os.path.join("site", "img", "logo.png"), destination="images/logo.png", prefix="site")
+        self.logo.url = "http://2017.igem.org/wiki/images/logo.png"
+        self.uploader.register_file(self.logo)
+
+    def test_names(self):
+        # destination, path relative to the site, path and url
+        for link in ("images/logo.png", "img/logo.png", "./img/logo.png", "/img/logo.png", self.logo.path,
+                     self.logo.url):
+            self.assertIs(self.uploader.find_actual_link(link), self.logo, link)
+
+    def test_unknown(self):
+        self.assertIsNone(self.uploader.find_actual_link("img/other.png"))
+
+    def test_first_file_keeps_name(self):
+        other = IGemFile(os.path.join("other", "img", "logo.png"), destination="images/logo.png", prefix="other")
+        self.uploader.register_file(other)
+        self.assertIs(self.uploader.find_actual_link("images/logo.png"), self.logo)
+        self.assertIs(self.uploader.find_actual_link(other.path), other)
+
+    def test_registered_again(self):
+        # the names of the earlier registration are no longer valid
+        self.logo.destination = "img/new-logo.png"
+        self.uploader.register_file(self.logo)
+        self.assertIs(self.uploader.find_actual_link("img/new-logo.png"), self.logo)
+        self.assertIsNone(self.uploader.find_actual_link("images/logo.png"))
+
+
+class TestIGemHtmlRewriter(unittest.TestCase):
+
+    @staticmethod
+    def prefix_links(tag, attributes):
+        if "src" in attributes:
+            return {"src": "new/{}".format(attributes["src"])}
+        if tag == "a" and "href" in attributes:
+            return {"href": "new/{}".format(attributes["href"])}
+        return {}
+
+    def test_quotes(self):
+        rewriter = IGemHtmlRewriter(self.prefix_links)
+        html = '<img src="a.png" alt="a"><img src=\'b.png\'><IMG SRC=c.png>'
+        self.assertEqual(
+            rewriter.rewrite(html), '<img src="new/a.png" alt="a"><img src=\'new/b.png\'><IMG SRC="new/c.png">'
+        )
+
+    def test_keeps_text(self):
+        rewriter = IGemHtmlRewriter(self.prefix_links)
+        html = '<!DOCTYPE html>\n<p class="x">Some <b>text</b> &amp; more</p>\n'
+        self.assertEqual(rewriter.rewrite(html), html)
+
+    def test_comments(self):
+        rewriter = IGemHtmlRewriter(self.prefix_links)
+        html = '<!-- <img src="a.png"> --><a href="b.html">b</a>'
+        self.assertEqual(rewriter.rewrite(html), '<!-- <img src="a.png"> --><a href="new/b.html">b</a>')
+
+    def test_escapes(self):
+        rewriter = IGemHtmlRewriter(lambda tag, attributes: {"href": attributes["href"] + '?a=1&b="2"'})
+        html = '<a href="page.html?x=1&amp;y=2">x</a>'
+        self.assertEqual(
+            rewriter.rewrite(html), '<a href="page.html?x=1&amp;y=2?a=1&amp;b=&quot;2&quot;">x</a>'
+        )
+
+    def test_raw_text(self):
+        texts = []
+
+        def text_handler(tag, text):
+            texts.append((tag, text))
+            return text.upper()
+
+        rewriter = IGemHtmlRewriter(self.prefix_links, text_handler=text_handler)
+        html = '<script>var a = "<img src=a.png>";</script><style>p {}</style><img src="b.png">'
+        expected = '<script>VAR A = "<IMG SRC=A.PNG>";</script><style>P {}</style><img src="new/b.png">'
+        self.assertEqual(rewriter.rewrite(html), expected)
+        self.assertEqual(texts, [("script", 'var a = "<img src=a.png>";'), ("style", "p {}")])
+
+    def test_remove(self):
+        def handler(tag, attributes):
+            return None if tag in ("script", "link") else {}
+
+        rewriter = IGemHtmlRewriter(handler)
+        html = '<head><link rel="stylesheet" href="a.css"><script src="a.js"></script></head>'
+        self.assertEqual(rewriter.rewrite(html), '<head></head>')
+
+
+class TestRewriteCache(unittest.TestCase):
+
+    def setUp(self):
+        self.uploader = IGemUploader(team="Test", year=2017)
+        self.fixed = []
+        fix_image_link = self.uploader.fix_image_link
+
+        def fix(src):
+            self.fixed.append(src)
+            return fix_image_link(src)
+
+        self.uploader.fix_image_link = fix
+
+    def register(self, path, url):
+        f = IGemFile(path, destination=path)
+        f.url = url
+        self.uploader.register_file(f)
+        return f
+
+    def test_fixed_once(self):
+        self.register("logo.png", "http://2017.igem.org/wiki/images/logo.png")
+        html = '<img src="logo.png"><img src="logo.png">'
+        expected = '<img src="http://2017.igem.org/wiki/images/logo.png">' * 2
+        self.assertEqual(self.uploader.prepare_html(html), expected)
+        # the next page with the same link
+        self.assertEqual(self.uploader.prepare_html(html), expected)
+        self.assertEqual(self.fixed, ["logo.png"])
+
+    def test_new_file(self):
+        # a link that did not resolve is fixed again when a file is registered
+        self.assertEqual(self.uploader.rewrite_link("image", "logo.png"), "http://2017.igem.org/Team:Test/logo.png")
+        self.register("logo.png", "http://2017.igem.org/wiki/images/logo.png")
+        self.assertEqual(self.uploader.rewrite_link("image", "logo.png"), "http://2017.igem.org/wiki/images/logo.png")
+        self.assertEqual(self.fixed, ["logo.png", "logo.png"])
+
+    def test_new_url(self):
+        f = self.register("logo.png", "http://2017.igem.org/wiki/images/logo.png")
+        self.uploader.rewrite_link("image", "logo.png")
+        f.url = "http://2017.igem.org/wiki/images/new-logo.png"
+        self.uploader.register_file(f)
+        self.assertEqual(self.uploader.rewrite_link("image", "logo.png"), f.url)
+
+    def test_size(self):
+        self.uploader.REWRITE_CACHE_SIZE = 2
+        for name in ("a.png", "b.png", "c.png", "a.png"):
+            self.uploader.rewrite_link("html", name)
+        self.assertEqual(len(self.uploader._rewrite_cache), 2)
+
+
+class TestIGemCssRewriter(unittest.TestCase):
+
+    def test_references(self):
+        references = []
+
+        def handler(kind, reference):
+            references.append((kind, reference))
+            return "new/{}".format(reference)
+
+        stylesheet = '@import "a.css";\n@import url(b.css);\np { background: url( \'c.png\' ) }\n'
+        self.assertEqual(
+            IGemCssRewriter(handler).rewrite(stylesheet),
+            '@import "new/a.css";\n@import url(new/b.css);\np { background: url( \'new/c.png\' ) }\n'
+        )
+        self.assertEqual(references, [("import", "a.css"), ("import", "b.css"), ("url", "c.png")])
+
+    def test_comments_and_strings(self):
+        rewriter = IGemCssRewriter(lambda kind, reference: "new/{}".format(reference))
+        stylesheet = 'p { background: url(a.png) } /* url(b.png) */ q:after { content: "url(c.png)" }'
+        self.assertEqual(
+            rewriter.rewrite(stylesheet),
+            'p { background: url(new/a.png) } /* url(b.png) */ q:after { content: "url(c.png)" }'
+        )
+
+    def test_keep(self):
+        rewriter = IGemCssRewriter(lambda kind, reference: None)
+        stylesheet = 'p { background: url("data:image/png;base64,AAAA") }'
+        self.assertEqual(rewriter.rewrite(stylesheet), stylesheet)
+
+    def test_quoting(self):
+        # unquoted references that need quotes get them, quotes in quoted references are escaped
+        rewriter = IGemCssRewriter(lambda kind, reference: "a b(c).png")
+        self.assertEqual(rewriter.rewrite("p { background: url(x.png) }"), 'p { background: url("a b(c).png") }')
+        rewriter = IGemCssRewriter(lambda kind, reference: "it's.png")
+        self.assertEqual(rewriter.rewrite("p { background: url('x.png') }"), "p { background: url('it\\'s.png') }")
+
+    def test_keep_escapes(self):
+        # references kept by the handler are not touched, neither are their escapes
+        stylesheet = "p { background: url('it\\'s.png') } q { background: url(\"a\\\"b.png\") }"
+        for handler in (lambda kind, reference: None, lambda kind, reference: reference):
+            self.assertEqual(IGemCssRewriter(handler).rewrite(stylesheet), stylesheet)
+
+
+class TestBundleFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.create_file("index.html", (
+            '<link rel="stylesheet" href="css/a.css"><link rel="stylesheet" href="css/b.css">'
+            '<script src="a.js"></script><script src="b.js"></script>'
+        ))
+        self.create_file("about.html", '<link rel="stylesheet" href="css/a.css">')
+        self.create_file("css/a.css", 'p { color: red }')
+        self.create_file("css/b.css", '@import "fonts.css";\nq { color: blue }')
+        self.create_file("css/fonts.css", 'r { color: green }')
+        self.create_file("a.js", 'var a = 1')
+        self.create_file("b.js", 'var b = 2;')
+        self.uploader = IGemUploader(team="Test", year=2017)
+        self.uploader.set_strip(True)
+        self.uploader.set_bundle(True)
+        self.uploader.collect_patterns([os.path.join(self.folder, "*")])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def create_file(self, name, content):
+        location = os.path.join(self.folder, name)
+        if not os.path.exists(os.path.dirname(location)):
+            os.makedirs(os.path.dirname(location))
+        with open(location, "w") as dst:
+            dst.write(content)
+
+    def bundle(self):
+        """Returns the contents of the stylesheet and script bundle"""
+        results = {}
+        for bundle in self.uploader.bundle_files():
+            self.uploader.resolve_destination(bundle)
+            results[bundle.extension] = self.uploader.prepare_content(bundle)
+        return results["css"], results["js"]
+
+    def test_bundles(self):
+        stylesheet, script = self.bundle()
+        self.assertTrue(stylesheet.endswith("p { color: red }\nq { color: blue }"))
+        # protected against scripts without a final semicolon
+        self.assertEqual(script, 'var a = 1\n;\nvar b = 2;')
+
+    def test_collected(self):
+        self.bundle()
+        files = [f.path for f in self.uploader.collected_files if not isinstance(f, IGemBundle)]
+        # a.css is still included by about.html, fonts.css by b.css
+        self.assertEqual(sorted(os.path.relpath(path, self.folder).replace(os.sep, "/") for path in files), [
+            "about.html", "css/a.css", "css/fonts.css", "index.html",
+        ])
+
+    def test_imports_first(self):
+        stylesheet, script = self.bundle()
+        self.assertTrue(stylesheet.startswith(
+            '@import "http://2017.igem.org/Team:Test/css/fonts?action=raw&ctype=text/css";\n'
+        ))
+
+
+class TestWatchChanges(MockWikiTestCase):
+
+    def setUp(self):
+        super(TestWatchChanges, self).setUp()
+        self.index = self.create_file("index.html", '<img src="logo.png">')
+        self.about = self.create_file("about.html", '<p>about</p>')
+        self.create_file("logo.png", b"logo")
+        self.uploader = self.create_uploader()
+        self.watcher = igem_upload.IGemWatcher
+        igem_upload.IGemWatcher = self.create_watcher
+
+    def tearDown(self):
+        igem_upload.IGemWatcher = self.watcher
+        super(TestWatchChanges, self).tearDown()
+
+    def create_watcher(self, roots, interval=1.0):
+        steps = self.steps
+
+        class Watcher(object):
+            uses_inotify = False
+
+            @staticmethod
+            def wait(debounce=1.0):
+                # each step changes the site and returns the changed and removed files
+                if len(steps) == 0:
+                    raise KeyboardInterrupt()
+                return steps.pop(0)()
+
+        return Watcher()
+
+    def watch(self, *steps):
+        self.steps = list(steps)
+        return self.run_action(self.uploader, "watch")
+
+    def revision(self, title):
+        return self.server.wiki._pages["Team:Test/{}".format(title)]["revid"]
+
+    def test_changed(self):
+        revisions = {}
+
+        def change():
+            revisions["index"] = self.revision("index")
+            self.create_file("about.html", '<p>about us</p>')
+            return [self.about], []
+
+        self.watch(change)
+        self.assertEqual(self.page("about"), '<p>about us</p>')
+        self.assertEqual(self.revision("index"), revisions["index"])
+
+    def test_new_file(self):
+        def add():
+            self.create_file("team.jpg", b"team")
+            self.create_file("index.html", '<img src="team.jpg">')
+            return [self.index, os.path.join(self.site, "team.jpg")], []
+
+        self.watch(add)
+        self.assertEqual(self.server.wiki.download("Team-Test-team.jpg")[0], b"team")
+        self.assertEqual(self.page("index"), '<img src="{}">'.format(self.file_url("team.jpg")))
+
+    def test_rescan(self):
+        def add(name):
+            def step():
+                return [self.create_file(name, '<p>{}</p>'.format(name))], []
+            return step
+
+        self.watch(add("a.html"), add("b.html"), add("c.html"))
+        self.assertEqual(self.page("c"), '<p>c.html</p>')
+        # everything collected was uploaded, finding the new files did not collect the others again
+        self.assertEqual(self.uploader.collected_files, [])
+
+    def test_removed(self):
+        def remove():
+            os.remove(self.about)
+            return [], [self.about]
+
+        self.assertIn("## Removed {}".format(self.about), self.watch(remove))
+        self.assertEqual(self.page("about"), '<p>about</p>')
+
+
+class TestCollectPatterns(unittest.TestCase):
+
+    FILES = [
+        "index.html", "style.css", "app.js", "app.js.map", "img/logo.png", "img/icons/home.png",
+        "vendor/lib.js", ".hidden", ".git/config",
+    ]
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.site = os.path.join(self.folder, "site")
+        for name in self.FILES:
+            self.create_file(os.path.join(self.site, name))
+        self.uploader = IGemUploader(team="Test", year=2017)
+        self.uploader.set_strip(True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    @staticmethod
+    def create_file(location):
+        if not os.path.exists(os.path.dirname(location)):
+            os.makedirs(os.path.dirname(location))
+        with open(location, "w") as dst:
+            dst.write(location)
+
+    def collect(self, *patterns):
+        files = self.uploader.collect_patterns(list(patterns))
+        return sorted(os.path.relpath(f.path, self.folder).replace(os.sep, "/") for f in files)
+
+    def test_all(self):
+        # hidden files and directories are skipped
+        self.assertEqual(self.collect(os.path.join(self.site, "*")), [
+            "site/app.js", "site/app.js.map", "site/img/icons/home.png", "site/img/logo.png", "site/index.html",
+            "site/style.css", "site/vendor/lib.js",
+        ])
+
+    def test_exclude(self):
+        # by name, or by path relative to the pattern
+        self.uploader.set_exclude("*.map, vendor, img/icons")
+        self.assertEqual(self.collect(os.path.join(self.site, "*")), [
+            "site/app.js", "site/img/logo.png", "site/index.html", "site/style.css",
+        ])
+
+    def test_include(self):
+        self.uploader.set_include(["*.js", "*.html"])
+        self.uploader.set_exclude(["vendor"])
+        self.assertEqual(self.collect(os.path.join(self.site, "*")), ["site/app.js", "site/index.html"])
+
+    def test_include_directory_pattern(self):
+        self.uploader.set_include(["*.png"])
+        self.assertEqual(self.collect(self.site), ["site/img/icons/home.png", "site/img/logo.png"])
+
+    def test_matched_twice(self):
+        files = self.collect(os.path.join(self.site, "*.html"), os.path.join(self.site, "index.*"))
+        self.assertEqual(files, ["site/index.html"])
+
+    def test_same_file_title(self):
+        # the wiki replaces the slashes in file names, so both get File:Team-Test-img-icons-home.png
+        self.create_file(os.path.join(self.site, "img", "icons-home.png"))
+        self.uploader.set_include(["*.png"])
+        self.assertEqual(self.collect(os.path.join(self.site, "*")), [
+            "site/img/icons-home.png", "site/img/logo.png",
+        ])
+
+    def test_same_page_title(self):
+        other = os.path.join(self.folder, "other")
+        self.create_file(os.path.join(other, "index.html"))
+        files = self.collect(os.path.join(self.site, "*.html"), os.path.join(other, "*.html"))
+        self.assertEqual(files, ["site/index.html"])
+
+
+if __name__ == "__main__":
+    unittest.main()